@@ -0,0 +1,91 @@
+"""
+Measures the cost of the token authentication without and with the token cache (SRACHAT_TOKEN_CACHE_SIZE).
+
+`--users` users authenticate `--connects` times in total, round robin, through both paths:
+- websocket: `root.token_auth.get_user`, which every websocket connect awaits, `--concurrency` at the same time
+  (a connect storm, e.g. after a deploy every client reconnects)
+- rest: `CachedTokenAuthentication.authenticate_credentials`, which every REST request calls
+For each of them the script reports authentications per second, the mean cost of one and the hit rate
+of the cache from the `token_cache.*` counters of `srachat.metrics`.
+
+Usage (from the backend folder):
+    python -m benchmarks.auth_cost --users 200 --connects 5000 --concurrency 100
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.utils import print_table, setup_django, test_database
+
+
+async def connect_storm(keys, connects: int, concurrency: int):
+    from root.token_auth import get_user
+
+    async def connect_all(offset: int):
+        for i in range(offset, connects, concurrency):
+            await get_user(keys[i % len(keys)])
+
+    await asyncio.gather(*(connect_all(offset) for offset in range(concurrency)))
+
+
+def rest_requests(keys, connects: int):
+    from root.token_auth import CachedTokenAuthentication
+
+    authentication = CachedTokenAuthentication()
+    for i in range(connects):
+        authentication.authenticate_credentials(keys[i % len(keys)])
+
+
+def measure(run) -> float:
+    from root.token_auth import token_cache
+    from srachat import metrics
+
+    token_cache.clear()
+    metrics.reset()
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="users with a token")
+    parser.add_argument("--connects", type=int, default=5000, help="authentications of every path")
+    parser.add_argument("--concurrency", type=int, default=100, help="websocket connects at the same time")
+    args = parser.parse_args()
+
+    setup_django()
+    from asgiref.sync import async_to_sync
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import override_settings
+    from rest_framework.authtoken.models import Token
+    from srachat import metrics
+
+    rows = []
+    with test_database():
+        users = User.objects.bulk_create(User(username=f"user_{i}") for i in range(args.users))
+        Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in User.objects.filter(
+            username__in=[user.username for user in users]
+        ))
+        keys = list(Token.objects.values_list("key", flat=True))
+        for path, run in (
+            ("websocket", lambda: async_to_sync(connect_storm)(keys, args.connects, args.concurrency)),
+            ("rest", lambda: rest_requests(keys, args.connects)),
+        ):
+            for cache_size in (0, args.users):
+                with override_settings(SRACHAT_TOKEN_CACHE_SIZE=cache_size):
+                    elapsed = measure(run)
+                hits, misses = metrics.get("token_cache.hit"), metrics.get("token_cache.miss")
+                rows.append((
+                    path, "on" if cache_size else "off", f"{args.connects / elapsed:.0f}",
+                    f"{elapsed / args.connects * 1e6:.1f}", f"{hits / (hits + misses):.1%}" if hits + misses else "-",
+                ))
+
+    print(f"{args.users} users, {args.connects} authentications per path, {args.concurrency} concurrent connects, "
+          f"{connection.vendor}")
+    print_table(("path", "cache", "auth/s", "us per auth", "hit rate"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures CPU spent on encoding a single room broadcast as the room grows.
+
+The group event is dispatched to every consumer of a room the way the channel layer does it,
+with the socket replaced by a no-op. Two handlers are compared:
+- per member: the event carries the comment dict and each consumer encodes the frame itself
+  (the way `new_message` events were handled before)
+- serialize once: the sender encodes the frame and each consumer forwards the ready text (`RoomConsumer.broadcast`)
+
+Usage (from the backend folder):
+    python -m benchmarks.broadcast_fanout --sizes 10 100 1000 2000 --broadcasts 20
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.utils import print_table, setup_django
+
+COMMENT = {
+    "id": 123456,
+    "body": "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt " * 3,
+    "created": "2021-03-01T12:34:56.789012Z",
+    "team_number": 1,
+    "creator": 4321,
+}
+
+
+async def discard(**kwargs):
+    pass
+
+
+def make_consumers(size: int):
+    from srachat.consumers import RoomConsumer
+
+    consumers = []
+    for _ in range(size):
+        consumer = RoomConsumer()
+        consumer.send = discard
+        consumers.append(consumer)
+    return consumers
+
+
+async def per_member(consumers):
+    from srachat.consumers import codec
+
+    event = {"type": "new_message", "comment": COMMENT}
+    for consumer in consumers:
+        await consumer.send(text_data=codec.encode({"type": "new_message", "comments": [event["comment"]]}))
+
+
+async def serialize_once(consumers):
+    from srachat.consumers import codec
+
+    event = {"type": "broadcast", "text": codec.encode({"type": "new_message", "comments": [COMMENT]})}
+    for consumer in consumers:
+        await consumer.broadcast(event)
+
+
+def cpu_per_broadcast(fanout, consumers, broadcasts: int) -> float:
+    loop = asyncio.new_event_loop()
+    try:
+        started = time.process_time()
+        for _ in range(broadcasts):
+            loop.run_until_complete(fanout(consumers))
+        return (time.process_time() - started) / broadcasts
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 2000], help="sockets in the room")
+    parser.add_argument("--broadcasts", type=int, default=20, help="broadcasts measured per room size")
+    args = parser.parse_args()
+
+    setup_django()
+
+    rows = []
+    for size in args.sizes:
+        consumers = make_consumers(size)
+        before = cpu_per_broadcast(per_member, consumers, args.broadcasts)
+        after = cpu_per_broadcast(serialize_once, consumers, args.broadcasts)
+        rows.append((size, f"{before * 1000:.3f}", f"{after * 1000:.3f}", f"{(before - after) * 1000:.3f}"))
+
+    print("CPU per broadcast")
+    print_table(("room size", "per member ms", "serialize once ms", "saved ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
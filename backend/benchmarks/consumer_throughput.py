@@ -0,0 +1,103 @@
+"""
+Compares messages per second and delivery latency of the room consumers.
+
+Several participants send messages into a single room without waiting for each other,
+while a number of anonymous spectators listen. For every consumer implementation the script reports:
+- the amount of comments per second the room could accept and deliver to every socket
+- p50 and p99 latency between sending a comment and receiving it on a listening socket
+
+Usage (from the backend folder):
+    python -m benchmarks.consumer_throughput --senders 4 --listeners 50 --messages 100
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.utils import percentile, print_table, seed_room, setup_django, test_database
+
+
+async def run_room(consumer_class, room, users, listeners: int, messages: int, timeout: float):
+    from channels.layers import get_channel_layer
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from django.contrib.auth.models import AnonymousUser
+    from django.urls import re_path
+    from srachat.tests.utils import ScopeUserMiddleware
+
+    def communicator(user):
+        application = ScopeUserMiddleware(
+            URLRouter([re_path(r'^rooms/(?P<id>\w+)/$', consumer_class.as_asgi())]), user
+        )
+        return WebsocketCommunicator(application, f"/rooms/{room.id}/")
+
+    await get_channel_layer().flush()
+    senders = [communicator(user) for user in users]
+    spectators = [communicator(AnonymousUser()) for _ in range(listeners)]
+    for socket in senders + spectators:
+        await socket.connect(timeout)
+        # Skip the room history
+        await socket.receive_from(timeout)
+
+    sent_at = {}
+    latencies = []
+
+    async def send_all(sender_index, socket):
+        for i in range(messages):
+            body = f"{sender_index}:{i}"
+            sent_at[body] = time.perf_counter()
+            await socket.send_to(text_data=json.dumps({"type": "new_message", "data": {"body": body}}))
+            # Give the event loop a chance to deliver the frames, as a real network would
+            await asyncio.sleep(0)
+
+    async def receive_all(socket):
+        for _ in range(messages * len(senders)):
+            frame = json.loads(await socket.receive_from(timeout))
+            for comment in frame["comments"]:
+                latencies.append(time.perf_counter() - sent_at[comment["body"]])
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(send_all(i, socket) for i, socket in enumerate(senders)),
+        *(receive_all(socket) for socket in spectators),
+    )
+    elapsed = time.perf_counter() - started
+
+    for socket in senders + spectators:
+        await socket.disconnect()
+    return messages * len(senders) / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=4, help="participants sending messages at the same time")
+    parser.add_argument("--listeners", type=int, default=50, help="anonymous sockets listening to the room")
+    parser.add_argument("--messages", type=int, default=100, help="messages sent by each participant")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a single frame")
+    args = parser.parse_args()
+
+    setup_django()
+    from asgiref.sync import async_to_sync
+    from benchmarks.sync_room_consumer import SyncRoomConsumer
+    from srachat.consumers import RoomConsumer
+
+    rows = []
+    with test_database():
+        room, users = seed_room(args.senders)
+        for consumer_class in (SyncRoomConsumer, RoomConsumer):
+            rate, latencies = async_to_sync(run_room)(
+                consumer_class, room, users, args.listeners, args.messages, args.timeout
+            )
+            rows.append((
+                consumer_class.__name__,
+                f"{rate:.1f}",
+                f"{percentile(latencies, 50) * 1000:.2f}",
+                f"{percentile(latencies, 99) * 1000:.2f}",
+            ))
+
+    print(f"{args.senders} senders x {args.messages} messages, {args.listeners} listeners")
+    print_table(("consumer", "messages/s", "p50 ms", "p99 ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Compares the size and the encoding time of the websocket frames as JSON text and as MessagePack binary
+(the `srachat.msgpack` subprotocol).
+
+The frames are recorded from a room session driven through the real `RoomConsumer`: a spectator connects
+to a room with `--history` comments and pages through it with `load_more`, `--senders` participants send
+`--messages` messages each, one of them deletes a message and an anonymous socket tries to send one.
+Every frame the sockets receive is recorded. Pass `--traffic` with a file of frames captured elsewhere,
+one JSON frame per line, to compare those instead. `--save` writes the recorded frames in the same format.
+
+For every frame type the script reports the amount of frames, their total size in both encodings
+and the mean time to encode and decode a single frame.
+
+Usage (from the backend folder):
+    python -m benchmarks.frame_encodings --history 200 --senders 4 --messages 50
+"""
+import argparse
+import json
+import random
+import time
+from collections import defaultdict
+
+from benchmarks.utils import print_table, seed_room, setup_django, test_database
+
+PHRASES = (
+    "Cats are better than dogs.",
+    "Кошки лучше собак, и это не обсуждается.",
+    "Nope 🐶🐶🐶",
+    "Have you ever seen a dog purring? I haven't, so case closed.",
+    "ok",
+)
+
+
+def message_body() -> str:
+    return " ".join(random.choice(PHRASES) for _ in range(random.randint(1, 6)))
+
+
+class Recorder:
+    def __init__(self, room):
+        self.room = room
+        self.frames = []
+
+    def communicator(self, user):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from django.urls import path
+        from srachat.routes import srachat_router
+        from srachat.tests.utils import ScopeUserMiddleware
+
+        application = ScopeUserMiddleware(URLRouter([path("ws/pidor/", srachat_router)]), user)
+        return WebsocketCommunicator(application, f"/ws/pidor/rooms/{self.room.id}/")
+
+    async def connect(self, user):
+        socket = self.communicator(user)
+        await socket.connect()
+        await self.receive(socket)
+        return socket
+
+    async def receive(self, socket):
+        frame = json.loads(await socket.receive_from())
+        self.frames.append(frame)
+        return frame
+
+    async def drain(self, socket):
+        while not await socket.receive_nothing():
+            await self.receive(socket)
+
+    async def run(self, users, messages: int):
+        from django.contrib.auth.models import AnonymousUser
+
+        spectator = await self.connect(AnonymousUser())
+        page = self.frames[-1]
+        while page.get("has_more"):
+            await spectator.send_json_to({"type": "load_more", "data": {"cursor": page["cursor"]}})
+            page = await self.receive(spectator)
+
+        senders = [await self.connect(user) for user in users]
+        anonymous = await self.connect(AnonymousUser())
+        for _ in range(messages):
+            for sender in senders:
+                await sender.send_json_to({"type": "new_message", "data": {"body": message_body()}})
+                await self.drain(sender)
+        await anonymous.send_json_to({"type": "new_message", "data": {"body": message_body()}})
+        await self.drain(anonymous)
+        last_comment = self.frames[-2]["comments"][0]
+        await senders[-1].send_json_to({"type": "delete_messages", "data": {"ids": [last_comment["id"]]}})
+        await self.drain(senders[-1])
+        await self.drain(spectator)
+
+        for socket in [spectator, anonymous, *senders]:
+            await socket.disconnect()
+
+
+def record(history: int, senders: int, messages: int):
+    from asgiref.sync import async_to_sync
+    from srachat.models import Comment
+
+    room, users = seed_room(senders)
+    creator_ids = list(room.chat_users.values_list("id", flat=True))
+    Comment.objects.bulk_create(
+        Comment(room=room, creator_id=random.choice(creator_ids), team_number=1, body=message_body())
+        for _ in range(history)
+    )
+    recorder = Recorder(room)
+    async_to_sync(recorder.run)(users, messages)
+    return recorder.frames
+
+
+def mean_us(function, frames, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            function(frame)
+    return (time.perf_counter() - started) / len(frames) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, default=200, help="comments in the room before the session")
+    parser.add_argument("--senders", type=int, default=4, help="participants sending messages")
+    parser.add_argument("--messages", type=int, default=50, help="messages sent by every sender")
+    parser.add_argument("--repeat", type=int, default=100, help="encodings of every frame, the mean is reported")
+    parser.add_argument("--traffic", metavar="FILE", help="compare the frames from this file instead")
+    parser.add_argument("--save", metavar="FILE", help="write the recorded frames to this file")
+    args = parser.parse_args()
+
+    setup_django()
+    from srachat.consumers import codec
+
+    if not codec.MSGPACK_AVAILABLE:
+        parser.error("msgpack is not installed")
+
+    if args.traffic:
+        with open(args.traffic) as traffic:
+            frames = [json.loads(line) for line in traffic if line.strip()]
+    else:
+        with test_database():
+            frames = record(args.history, args.senders, args.messages)
+    if args.save:
+        with open(args.save, "w") as traffic:
+            traffic.writelines(json.dumps(frame, ensure_ascii=False) + "\n" for frame in frames)
+
+    by_type = defaultdict(list)
+    for frame in frames:
+        by_type[frame.get("type")].append(frame)
+    by_type["all"] = frames
+
+    rows = []
+    for frame_type, typed_frames in by_type.items():
+        texts = [codec.encode(frame).encode() for frame in typed_frames]
+        binaries = [codec.encode_binary(frame) for frame in typed_frames]
+        json_size, msgpack_size = sum(map(len, texts)), sum(map(len, binaries))
+        rows.append((
+            frame_type, len(typed_frames), f"{json_size / 1024:.1f}", f"{msgpack_size / 1024:.1f}",
+            f"{msgpack_size / json_size - 1:+.1%}",
+            *(f"{mean_us(function, data, args.repeat):.1f}" for function, data in (
+                (codec.encode, typed_frames), (codec.encode_binary, typed_frames),
+                (codec.decode, texts), (codec.decode_binary, binaries),
+            )),
+        ))
+
+    print(f"{len(frames)} frames" + (f" from {args.traffic}" if args.traffic else " recorded"))
+    print_table((
+        "frame", "count", "json KB", "msgpack KB", "size", "json enc us", "msgpack enc us", "json dec us",
+        "msgpack dec us",
+    ), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares the JSON encoding and decoding of big payloads by DRF and the standard library against orjson
+(`srachat.fast_json`).
+
+The database is seeded with `--rooms` rooms and `--comments` comments of a single room, which are serialized
+by the serializers of the endpoints once. Then every payload is encoded and decoded `--repeat` times:
+- room list: the rooms as `RoomList` returns them, `JSONRenderer` / `JSONParser` against
+  `FastJSONRenderer` / `FastJSONParser`
+- comment list: the comments as `CommentList` returns them, the same way
+- comments frame: the comments as a websocket frame, `json.dumps` / `json.loads` against `srachat.consumers.codec`
+The script reports the median time in ms of every way and the size of the payload in UTF-8.
+
+Usage (from the backend folder):
+    python -m benchmarks.json_payloads --rooms 1000 --comments 5000
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+
+from benchmarks.utils import print_table, seed_room, setup_django, test_database
+
+
+def seed(rooms_amount: int, comments_amount: int):
+    from srachat.models import Comment, Room
+    from srachat.models.language import LanguageChoices
+    from srachat.models.tag import Tag
+
+    room, users = seed_room(2)
+    creator = room.creator
+    Room.objects.bulk_create(
+        Room(
+            creator=creator, title=f"room {i} about the cats and the dogs", first_team_name="cats",
+            second_team_name="dogs", language=LanguageChoices.ENGLISH, max_participants_in_team=10,
+        ) for i in range(rooms_amount - 1)
+    )
+    Tag.objects.bulk_create(Tag(name=f"tag {i}") for i in range(3))
+    tag_ids = list(Tag.objects.values_list("id", flat=True))
+    Room.tags.through.objects.bulk_create(
+        Room.tags.through(room_id=room_id, tag_id=tag_id) for room_id in Room.objects.values_list("id", flat=True)
+        for tag_id in tag_ids
+    )
+    Comment.objects.bulk_create(
+        Comment(room=room, creator=creator, team_number=1, body=f"comment {i}: " + "Кошки лучше собак. " * 5)
+        for i in range(comments_amount)
+    )
+    return room
+
+
+def payloads(room):
+    from srachat.models import Comment, Room
+    from srachat.serializers.comment_serializer import SingleRoomCommentSerializer
+    from srachat.serializers.room_serializer import DetailListRoomSerializer
+
+    rooms = DetailListRoomSerializer(Room.objects.with_relations().order_by("-id"), many=True).data
+    comments = SingleRoomCommentSerializer(Comment.objects.filter(room=room).order_by("id"), many=True).data
+    return {
+        "room list": {"next": None, "previous": None, "results": rooms},
+        "comment list": {"before": None, "after": None, "results": comments},
+        "comments frame": {"type": "history", "room": room.id, "comments": comments},
+    }
+
+
+def median_ms(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1000, help="rooms of the room list")
+    parser.add_argument("--comments", type=int, default=5000, help="comments of the comment list")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of every way, the median is reported")
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from srachat import fast_json
+    from srachat.consumers import codec
+    from srachat.parsers import FastJSONParser
+    from srachat.renderers import FastJSONRenderer
+
+    with test_database():
+        data = payloads(seed(args.rooms, args.comments))
+
+    rows = []
+    for name, payload in data.items():
+        if name == "comments frame":
+            ways = (
+                ("stdlib", json.dumps, json.loads),
+                ("orjson", codec.encode, codec.decode),
+            )
+        else:
+            ways = (
+                ("drf", JSONRenderer().render, lambda body: JSONParser().parse(io.BytesIO(body))),
+                ("orjson", FastJSONRenderer().render, lambda body: FastJSONParser().parse(io.BytesIO(body))),
+            )
+        for way, encode, decode in ways:
+            encoded = encode(payload)
+            size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            rows.append((
+                name, way, f"{size / 1024:.0f}", f"{median_ms(lambda: encode(payload), args.repeat):.2f}",
+                f"{median_ms(lambda: decode(encoded), args.repeat):.2f}",
+            ))
+
+    print(f"{args.rooms} rooms, {args.comments} comments, orjson {'installed' if fast_json.FAST else 'missing'}")
+    print_table(("payload", "json", "KB", "encode ms", "decode ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
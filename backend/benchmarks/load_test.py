@@ -0,0 +1,194 @@
+"""
+Load test of the realtime path: N rooms with M sockets each, driven through the real websocket routes.
+
+In every room `--senders` participants send messages at `--rate` messages per second for `--duration` seconds,
+while the rest of the sockets are anonymous spectators. The sending phase lasts until every socket
+has received every comment of its room, so it is longer than `--duration` when the worker doesn't keep up.
+
+The whole worker runs in this process on top of `WebsocketCommunicator`, so the numbers include the routing,
+the consumers, the channel layer and the database, but not the network and the ASGI server. The script reports:
+- connect latency: from opening a socket till its history frame is received
+- broadcast latency: from sending a comment till it is received by a socket of the room, over all sockets
+- throughput: comments accepted and frames delivered per second
+- RSS of the worker before the sockets are opened, with all of them open and its peak
+
+The channel layer is the in-memory one by default. Pass `--redis redis://localhost:6379` to run
+through a local Redis (or any server speaking its protocol) with `channels_redis`.
+
+Usage (from the backend folder):
+    python -m benchmarks.load_test --rooms 10 --clients 50 --senders 2 --rate 5 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import resource
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks.utils import percentile, print_table, seed_room, setup_django, test_database
+
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() / 2 ** 20
+
+
+def peak_rss_mb() -> float:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def use_redis(url: str):
+    from django.conf import settings
+
+    settings.CHANNEL_LAYERS["default"] = {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [url], "capacity": 100_000},
+    }
+
+
+class LoadTest:
+    def __init__(self, rooms, clients: int, rate: float, duration: float, timeout: float):
+        self.rooms = rooms
+        self.clients = clients
+        self.rate = rate
+        # Every sender sends the same amount of messages, so the listeners know how many to wait for
+        self.messages = max(1, round(rate * duration))
+        self.timeout = timeout
+
+        self.connect_latencies: List[float] = []
+        self.broadcast_latencies: List[float] = []
+        self.sent_at: Dict[str, float] = {}
+        self.delivered_frames = 0
+
+    @staticmethod
+    def communicator(room, user):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from django.urls import path
+        from srachat.routes import srachat_router
+        from srachat.tests.utils import ScopeUserMiddleware
+
+        application = ScopeUserMiddleware(URLRouter([path("ws/pidor/", srachat_router)]), user)
+        return WebsocketCommunicator(application, f"/ws/pidor/rooms/{room.id}/")
+
+    async def connect(self, room, user):
+        socket = self.communicator(room, user)
+        started = time.perf_counter()
+        await socket.connect(self.timeout)
+        # The history frame means the consumer has loaded the room
+        await socket.receive_from(self.timeout)
+        self.connect_latencies.append(time.perf_counter() - started)
+        return socket
+
+    async def send_all(self, room_index: int, sender_index: int, socket):
+        period = 1 / self.rate
+        started = time.perf_counter()
+        for i in range(self.messages):
+            body = f"{room_index}:{sender_index}:{i}"
+            self.sent_at[body] = time.perf_counter()
+            await socket.send_to(text_data=json.dumps({"type": "new_message", "data": {"body": body}}))
+            # Keep the rate steady even if sending took a while
+            await asyncio.sleep(max(0.0, started + (i + 1) * period - time.perf_counter()))
+
+    async def receive_all(self, socket, expected: int):
+        received = 0
+        while received < expected:
+            frame = json.loads(await socket.receive_from(self.timeout))
+            now = time.perf_counter()
+            self.delivered_frames += 1
+            for comment in frame.get("comments", ()):
+                self.broadcast_latencies.append(now - self.sent_at[comment["body"]])
+                received += 1
+
+    async def connect_room(self, room, users):
+        from django.contrib.auth.models import AnonymousUser
+
+        senders = [await self.connect(room, user) for user in users]
+        spectators = [await self.connect(room, AnonymousUser()) for _ in range(self.clients - len(users))]
+        return senders, spectators
+
+    async def run(self) -> Tuple[float, float]:
+        """
+        Returns the duration of the sending phase and the RSS with all the sockets connected.
+        """
+        from channels.layers import get_channel_layer
+
+        await get_channel_layer().flush()
+        # Rooms connect concurrently, the sockets of a room one after another
+        sockets = await asyncio.gather(*(self.connect_room(room, users) for room, users in self.rooms))
+        rss_connected = current_rss_mb()
+
+        tasks = []
+        for room_index, (senders, spectators) in enumerate(sockets):
+            expected = len(senders) * self.messages
+            tasks += [self.send_all(room_index, i, socket) for i, socket in enumerate(senders)]
+            tasks += [self.receive_all(socket, expected) for socket in senders + spectators]
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        for senders, spectators in sockets:
+            for socket in senders + spectators:
+                await socket.disconnect()
+        return elapsed, rss_connected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10, help="rooms under load")
+    parser.add_argument("--clients", type=int, default=50, help="sockets per room, the senders included")
+    parser.add_argument("--senders", type=int, default=2, help="participants sending messages in every room")
+    parser.add_argument("--rate", type=float, default=5, help="messages per second sent by every sender")
+    parser.add_argument("--duration", type=float, default=10, help="seconds the senders are sending")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a single frame")
+    parser.add_argument("--redis", metavar="URL", help="use the redis channel layer at this url")
+    args = parser.parse_args()
+    if not 0 < args.senders <= args.clients:
+        parser.error("Every room needs at least one sender and cannot have more senders than clients")
+
+    setup_django()
+    if args.redis:
+        use_redis(args.redis)
+    from asgiref.sync import async_to_sync
+
+    with test_database():
+        rooms = [seed_room(args.senders, f"load test room {i}") for i in range(args.rooms)]
+        rss_before = current_rss_mb()
+        load_test = LoadTest(rooms, args.clients, args.rate, args.duration, args.timeout)
+        elapsed, rss_connected = async_to_sync(load_test.run)()
+
+    comments = args.rooms * args.senders * load_test.messages
+    print(
+        f"{args.rooms} rooms x {args.clients} sockets, {args.senders} senders per room at {args.rate} messages/s, "
+        f"{'redis' if args.redis else 'in-memory'} channel layer"
+    )
+    print_table(("metric", "p50", "p99", "max"), [
+        ("connect ms", *(
+            f"{value * 1000:.2f}" for value in (
+                percentile(load_test.connect_latencies, 50), percentile(load_test.connect_latencies, 99),
+                max(load_test.connect_latencies),
+            )
+        )),
+        ("broadcast ms", *(
+            f"{value * 1000:.2f}" for value in (
+                percentile(load_test.broadcast_latencies, 50), percentile(load_test.broadcast_latencies, 99),
+                max(load_test.broadcast_latencies, default=float("nan")),
+            )
+        )),
+    ])
+    print()
+    print_table(("metric", "value"), [
+        ("comments sent", comments),
+        ("comments/s", f"{comments / elapsed:.1f}"),
+        ("comments delivered/s", f"{len(load_test.broadcast_latencies) / elapsed:.1f}"),
+        ("frames delivered/s", f"{load_test.delivered_frames / elapsed:.1f}"),
+        ("RSS before connect MB", f"{rss_before:.1f}"),
+        ("RSS connected MB", f"{rss_connected:.1f}"),
+        ("RSS peak MB", f"{peak_rss_mb():.1f}"),
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Shows the plans and the timings of the hot queries without and with the purpose-built indexes.
+
+The database is seeded with `--rooms` rooms (`--inactive` share of them deactivated), `--users` users,
+`--comments` comments spread over the rooms with a long tail, so the first room is the busiest one,
+`--participants` participants and `--votes` votes per room. Then every query is explained and timed
+with the indexes declared in the models dropped, and once more after they are created again:
+- room history page: the newest comments of the busiest room (comment_room_created_id)
+- room users: participants of the busiest room by team (participation_room_team)
+- room votes by team: votes of the busiest room counted by team (roomvote_room_team)
+- active rooms page: the newest active rooms (room_active_id)
+- active rooms by language: the newest active rooms of a language (room_language_id)
+
+The plans depend on the database, run it against PostgreSQL (DJANGO_SETTINGS_MODULE=root.settings)
+for the numbers of production, SQLite shows only which index is picked.
+
+Usage (from the backend folder):
+    python -m benchmarks.query_plans --rooms 2000 --users 2000 --comments 200000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from benchmarks.utils import print_table, setup_django, test_database
+
+BATCH_SIZE = 5000
+
+
+def seed(rooms_amount: int, users_amount: int, comments_amount: int, participants: int, votes: int, inactive: float):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from srachat.models import ChatUser, Comment, Room
+    from srachat.models.language import LanguageChoices
+    from srachat.models.room import RoomVote
+    from srachat.models.user import Participation
+
+    User.objects.bulk_create((User(username=f"user_{i}") for i in range(users_amount)), batch_size=BATCH_SIZE)
+    ChatUser.objects.bulk_create(
+        (ChatUser(user_id=user_id) for user_id in User.objects.values_list("id", flat=True)), batch_size=BATCH_SIZE
+    )
+    chat_user_ids = list(ChatUser.objects.values_list("id", flat=True))
+
+    languages = LanguageChoices.values
+    Room.objects.bulk_create((
+        Room(
+            creator_id=random.choice(chat_user_ids), title=f"room {i}", first_team_name="first",
+            second_team_name="second", language=random.choice(languages), is_active=random.random() >= inactive,
+            max_participants_in_team=Room.POSSIBLE_MAX_PARTICIPANTS,
+        ) for i in range(rooms_amount)
+    ), batch_size=BATCH_SIZE)
+    room_ids = list(Room.objects.order_by("id").values_list("id", flat=True))
+
+    # Participants and voters of a room are different users
+    members = [(room_id, random.sample(chat_user_ids, participants + votes)) for room_id in room_ids]
+    Participation.objects.bulk_create((
+        Participation(room_id=room_id, chatuser_id=member_id, team_number=i % 2 + 1)
+        for room_id, member_ids in members for i, member_id in enumerate(member_ids[:participants])
+    ), batch_size=BATCH_SIZE)
+    RoomVote.objects.bulk_create((
+        RoomVote(room_id=room_id, voter_id=member_id, team_number=random.randint(1, 2))
+        for room_id, member_ids in members for member_id in member_ids[participants:]
+    ), batch_size=BATCH_SIZE)
+
+    # A long tail: the first rooms get most of the comments
+    weights = [1 / (i + 1) for i in range(len(room_ids))]
+    now = timezone.now()
+    Comment.objects.bulk_create((
+        Comment(
+            room_id=room_id, creator_id=random.choice(chat_user_ids), body=f"comment {i}",
+            team_number=random.randint(1, 2), created=now - timedelta(seconds=random.randint(0, 30 * 24 * 3600)),
+        ) for i, room_id in enumerate(random.choices(room_ids, weights, k=comments_amount))
+    ), batch_size=BATCH_SIZE)
+    return room_ids[0]
+
+
+def hot_queries(room_id: int):
+    from django.db.models import Count
+    from srachat.models import Comment, Room
+    from srachat.models.language import LanguageChoices
+    from srachat.models.room import RoomVote
+    from srachat.models.user import Participation
+
+    return {
+        "room history page": lambda: Comment.objects.filter(room_id=room_id).order_by("-created", "-pk")[:50],
+        "room users": lambda: Participation.objects.filter(room_id=room_id).values_list("chatuser_id", "team_number"),
+        "room votes by team": lambda: RoomVote.objects.filter(room_id=room_id).values_list("team_number").annotate(
+            votes=Count("pk")
+        ).order_by(),
+        "active rooms page": lambda: Room.objects.filter(is_active=True).order_by("-id")[:50],
+        "active rooms by language": lambda: Room.objects.filter(
+            is_active=True, language=LanguageChoices.ENGLISH
+        ).order_by("-id")[:50],
+    }
+
+
+def declared_indexes():
+    from srachat.models import Comment, Room
+    from srachat.models.room import RoomVote
+    from srachat.models.user import Participation
+
+    return [(model, index) for model in (Comment, Room, Participation, RoomVote) for index in model._meta.indexes]
+
+
+def measure(queries, repeat: int):
+    """
+    Returns the plan and the median time in ms of every query.
+    """
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(query())
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (query().explain(), statistics.median(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=2000, help="rooms in the database")
+    parser.add_argument("--inactive", type=float, default=0.7, help="share of the deactivated rooms")
+    parser.add_argument("--users", type=int, default=2000, help="users in the database")
+    parser.add_argument("--comments", type=int, default=200_000, help="comments in the database")
+    parser.add_argument("--participants", type=int, default=20, help="participants of every room")
+    parser.add_argument("--votes", type=int, default=50, help="votes of every room")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of every query, the median is reported")
+    args = parser.parse_args()
+    if args.participants + args.votes > args.users:
+        parser.error("Participants and voters of a room are different users, so there should be enough of them")
+
+    setup_django()
+    from django.db import connection
+
+    with test_database():
+        room_id = seed(args.rooms, args.users, args.comments, args.participants, args.votes, args.inactive)
+        with connection.cursor() as cursor:
+            # Fresh statistics for the planner
+            cursor.execute("ANALYZE")
+        queries = hot_queries(room_id)
+
+        indexes = declared_indexes()
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                editor.remove_index(model, index)
+        before = measure(queries, args.repeat)
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        after = measure(queries, args.repeat)
+
+    print(
+        f"{args.rooms} rooms ({args.inactive:.0%} inactive), {args.users} users, {args.comments} comments, "
+        f"{args.participants} participants and {args.votes} votes per room, {connection.vendor}"
+    )
+    for name in queries:
+        print()
+        print(f"{name}, without the indexes:\n{before[name][0]}")
+        print(f"{name}, with the indexes:\n{after[name][0]}")
+    print()
+    print_table(("query", "without ms", "with ms"), [
+        (name, f"{before[name][1]:.3f}", f"{after[name][1]:.3f}") for name in queries
+    ])
+
+
+if __name__ == "__main__":
+    main()
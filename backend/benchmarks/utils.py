@@ -0,0 +1,78 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Every script is run from the backend folder as a module, e.g. `python -m benchmarks.consumer_throughput`.
+By default it works on a throwaway test database and the in-memory channel layer from `root.test_settings`,
+set DJANGO_SETTINGS_MODULE to benchmark against another setup.
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterable, Sequence, Tuple
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "root.test_settings")
+    import django
+    from django.conf import settings
+
+    django.setup()
+    if settings.CHANNEL_LAYERS["default"]["BACKEND"] == "channels.layers.InMemoryChannelLayer":
+        # The default capacity of 100 messages per channel silently drops frames under the benchmark load
+        settings.CHANNEL_LAYERS["default"].setdefault("CONFIG", {})["capacity"] = 100_000
+
+
+@contextmanager
+def test_database():
+    """
+    Creates a migrated test database for the duration of the benchmark and destroys it afterwards.
+    """
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed_room(participants: int, title: str = "benchmark room"):
+    """
+    Creates a room and `participants` users, which are split between the teams.
+    Returns the room and the list of the underlying django users.
+    """
+    from django.contrib.auth.models import User
+    from srachat.models import ChatUser, Room
+    from srachat.models.user import Participation
+
+    users = [User.objects.create_user(f"{title}_user_{i}") for i in range(participants)]
+    chat_users = list(ChatUser.objects.filter(user__in=users).order_by("id"))
+    room = Room.objects.create(
+        creator=chat_users[0], title=title, first_team_name="first", second_team_name="second",
+        max_participants_in_team=participants
+    )
+    Participation.objects.bulk_create(
+        Participation(chatuser=chat_user, room=room, team_number=i % 2 + 1) for i, chat_user in enumerate(chat_users)
+    )
+    # bulk_create skips Participation.save, which keeps the counters
+    Room.objects.filter(pk=room.pk).update(
+        first_team_participants=(participants + 1) // 2, second_team_participants=participants // 2
+    )
+    return room, users
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def print_table(headers: Sequence[str], rows: Iterable[Tuple]):
+    rows = [tuple(str(value) for value in row) for row in rows]
+    widths = [max(len(header), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,113 @@
+"""
+Compares the throughput and the correctness of the room vote counting under parallel voters.
+
+Every voter votes once for one of the teams of a single room, `--threads` of them at the same time,
+each thread with its own database connection. Two implementations are compared:
+- read-modify-write: the room is read, its counter is incremented in python and the whole room is saved
+  (the way `RoomVoteTeam` counted the votes before)
+- atomic: `RoomVote.cast`, which changes the counter with a single UPDATE ... SET votes = votes + 1
+- sharded: `RoomVote.cast` with `--shards` counter rows per room (SRACHAT_VOTE_COUNTER_SHARDS),
+  the shards are folded into the room before the votes are checked
+For each of them the script reports votes per second and the amount of votes missing from the counters.
+
+Run it against PostgreSQL (DJANGO_SETTINGS_MODULE=root.settings) to see the contention on the room row.
+SQLite cannot upgrade the locks of concurrent transactions, so there the votes are cast one at a time
+(from a file database shared by the threads) and only the cost of a single vote is measured.
+
+Usage (from the backend folder):
+    python -m benchmarks.vote_throughput --voters 400 --threads 16
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import print_table, setup_django, test_database
+
+
+def read_modify_write_vote(room_id: int, voter_id: int, team_number: int) -> bool:
+    from srachat.models import Room
+    from srachat.models.room import RoomVote
+
+    room = Room.objects.get(pk=room_id)
+    RoomVote.objects.create(room_id=room_id, voter_id=voter_id, team_number=team_number)
+    field = Room.VOTES_FIELDS[team_number]
+    setattr(room, field, getattr(room, field) + 1)
+    room.save(update_fields=[field])
+    return True
+
+
+def atomic_vote(room_id: int, voter_id: int, team_number: int) -> bool:
+    from srachat.models.room import RoomVote
+
+    return RoomVote.cast(room_id, voter_id, team_number)
+
+
+def run_votes(vote, room, voter_ids, threads: int):
+    from django.db import connection
+    from srachat.models.room import RoomVoteShard
+
+    serialized = threading.Lock() if connection.vendor == "sqlite" else contextlib.nullcontext()
+
+    def vote_and_close(voter_index):
+        try:
+            with serialized:
+                vote(room.id, voter_ids[voter_index], voter_index % 2 + 1)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(vote_and_close, range(len(voter_ids))))
+    elapsed = time.perf_counter() - started
+
+    RoomVoteShard.fold([room.id])
+    room.refresh_from_db()
+    return len(voter_ids) / elapsed, len(voter_ids) - room.first_team_votes - room.second_team_votes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--voters", type=int, default=400, help="voters, each of them votes once")
+    parser.add_argument("--threads", type=int, default=16, help="voters voting at the same time")
+    parser.add_argument("--shards", type=int, default=8, help="counter rows per room of the sharded counting")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import override_settings
+    from srachat.models import ChatUser, Room
+
+    if connection.vendor == "sqlite":
+        # The in-memory database cannot be shared by the connections of the threads
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+
+    rows = []
+    with test_database():
+        users = User.objects.bulk_create(User(username=f"voter_{i}") for i in range(args.voters))
+        ChatUser.objects.bulk_create(ChatUser(user_id=user.id) for user in User.objects.filter(
+            username__in=[user.username for user in users]
+        ))
+        voter_ids = list(ChatUser.objects.order_by("id").values_list("id", flat=True))
+        for name, vote, shards in (
+            ("read-modify-write", read_modify_write_vote, 0),
+            ("atomic", atomic_vote, 0),
+            (f"sharded x{args.shards}", atomic_vote, args.shards),
+        ):
+            room = Room.objects.create(
+                creator_id=voter_ids[0], title=f"{name} room", first_team_name="first", second_team_name="second"
+            )
+            with override_settings(SRACHAT_VOTE_COUNTER_SHARDS=shards):
+                rate, lost = run_votes(vote, room, voter_ids, args.threads)
+            rows.append((name, f"{rate:.1f}", lost))
+
+    print(f"{args.voters} voters, {args.threads} at the same time, {connection.vendor}")
+    print_table(("counting", "votes/s", "lost votes"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the overhead of the websocket middleware stack per connect.
+
+The stack is called `--connects` times with a scope of a browser (a few cookies besides the token)
+and an inner application doing nothing, so only the middlewares are measured:
+- before: CookieMiddleware(SessionMiddleware(...)) around a middleware reading the token from the parsed cookies,
+  the stack used before the sessions were dropped
+- after: `root.token_auth.TokenAuthMiddlewareStack` with the token in a cookie, a header or a subprotocol
+The token is in the token cache, so no row includes a database query, see `benchmarks.auth_cost` for them.
+
+Usage (from the backend folder):
+    python -m benchmarks.websocket_auth --connects 20000
+"""
+import argparse
+import time
+
+from benchmarks.utils import print_table, setup_django, test_database
+
+BROWSER_COOKIES = "csrftoken=0123456789abcdef0123456789abcdef; sessionid=0123456789abcdefghijklmnopqrstuv; theme=dark"
+
+
+class CookieTokenAuthMiddleware:
+    """
+    The token middleware of the old stack, which relied on the cookies parsed by `CookieMiddleware`.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        from root.token_auth import get_user
+
+        scope["user"] = await get_user(scope.get("cookies", {}).get("token"))
+        return await self.inner(scope, receive, send)
+
+
+async def inner_application(scope, receive, send):
+    pass
+
+
+async def connect_all(application, scope, connects: int) -> float:
+    started = time.perf_counter()
+    for _ in range(connects):
+        await application(dict(scope), None, None)
+    return (time.perf_counter() - started) / connects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connects", type=int, default=20000, help="connects through every stack")
+    args = parser.parse_args()
+
+    setup_django()
+    from asgiref.sync import async_to_sync
+    from channels.sessions import CookieMiddleware, SessionMiddleware
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from root.token_auth import TokenAuthMiddlewareStack, get_token
+
+    with test_database():
+        token = Token.objects.create(user=User.objects.create_user("benchmark_user"))
+        get_token(token.key)
+
+        cookie_headers = [(b"cookie", f"{BROWSER_COOKIES}; token={token.key}".encode())]
+        browser_headers = [(b"cookie", BROWSER_COOKIES.encode())]
+        stacks = (
+            ("before", "cookie", CookieMiddleware(SessionMiddleware(CookieTokenAuthMiddleware(inner_application))), {
+                "headers": cookie_headers,
+            }),
+            ("after", "cookie", TokenAuthMiddlewareStack(inner_application), {"headers": cookie_headers}),
+            ("after", "header", TokenAuthMiddlewareStack(inner_application), {
+                "headers": browser_headers + [(b"authorization", f"Token {token.key}".encode())],
+            }),
+            ("after", "subprotocol", TokenAuthMiddlewareStack(inner_application), {
+                "headers": browser_headers, "subprotocols": [f"token.{token.key}"],
+            }),
+            ("before", "none", CookieMiddleware(SessionMiddleware(CookieTokenAuthMiddleware(inner_application))), {
+                "headers": browser_headers,
+            }),
+            ("after", "none", TokenAuthMiddlewareStack(inner_application), {"headers": browser_headers}),
+        )
+        rows = []
+        for stack, source, application, scope in stacks:
+            scope = dict(scope, type="websocket", path="/ws/pidor/rooms/1/")
+            per_connect = async_to_sync(connect_all)(application, scope, args.connects)
+            rows.append((stack, source, f"{per_connect * 1e6:.1f}", f"{1 / per_connect:.0f}"))
+
+    print(f"{args.connects} connects through every stack")
+    print_table(("stack", "token", "us per connect", "connects/s"), rows)
+
+
+if __name__ == "__main__":
+    main()
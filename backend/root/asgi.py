@@ -17,15 +17,15 @@ django_asgi_app = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
 
-from .token_auth import TokenAuthMiddlewareStack
+from .token_auth import TokenAuthMiddlewareStack, TokenCacheInvalidationMiddleware
 from srachat.routes import srachat_router
 
 
-application = ProtocolTypeRouter({
+application = TokenCacheInvalidationMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": TokenAuthMiddlewareStack(
         URLRouter([
             path('ws/pidor/', srachat_router),
         ])
     )
-})
+}))
@@ -117,6 +117,40 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Realtime settings of the room consumers
+
+# New comments of a room are merged into a single frame during this window (ms).
+# It is the maximum latency added to a message, 0 disables merging.
+SRACHAT_BROADCAST_COALESCE_MS = int(os.environ.get("SRACHAT_BROADCAST_COALESCE_MS", 0))
+# Merged frame is sent immediately, when this amount of comments is reached
+SRACHAT_BROADCAST_COALESCE_MAX_COMMENTS = int(os.environ.get("SRACHAT_BROADCAST_COALESCE_MAX_COMMENTS", 50))
+
+# Comments sent through the websockets are broadcast right away and saved to the database in batches
+SRACHAT_COMMENT_WRITE_BEHIND = bool(int(os.environ.get("SRACHAT_COMMENT_WRITE_BEHIND", 0)))
+# A batch is saved when it reaches this size ...
+SRACHAT_COMMENT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("SRACHAT_COMMENT_WRITE_BEHIND_BATCH_SIZE", 100))
+# ... or this amount of time (ms) after its first comment was accepted
+SRACHAT_COMMENT_WRITE_BEHIND_MS = int(os.environ.get("SRACHAT_COMMENT_WRITE_BEHIND_MS", 200))
+
+# Maximum amount of frames sent to a socket and not acknowledged by the client yet (see `ack` in RoomConsumer),
+# 0 ignores the acknowledgements. Clients, which never acknowledge, are not limited
+SRACHAT_OUTBOUND_WINDOW = int(os.environ.get("SRACHAT_OUTBOUND_WINDOW", 100))
+# Maximum amount of frames waiting for the acknowledgements of a single socket
+SRACHAT_OUTBOUND_QUEUE_SIZE = int(os.environ.get("SRACHAT_OUTBOUND_QUEUE_SIZE", 500))
+# What happens to a socket, which doesn't keep up: "drop_oldest", "resync" or "disconnect"
+SRACHAT_SLOW_CONSUMER_POLICY = os.environ.get("SRACHAT_SLOW_CONSUMER_POLICY", "resync")
+
+# Votes of a room are counted in this amount of shard rows instead of the room row, 0 disables the shards.
+# The shards are folded into the rooms by `python manage.py reconcile_votes`
+SRACHAT_VOTE_COUNTER_SHARDS = int(os.environ.get("SRACHAT_VOTE_COUNTER_SHARDS", 0))
+
+# Tokens with their users are cached by the REST and the websocket authentication of a worker process.
+# At most this amount of tokens is kept, 0 disables the cache ...
+SRACHAT_TOKEN_CACHE_SIZE = int(os.environ.get("SRACHAT_TOKEN_CACHE_SIZE", 10000))
+# ... each for this amount of seconds. Logout and changes of the users are sent to all the processes
+# through the channel layer, the TTL bounds the changes made without the models
+SRACHAT_TOKEN_CACHE_TTL = float(os.environ.get("SRACHAT_TOKEN_CACHE_TTL", 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -190,8 +224,18 @@ if "IS_HEROKU" in os.environ:
 # Rest framework auth backend
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'root.token_auth.CachedTokenAuthentication',
+    ],
+    # JSON is encoded and decoded by orjson when it is installed, see `srachat.fast_json`
+    'DEFAULT_RENDERER_CLASSES': [
+        'srachat.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'srachat.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # Django email backend
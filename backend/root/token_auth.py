@@ -1,39 +1,306 @@
+import asyncio
 import logging
-from typing import Awaitable, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
 
+from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async
-from channels.sessions import CookieMiddleware, SessionMiddleware
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
-from django.db import close_old_connections
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.base import ModelState
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import parse_cookie
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
 
+from srachat import metrics
 
-@database_sync_to_async
-def get_user(token_key: Optional[str]) -> Union[Awaitable[User], AnonymousUser]:
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    Process-local LRU cache of the tokens with their users, shared by the REST and the websocket authentication.
+
+    At most `SRACHAT_TOKEN_CACHE_SIZE` tokens are kept, each for `SRACHAT_TOKEN_CACHE_TTL` seconds at most,
+    so changes made without the signals below (e.g. by `QuerySet.update`) are picked up after the TTL.
+    The signals invalidate the cache of the process, which made the change, right away and the caches
+    of the other worker processes through the channel layer, see `TokenCacheInvalidationMiddleware`.
+    A size of 0 disables the cache. Hits and misses are counted as `token_cache.hit` and `token_cache.miss`.
+    """
+
+    def __init__(self):
+        self._tokens: "OrderedDict[str, Tuple[float, Token]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by every invalidation, see `put`
+        self.generation = 0
+
+    def get(self, key: str) -> Optional[Token]:
+        if not settings.SRACHAT_TOKEN_CACHE_SIZE:
+            return None
+        with self._lock:
+            expires, token = self._tokens.get(key, (0.0, None))
+            if token is not None:
+                if expires > time.monotonic():
+                    self._tokens.move_to_end(key)
+                else:
+                    del self._tokens[key]
+                    token = None
+        metrics.increment("token_cache.miss" if token is None else "token_cache.hit")
+        return None if token is None else self._copy(token)
+
+    def put(self, token: Token, generation: int):
+        """
+        Caches the token read from the database, unless something was invalidated since `generation`
+        was taken before the read: the token might have been deleted or its user changed in the meantime.
+        """
+        size = settings.SRACHAT_TOKEN_CACHE_SIZE
+        if not size:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._tokens[token.key] = (time.monotonic() + settings.SRACHAT_TOKEN_CACHE_TTL, self._copy(token))
+            self._tokens.move_to_end(token.key)
+            while len(self._tokens) > size:
+                self._tokens.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self.generation += 1
+            self._tokens.pop(key, None)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, (_, token) in self._tokens.items() if token.user_id == user_id]:
+                del self._tokens[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._tokens.clear()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    @classmethod
+    def _copy(cls, token: Token) -> Token:
+        # The cached objects are shared by the requests, so neither of them gets the cached ones
+        clone = cls._clone(token)
+        clone.user = cls._clone(token.user)
+        return clone
+
+    @staticmethod
+    def _clone(instance: Model) -> Model:
+        # A few times cheaper than `copy.copy`, which goes through the pickling of the model
+        clone = instance.__class__.__new__(instance.__class__)
+        clone.__dict__.update(instance.__dict__)
+        clone._state = ModelState()
+        clone._state.db, clone._state.adding = instance._state.db, instance._state.adding
+        return clone
+
+
+token_cache = TokenCache()
+
+
+# The receivers are connected when this module is imported, which happens before anything is cached
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance: Token, **kwargs):
+    # Logout deletes the token
+    token_cache.invalidate(instance.key)
+    publish_invalidation(key=instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_changed_user(sender, instance: User, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+    publish_invalidation(user_id=instance.pk)
+
+
+INVALIDATION_GROUP = "token_cache"
+
+
+def publish_invalidation(**event):
+    """
+    Sends an invalidation of a token (`key`) or of the tokens of a user (`user_id`) to the caches
+    of all the worker processes, once the current transaction is committed.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    message = {"type": "token_cache.invalidate", **event}
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(INVALIDATION_GROUP, message))
+
+
+def apply_invalidation(message: dict):
+    if message.get("key") is not None:
+        token_cache.invalidate(message["key"])
+    if message.get("user_id") is not None:
+        token_cache.invalidate_user(message["user_id"])
+
+
+class TokenCacheInvalidationMiddleware:
+    """
+    ASGI middleware, which subscribes the `token_cache` of the worker process to the invalidations
+    published by the other processes (see `publish_invalidation`) on the first connection it handles.
+    """
+    # Group memberships expire in the channel layer (after a day in channels_redis), so they are renewed
+    RENEW_INTERVAL = 3600
+    # Pause after a failed receive, e.g. while the channel layer is unreachable
+    RETRY_INTERVAL = 1
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.tasks = []
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            try:
+                await self.subscribe()
+            except Exception:
+                self.loop = None
+                raise
+        return await self.inner(scope, receive, send)
+
+    async def subscribe(self):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(INVALIDATION_GROUP, channel)
+        self.tasks = [
+            asyncio.ensure_future(self._receive(channel_layer, channel)),
+            asyncio.ensure_future(self._renew(channel_layer, channel)),
+        ]
+
+    async def unsubscribe(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.loop = None
+
+    async def _receive(self, channel_layer, channel: str):
+        while True:
+            try:
+                apply_invalidation(await channel_layer.receive(channel))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to receive a token cache invalidation")
+                await asyncio.sleep(self.RETRY_INTERVAL)
+
+    async def _renew(self, channel_layer, channel: str):
+        while True:
+            await asyncio.sleep(self.RENEW_INTERVAL)
+            try:
+                await channel_layer.group_add(INVALIDATION_GROUP, channel)
+            except Exception:
+                logger.exception("Failed to renew the token cache invalidations")
+
+
+def load_token(key: str) -> Optional[Token]:
+    """
+    Fetches the token with its user from the database and caches it. Returns None for an unknown key.
+    """
+    generation = token_cache.generation
+    try:
+        token = Token.objects.select_related("user").get(key=key)
+    except Token.DoesNotExist:
+        metrics.increment("token_auth.invalid")
+        return None
+    token_cache.put(token, generation)
+    return token
+
+
+def get_token(key: str) -> Optional[Token]:
+    return token_cache.get(key) or load_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    `TokenAuthentication`, which looks the token up in the `token_cache` before the database.
+    """
+
+    def authenticate_credentials(self, key: str) -> Tuple[User, Token]:
+        token = get_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return token.user, token
+
+
+async def get_user(token_key: Optional[str]) -> Union[User, AnonymousUser]:
     if token_key:
-        try:
-            token = Token.objects.get(key=token_key)
-            close_old_connections()
+        # A cached token doesn't need a thread for the database
+        token = token_cache.get(token_key) or await database_sync_to_async(load_token)(token_key)
+        if token is not None and token.user.is_active:
             return token.user
-        except Token.DoesNotExist:
-            logging.error(f"Someone is trying to use a non-existing token: {token_key}")
     return AnonymousUser()
 
 
 class TokenAuthMiddleware:
     """
-    Token authorization middleware for Django Channels 3
+    Token authorization middleware for Django Channels 3, which puts the user of the token into the scope.
+
+    The token is taken from the first of:
+    - the `Authorization: Token <key>` header, for the clients which can set headers
+    - the `token.<key>` subprotocol, for the browsers, which cannot. It is removed from the `subprotocols`
+      of the scope and, unless the consumer picks another subprotocol, echoed on accept as the browsers require
+    - the `token` cookie
+    Nothing else is done, in particular there are no sessions.
     """
+    SUBPROTOCOL_PREFIX = "token."
 
     def __init__(self, inner):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        cookies = scope.get('cookies', {})
-        token_key = cookies.get("token", None)
-        scope["user"] = await get_user(token_key)
+        token_key, cookies = None, {}
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization" and token_key is None:
+                keyword, _, key = value.decode("latin1").partition(" ")
+                if keyword.lower() == TokenAuthentication.keyword.lower():
+                    token_key = key.strip()
+            elif name == b"cookie":
+                cookies = parse_cookie(value.decode("latin1"))
+
+        subprotocols = scope.get("subprotocols", ())
+        token_subprotocol = next((
+            subprotocol for subprotocol in subprotocols if subprotocol.startswith(self.SUBPROTOCOL_PREFIX)
+        ), None)
+        if token_subprotocol is not None:
+            subprotocols = [subprotocol for subprotocol in subprotocols if subprotocol != token_subprotocol]
+            token_key = token_key or token_subprotocol[len(self.SUBPROTOCOL_PREFIX):]
+            send = self._echo_subprotocol(send, token_subprotocol)
+
+        scope = dict(
+            scope, cookies=cookies, subprotocols=subprotocols,
+            user=await get_user(token_key or cookies.get("token")),
+        )
         return await self.inner(scope, receive, send)
 
+    @staticmethod
+    def _echo_subprotocol(send, subprotocol: str):
+        async def send_with_subprotocol(message):
+            if message["type"] == "websocket.accept" and not message.get("subprotocol"):
+                message = dict(message, subprotocol=subprotocol)
+            await send(message)
+        return send_with_subprotocol
+
 
 def TokenAuthMiddlewareStack(inner):
-    return CookieMiddleware(SessionMiddleware(TokenAuthMiddleware(inner)))
+    return TokenAuthMiddleware(inner)
@@ -21,7 +21,7 @@ from django.views.generic import TemplateView
 from rest_framework.schemas import get_schema_view
 
 from . import settings
-from .views import HealthCheck, index
+from .views import HealthCheck, Metrics, index
 
 SCHEMA_NAME = "api-schema"
 
@@ -45,6 +45,7 @@ urlpatterns = [
 
     # Health check
     path('health/', HealthCheck.as_view()),
+    path('metrics/', Metrics.as_view(), name="metrics"),
 
 
     # Front end view as an entry point
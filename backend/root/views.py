@@ -2,6 +2,11 @@ from django.http import HttpResponse
 from django.views import View
 from django.views.decorators.cache import never_cache
 from django.views.generic import TemplateView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from srachat import metrics
 
 
 class HealthCheck(View):
@@ -9,4 +14,14 @@ class HealthCheck(View):
         return HttpResponse("ok", content_type="text/plain")
 
 
+class Metrics(APIView):
+    """
+    Counters of the worker process, which serves the request. Available to the staff only.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+
 index = never_cache(TemplateView.as_view(template_name='index.html'))
@@ -1 +1,2 @@
+from .multiplex_consumer import MultiplexRoomConsumer
 from .room_consumer import RoomConsumer
@@ -0,0 +1,254 @@
+from typing import Any, Dict, Optional
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError as ModelValidationError
+from rest_framework.exceptions import ValidationError
+
+from srachat.serializers.comment_serializer import SingleRoomCommentSerializer
+from . import codec
+from .coalescer import get_coalescer
+from .events import RoomControlAction, broadcast_room_frame, room_group_name
+from .outbound import OutboundQueueMixin
+from .room_subscription import RoomSubscription
+from .write_behind import get_write_behind_queue
+
+
+class BaseRoomConsumer(OutboundQueueMixin, AsyncWebsocketConsumer):
+    """
+    Handlers of the room protocol shared by the consumers of a single room and of many rooms.
+
+    Every handler gets the `RoomSubscription` the message is about, and every frame about a room
+    is tagged with its id in the "room" key. Subclasses decide how the subscriptions are created
+    and found (see `get_subscription`) and what happens when a room cannot be followed anymore (`end_subscription`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.user = AnonymousUser()
+        # Whether the frames are sent as MessagePack binary messages instead of JSON text ones
+        self.is_binary = False
+        super().__init__(*args, **kwargs)
+
+    async def accept(self, subprotocol=None):
+        # JSON is the default, the binary frames are used only if the client asks for them
+        offered = self.scope.get("subprotocols", ())
+        if subprotocol is None and codec.MSGPACK_AVAILABLE and codec.MSGPACK_SUBPROTOCOL in offered:
+            subprotocol = codec.MSGPACK_SUBPROTOCOL
+        self.is_binary = subprotocol == codec.MSGPACK_SUBPROTOCOL
+        await super().accept(subprotocol)
+
+    def get_subscription(self, room_id) -> Optional[RoomSubscription]:
+        raise NotImplementedError
+
+    async def end_subscription(self, subscription: RoomSubscription):
+        raise NotImplementedError
+
+    async def subscribe(self, subscription: RoomSubscription, last_seen_id: Optional[int] = None) -> bool:
+        """
+        Adds the socket to the room group, loads the permissions and sends the history.
+        Returns False and sends an error if the room does not exist.
+        """
+        # First add the socket to the room group, so it immediately starts receiving messages
+        await self.channel_layer.group_add(self.get_group_name(subscription), self.channel_name)
+
+        history = await database_sync_to_async(subscription.load)(last_seen_id)
+        if history is None:
+            await self.channel_layer.group_discard(self.get_group_name(subscription), self.channel_name)
+            await self.send_error("Room does not exist.", subscription)
+            return False
+
+        for frame in history:
+            await self.send_room_frame(subscription, frame)
+
+        if not subscription.room.is_active:
+            await self.send_error("Room is inactive, messages cannot be updated.", subscription)
+            await self.end_subscription(subscription)
+        return True
+
+    async def unsubscribe(self, subscription: RoomSubscription):
+        await self.channel_layer.group_discard(self.get_group_name(subscription), self.channel_name)
+
+    def get_group_name(self, subscription: RoomSubscription) -> str:
+        return room_group_name(subscription.room_id, binary=self.is_binary)
+
+    async def handle_room_message(self, subscription: RoomSubscription, data_type: str, data: Any):
+        if data_type == "new_message":
+            await self.handle_new_message(subscription, data)
+        elif data_type == "delete_messages":
+            await self.handle_delete_messages(subscription, data)
+        elif data_type == "join_team":
+            await self.handle_join_team(subscription)
+        elif data_type == "leave_team":
+            await self.handle_leave_team(subscription)
+        elif data_type == "load_more":
+            await self.handle_load_more(subscription, data)
+        elif data_type == "resume":
+            await self.handle_resume(subscription, data)
+
+    async def handle_new_message(self, subscription: RoomSubscription, data: Dict[str, str]):
+        if not subscription.is_authenticated:
+            await self.send_error("Only authenticated users can send messages", subscription)
+            return
+
+        if subscription.is_banned:
+            await self.send_error("You are banned in this room, therefore you cannot send messages", subscription)
+            return
+
+        if not subscription.is_participant:
+            await self.send_error("You are not a participant of any room's team", subscription)
+            return
+
+        body = (data or {}).get("body")
+        if not body:
+            await self.send_error("Empty message body was sent", subscription)
+            return
+
+        if settings.SRACHAT_COMMENT_WRITE_BEHIND:
+            try:
+                pending = subscription.build_pending_comment(body)
+            except ModelValidationError as e:
+                await self.send_error(f"Trying to create a comment with bad data: {e.message_dict}", subscription)
+                return
+            comment = {**SingleRoomCommentSerializer(pending.comment).data, "pending_id": pending.pending_id}
+            await self.broadcast_comment(subscription, comment)
+            await get_write_behind_queue().add(pending)
+            return
+
+        try:
+            comment = await database_sync_to_async(subscription.create_comment)(body)
+        except ValidationError as e:
+            await self.send_error(f"Trying to create a comment with bad data: {e.detail}", subscription)
+            return
+
+        # Send message to room group
+        await self.broadcast_comment(subscription, comment)
+
+    async def handle_delete_messages(self, subscription: RoomSubscription, data: Dict[str, str]):
+        comment_ids = (data or {}).get("ids")
+        if not comment_ids:
+            await self.send_error("No messages were specified for deletion.", subscription)
+            return
+        if not isinstance(comment_ids, list):
+            await self.send_error("Comments ids must be an array of ints.", subscription)
+            return
+
+        error_message = await database_sync_to_async(subscription.delete_comments)(comment_ids)
+        if error_message:
+            await self.send_error(error_message, subscription)
+            return
+        await self.send_room_frame(subscription, {
+            "type": "delete_messages",
+        })
+
+    async def handle_load_more(self, subscription: RoomSubscription, data: Dict[str, Any]):
+        cursor = (data or {}).get("cursor")
+        if not cursor or not isinstance(cursor, str):
+            await self.send_error("Cursor must be specified to load more messages.", subscription)
+            return
+        limit = (data or {}).get("limit", subscription.HISTORY_WINDOW)
+        if not isinstance(limit, int) or limit <= 0:
+            await self.send_error("Limit must be a positive integer.", subscription)
+            return
+
+        try:
+            page = await database_sync_to_async(subscription.get_comments_before)(
+                cursor, min(limit, subscription.LOAD_MORE_MAX_LIMIT)
+            )
+        except ValidationError as e:
+            await self.send_error(f"Cannot load more messages: {e.detail}", subscription)
+            return
+        await self.send_room_frame(subscription, {
+            "type": "load_more",
+            **page
+        })
+
+    async def handle_resume(self, subscription: RoomSubscription, data: Dict[str, Any]):
+        last_seen_id = (data or {}).get("last_seen_id")
+        if not isinstance(last_seen_id, int):
+            await self.send_error("Id of the last seen message must be an integer.", subscription)
+            return
+        for frame in await database_sync_to_async(subscription.get_history_frames)(last_seen_id):
+            await self.send_room_frame(subscription, frame)
+
+    async def handle_leave_team(self, subscription: RoomSubscription):
+        if not subscription.is_participant:
+            await self.send_error("Not a participant", subscription)
+            return
+        subscription.leave_team()
+
+    async def handle_join_team(self, subscription: RoomSubscription):
+        if subscription.is_participant:
+            await self.send_error("Already a participant", subscription)
+            return
+        if not subscription.is_authenticated:
+            await self.send_error("Only authenticated users can join a team", subscription)
+            return
+        await database_sync_to_async(subscription.refresh_participation)()
+
+    async def send_frame(self, content: Dict[str, Any]):
+        if self.is_binary:
+            await self.send(bytes_data=codec.encode_binary(content))
+        else:
+            await self.send(text_data=codec.encode(content))
+
+    async def send_room_frame(self, subscription: RoomSubscription, content: Dict[str, Any]):
+        await self.send_frame({"room": subscription.room_id, **content})
+
+    async def send_error(self, error_message: str, subscription: Optional[RoomSubscription] = None):
+        content = {
+            "type": "error",
+            "error_message": error_message
+        }
+        if subscription is None:
+            await self.send_frame(content)
+        else:
+            await self.send_room_frame(subscription, content)
+
+    async def broadcast_comment(self, subscription: RoomSubscription, comment: Dict[str, Any]):
+        window = settings.SRACHAT_BROADCAST_COALESCE_MS
+        if not window:
+            await self.group_broadcast(subscription, {
+                "type": "new_message",
+                "comments": [comment]
+            })
+            return
+
+        coalescer = get_coalescer(
+            self.channel_layer, subscription.room_id, window / 1000, settings.SRACHAT_BROADCAST_COALESCE_MAX_COMMENTS
+        )
+        await coalescer.add(comment)
+
+    async def group_broadcast(self, subscription: RoomSubscription, content: Dict[str, Any]):
+        """
+        Sends the frame to every socket of the room, see `events.broadcast_room_frame`.
+        """
+        await broadcast_room_frame(self.channel_layer, subscription.room_id, {"room": subscription.room_id, **content})
+
+    # Receive a permission change from room group
+    async def room_control(self, event):
+        subscription = self.get_subscription(event.get("room_id"))
+        if subscription is None or subscription.room is None:
+            # The state of a room, which is still being loaded, is read after the change
+            return
+
+        if event["action"] == RoomControlAction.DEACTIVATE:
+            subscription.room.is_active = False
+            await self.send_error("Room is inactive, messages cannot be updated.", subscription)
+            await self.end_subscription(subscription)
+            return
+
+        if subscription.apply_control(event):
+            await self.send_room_frame(subscription, subscription.get_membership_frame())
+
+    # Receive a pre-encoded frame from room group
+    async def broadcast(self, event):
+        # Send it to WebSocket as is
+        if 'bytes' in event:
+            await self.send(bytes_data=event['bytes'])
+        elif not self.is_binary:
+            await self.send(text_data=event['text'])
+        else:
+            # Sent by a worker without msgpack
+            await self.send(bytes_data=codec.encode_binary(codec.decode(event['text'])))
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from .events import broadcast_room_frame
+
+
+class BroadcastCoalescer:
+    """
+    Merges new comments of a single room into one `new_message` frame.
+
+    The first comment opens a window of `window` seconds. Every comment added during the window
+    is sent together with it in a single group_send, so under bursts the channel layer and every socket
+    of the room handle one frame instead of dozens. The frame is sent earlier, when `max_comments` is reached.
+
+    There is one coalescer per room in a worker process, see `get_coalescer`.
+    """
+
+    def __init__(self, channel_layer, room_id: int, window: float, max_comments: int):
+        self.channel_layer = channel_layer
+        self.room_id = room_id
+        self.window = window
+        self.max_comments = max_comments
+
+        self.pending: List[Dict[str, Any]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def add(self, comment: Dict[str, Any]):
+        self.pending.append(comment)
+        if len(self.pending) >= self.max_comments:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        comments, self.pending = self.pending, []
+        if not comments:
+            return
+        if _coalescers.get(self.room_id) is self:
+            # The coalescer is recreated by the next comment, so the idle rooms don't pile up in the memory
+            del _coalescers[self.room_id]
+
+        await broadcast_room_frame(
+            self.channel_layer, self.room_id, {"type": "new_message", "room": self.room_id, "comments": comments}
+        )
+
+
+_coalescers: Dict[int, BroadcastCoalescer] = {}
+
+
+def get_coalescer(channel_layer, room_id: int, window: float, max_comments: int) -> BroadcastCoalescer:
+    if room_id not in _coalescers:
+        _coalescers[room_id] = BroadcastCoalescer(channel_layer, room_id, window, max_comments)
+    return _coalescers[room_id]
@@ -0,0 +1,52 @@
+"""
+Encoding and decoding of the websocket frames.
+
+Every frame the consumers send or receive goes through these functions,
+so the wire format can be changed in one place. The JSON itself is done by `srachat.fast_json`.
+
+Clients, which offer the `srachat.msgpack` subprotocol, get the same frames encoded by MessagePack
+as binary websocket messages instead, if msgpack is installed (see `BaseRoomConsumer.accept`).
+"""
+from typing import Any, Dict, Optional
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .. import fast_json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "srachat.msgpack"
+# Whether the binary frames can be used
+MSGPACK_AVAILABLE = msgpack is not None
+
+# Whatever MessagePack doesn't know is converted the same way it is for JSON, e.g. datetimes become strings
+_to_builtin = JSONEncoder().default
+
+
+def encode(content: Dict[str, Any]) -> str:
+    return fast_json.dumps(content).decode()
+
+
+def decode(text_data: str) -> Dict[str, Any]:
+    return fast_json.loads(text_data)
+
+
+def encode_binary(content: Dict[str, Any]) -> bytes:
+    return msgpack.packb(content, default=_to_builtin)
+
+
+def decode_binary(bytes_data: bytes) -> Dict[str, Any]:
+    # Strings as map keys only, as they are in JSON
+    return msgpack.unpackb(bytes_data, strict_map_key=True)
+
+
+def decode_frame(text_data: Optional[str], bytes_data: Optional[bytes]) -> Dict[str, Any]:
+    """
+    Decodes a frame received from a client, which can be either text or binary whatever subprotocol was agreed on.
+    """
+    if bytes_data is not None:
+        return decode_binary(bytes_data)
+    return decode(text_data)
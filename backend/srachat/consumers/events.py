@@ -0,0 +1,50 @@
+"""
+Events sent to the room consumers from outside of them, e.g. from the REST views.
+"""
+from typing import Any, Dict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import codec
+
+
+class RoomControlAction:
+    BAN = "ban"
+    UNBAN = "unban"
+    DEACTIVATE = "deactivate"
+    TEAM_CHANGE = "team_change"
+
+
+def room_group_name(room_id, binary: bool = False) -> str:
+    """
+    Group of the sockets of the room, which get JSON text frames, or of the ones, which get MessagePack binary frames.
+    """
+    return f"chat_{room_id}.msgpack" if binary else f"chat_{room_id}"
+
+
+async def broadcast_room_frame(channel_layer, room_id: int, content: Dict[str, Any]):
+    """
+    Sends the frame to every socket of the room. It is encoded once per encoding instead of once per socket,
+    and every group gets only its own encoding, which the consumers forward as is (see `BaseRoomConsumer.broadcast`).
+    """
+    await channel_layer.group_send(room_group_name(room_id), {"type": "broadcast", "text": codec.encode(content)})
+    # A worker without msgpack leaves the encoding to the consumers of the binary sockets
+    binary = {"bytes": codec.encode_binary(content)} if codec.MSGPACK_AVAILABLE else {"text": codec.encode(content)}
+    await channel_layer.group_send(room_group_name(room_id, binary=True), {"type": "broadcast", **binary})
+
+
+def publish_room_control(room_id: int, action: str, **payload):
+    """
+    Sends a small control event to every socket of the room, once the current transaction is committed.
+    The consumers update their cached permission state from it, so they never re-query it per message.
+    """
+    channel_layer = get_channel_layer()
+    event = {"type": "room_control", "action": action, "room_id": room_id, **payload}
+
+    def send():
+        for binary in (False, True):
+            async_to_sync(channel_layer.group_send)(room_group_name(room_id, binary), event)
+
+    transaction.on_commit(send)
@@ -0,0 +1,90 @@
+from typing import Dict, Optional
+
+from . import codec
+from .base import BaseRoomConsumer
+from .room_subscription import RoomSubscription
+
+
+class MultiplexRoomConsumer(BaseRoomConsumer):
+    """
+    Consumer following many rooms over a single socket, for the clients, which would otherwise open
+    a `RoomConsumer` socket per room. The connection, its authentication and its channel are shared,
+    while every followed room keeps its own `RoomSubscription` with the permissions of the user in it.
+
+    Protocol: the room messages of `RoomConsumer` with the id of the room they are about in the "room" key
+    (except `ack`, which is about the socket), plus
+        client -> server: subscribe {"room": int, "data": {"last_seen_id": int}}, unsubscribe {"room": int}
+        server -> client: unsubscribed {"room": int}
+    Every server frame about a room carries its id in the "room" key. A subscription is answered with
+    the same history frames a `RoomConsumer` sends on connect.
+
+    A deactivated room is unsubscribed after the error frame instead of closing the socket.
+    Frames of a room broadcast right before it was unsubscribed might still arrive and should be ignored.
+    """
+
+    MAX_SUBSCRIPTIONS = 50
+
+    def __init__(self, *args, **kwargs):
+        self.subscriptions: Dict[int, RoomSubscription] = {}
+        super().__init__(*args, **kwargs)
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for subscription in list(self.subscriptions.values()):
+            await self.unsubscribe(subscription)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        content = codec.decode_frame(text_data, bytes_data)
+        if self.receive_ack(content):
+            return
+        data_type = content.get("type")
+        data = content.get("data")
+        room_id = content.get("room")
+        if not isinstance(room_id, int):
+            await self.send_error("Room id must be an integer.")
+            return
+
+        if data_type == "subscribe":
+            await self.handle_subscribe(room_id, data)
+            return
+
+        subscription = self.get_subscription(room_id)
+        if subscription is None:
+            await self.send_error("Not subscribed to the room.")
+            return
+        if data_type == "unsubscribe":
+            await self.unsubscribe(subscription)
+            await self.send_room_frame(subscription, {"type": "unsubscribed"})
+        else:
+            await self.handle_room_message(subscription, data_type, data)
+
+    async def handle_subscribe(self, room_id: int, data: Optional[Dict[str, int]]):
+        if room_id in self.subscriptions:
+            await self.send_error("Already subscribed to the room.")
+            return
+        if len(self.subscriptions) >= self.MAX_SUBSCRIPTIONS:
+            await self.send_error(f"Cannot follow more than {self.MAX_SUBSCRIPTIONS} rooms over a single socket.")
+            return
+        last_seen_id = (data or {}).get("last_seen_id")
+        if last_seen_id is not None and not isinstance(last_seen_id, int):
+            await self.send_error("Id of the last seen message must be an integer.")
+            return
+
+        subscription = RoomSubscription(room_id, self.user)
+        # Registered before the history is loaded, so the control events sent in the meantime are not lost
+        self.subscriptions[room_id] = subscription
+        if not await self.subscribe(subscription, last_seen_id):
+            self.subscriptions.pop(room_id, None)
+
+    async def unsubscribe(self, subscription: RoomSubscription):
+        self.subscriptions.pop(subscription.room_id, None)
+        await super().unsubscribe(subscription)
+
+    def get_subscription(self, room_id) -> Optional[RoomSubscription]:
+        return self.subscriptions.get(room_id)
+
+    async def end_subscription(self, subscription: RoomSubscription):
+        await self.unsubscribe(subscription)
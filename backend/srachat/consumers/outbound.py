@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from django.conf import settings
+
+from srachat import metrics
+from . import codec
+
+
+class SlowConsumerPolicy:
+    # Forget the oldest frame waiting for the socket
+    DROP_OLDEST = "drop_oldest"
+    # Forget every waiting frame and ask the client to reload the state
+    RESYNC = "resync"
+    # Close the socket
+    DISCONNECT = "disconnect"
+
+    choices = (DROP_OLDEST, RESYNC, DISCONNECT)
+
+
+class OutboundQueue:
+    """
+    Bounded queue of the messages waiting to be written to a single socket.
+
+    daphne accepts every write right away and buffers it in the worker until the client reads it,
+    so awaiting the socket doesn't show a slow client. Clients, which acknowledge the frames they have received
+    (see `ack`), get at most `window` frames ahead of their last acknowledgement: the next ones wait in the queue.
+    A single writer task sends the messages one by one, so a client, which doesn't keep up with the room,
+    accumulates at most `max_size` messages in the worker. On overflow the policy decides what is lost,
+    and the `outbound_queue.<policy>` counter is incremented (see `srachat.metrics`).
+    Clients, which never acknowledge, are not limited, their frames never wait in the queue.
+    """
+
+    def __init__(
+            self, base_send: Callable[[Dict[str, Any]], Awaitable], max_size: int, policy: str, binary: bool = False,
+            window: Optional[int] = None
+    ):
+        if policy not in SlowConsumerPolicy.choices:
+            raise ValueError(f"Slow consumer policy should be one of {SlowConsumerPolicy.choices}, got {policy}")
+        self.base_send = base_send
+        self.max_size = max_size
+        self.policy = policy
+        # The resync frame is encoded the way the other frames of the socket are
+        self.binary = binary
+        # Maximum amount of the frames sent and not acknowledged yet, None disables the acknowledgements
+        self.window = window
+
+        self.messages: Deque[Dict[str, Any]] = deque()
+        self.has_messages = asyncio.Event()
+        self.is_closed = False
+        self.writer: Optional[asyncio.Task] = None
+        # Frames written to the socket and the ones the client has reported as received, if it ever did
+        self.sent = 0
+        self.acknowledged: Optional[int] = None
+        self.has_acknowledgements = asyncio.Event()
+
+    def start(self):
+        self.writer = asyncio.ensure_future(self._write())
+
+    async def stop(self):
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+
+    def put(self, message: Dict[str, Any]):
+        if self.is_closed:
+            return
+        if message["type"] == "websocket.close":
+            self.is_closed = True
+        elif len(self.messages) >= self.max_size:
+            metrics.increment(f"outbound_queue.{self.policy}")
+            if self.policy == SlowConsumerPolicy.DROP_OLDEST:
+                self.messages.popleft()
+            elif self.policy == SlowConsumerPolicy.RESYNC:
+                self.messages.clear()
+                content = {"type": "resync_required", "reason": "slow_consumer"}
+                self.messages.append(
+                    {"type": "websocket.send", "bytes": codec.encode_binary(content)} if self.binary
+                    else {"type": "websocket.send", "text": codec.encode(content)}
+                )
+            else:
+                self.messages.clear()
+                self.is_closed = True
+                message = {"type": "websocket.close"}
+
+        self.messages.append(message)
+        self.has_messages.set()
+
+    def ack(self, received: int):
+        """
+        Records the total amount of the frames the client has received on this socket.
+        The first acknowledgement turns the window on. Amounts behind the previous one are ignored.
+        """
+        if self.window is None:
+            return
+        self.acknowledged = max(self.acknowledged or 0, min(received, self.sent))
+        self.has_acknowledgements.set()
+
+    def is_window_full(self) -> bool:
+        return self.acknowledged is not None and self.sent - self.acknowledged >= self.window
+
+    async def _write(self):
+        while True:
+            if not self.messages:
+                self.has_messages.clear()
+                await self.has_messages.wait()
+                continue
+            if self.messages[0]["type"] == "websocket.send" and self.is_window_full():
+                self.has_acknowledgements.clear()
+                await self.has_acknowledgements.wait()
+                continue
+            message = self.messages.popleft()
+            await self.base_send(message)
+            if message["type"] == "websocket.close":
+                return
+            self.sent += 1
+
+
+class OutboundQueueMixin:
+    """
+    Routes everything a websocket consumer sends after `accept` through an `OutboundQueue`
+    sized by SRACHAT_OUTBOUND_QUEUE_SIZE and SRACHAT_OUTBOUND_WINDOW and governed by SRACHAT_SLOW_CONSUMER_POLICY.
+    Consumers pass the frames they receive to `receive_ack` first.
+    """
+
+    outbound: Optional[OutboundQueue] = None
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol)
+        self.outbound = OutboundQueue(
+            self.base_send, settings.SRACHAT_OUTBOUND_QUEUE_SIZE, settings.SRACHAT_SLOW_CONSUMER_POLICY,
+            binary=subprotocol == codec.MSGPACK_SUBPROTOCOL, window=settings.SRACHAT_OUTBOUND_WINDOW or None
+        )
+        self.outbound.start()
+
+    def receive_ack(self, content: Dict[str, Any]) -> bool:
+        """
+        Handles an `ack {"data": {"received": int}}` frame of the client. Returns whether the frame was one.
+        """
+        if content.get("type") != "ack":
+            return False
+        received = (content.get("data") or {}).get("received")
+        if self.outbound is not None and isinstance(received, int):
+            self.outbound.ack(received)
+        return True
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if self.outbound is None:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        if text_data is not None:
+            self.outbound.put({"type": "websocket.send", "text": text_data})
+        elif bytes_data is not None:
+            self.outbound.put({"type": "websocket.send", "bytes": bytes_data})
+        else:
+            raise ValueError("You must pass one of bytes_data or text_data")
+        if close:
+            await self.close(close)
+
+    async def close(self, code=None):
+        if self.outbound is None:
+            await super().close(code)
+            return
+        message = {"type": "websocket.close"}
+        if code is not None and code is not True:
+            message["code"] = code
+        self.outbound.put(message)
+
+    async def websocket_disconnect(self, message):
+        if self.outbound is not None:
+            await self.outbound.stop()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,183 @@
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from django.contrib.auth.models import User
+
+from srachat.models import Comment
+from srachat.models.room import Room
+from srachat.models.user import Participation
+from srachat.pagination import KeysetPage, get_page_before
+from srachat.serializers.comment_serializer import SingleRoomCommentSerializer
+from .events import RoomControlAction
+from .write_behind import PendingComment
+
+
+class RoomSubscription:
+    """
+    A socket following a single room: the room, the permissions of the socket's user in it
+    and the database work done on their behalf.
+
+    The methods touching the database are sync, the consumers call them through `database_sync_to_async`.
+
+    A new socket gets the newest HISTORY_WINDOW comments, older ones are paged by `load_more`.
+    A resumed socket (`last_seen_id`) gets only the comments after the last seen one, or `resync_required`
+    followed by the history window if it has missed more than RESUME_MAX_GAP of them.
+    """
+
+    HISTORY_WINDOW = 50
+    LOAD_MORE_MAX_LIMIT = 100
+    RESUME_MAX_GAP = 200
+
+    def __init__(self, room_id, user):
+        self.room_id = room_id
+        self.user = user
+        self.room: Optional[Room] = None
+        self.chat_user_id = None
+
+        self.is_authenticated = isinstance(user, User)
+        self.is_banned = False
+        # Admins and a creator of the room are not affected by the bans
+        self.is_ban_immune = False
+        self.is_participant = False
+        self.user_team_number = None
+
+    def load(self, last_seen_id: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Loads everything needed to know about the room and the user in two queries:
+        the room annotated with the user's membership and the history window.
+        Sets the permission flags and returns the history frames to be sent, or None if the room does not exist.
+        """
+        rooms = Room.objects.all()
+        if self.is_authenticated:
+            rooms = rooms.with_membership(self.user)
+        try:
+            self.room = rooms.get(id=self.room_id)
+        except (Room.DoesNotExist, ValueError):
+            return None
+        # The id from the url is a string
+        self.room_id = self.room.id
+
+        # Make all checks one time at the connection
+        if self.is_authenticated:
+            self.chat_user_id = self.room.member_chat_user_id
+            self.is_ban_immune = self.room.member_is_admin or self.room.creator_id == self.chat_user_id
+            self.is_banned = self.room.member_is_banned and not self.is_ban_immune
+            self._set_participation(self.room.member_team_number)
+
+        return self.get_history_frames(last_seen_id)
+
+    def get_history_frames(self, last_seen_id: Optional[int]) -> List[Dict[str, Any]]:
+        if last_seen_id is not None:
+            # One extra comment is fetched to detect the gap, which is too large to be resumed
+            missed = list(
+                self.room.comments.filter(pk__gt=last_seen_id).order_by("created", "pk")[:self.RESUME_MAX_GAP + 1]
+            )
+            if len(missed) <= self.RESUME_MAX_GAP:
+                return [{
+                    "type": "new_message",
+                    "comments": SingleRoomCommentSerializer(missed, many=True).data,
+                    "resumed": True,
+                }]
+            resync = [{"type": "resync_required", "max_gap": self.RESUME_MAX_GAP}]
+        else:
+            resync = []
+
+        window = self._serialize_page(get_page_before(self.room.comments.all(), self.HISTORY_WINDOW))
+        return resync + [{"type": "new_message", **window}]
+
+    def get_comments_before(self, cursor: str, limit: int) -> Dict[str, Any]:
+        """
+        Returns the serialized page of comments older than the cursor. Raises ValidationError for a broken cursor.
+        """
+        return self._serialize_page(get_page_before(self.room.comments.all(), limit, cursor))
+
+    @staticmethod
+    def _serialize_page(page: KeysetPage) -> Dict[str, Any]:
+        return {
+            "comments": SingleRoomCommentSerializer(page.objects, many=True).data,
+            "cursor": page.cursor,
+            "has_more": page.has_more,
+        }
+
+    def create_comment(self, body: str) -> Dict[str, Any]:
+        """
+        Validates and saves the comment. Raises ValidationError if the data is wrong.
+        """
+        serializer = SingleRoomCommentSerializer(data={
+            "body": body,
+            "creator": self.chat_user_id,
+            "team_number": self.user_team_number
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save(room=self.room)
+        return serializer.data
+
+    def build_pending_comment(self, body: str) -> PendingComment:
+        """
+        Validates the comment without any queries: the creator, their team and the room are known since the connect.
+        Raises django ValidationError if the data is wrong.
+        """
+        comment = Comment(
+            body=body, creator_id=self.chat_user_id, room_id=self.room.id, team_number=self.user_team_number
+        )
+        comment.clean_fields(exclude=["creator", "room"])
+        return PendingComment(comment, uuid4().hex)
+
+    def delete_comments(self, comment_ids: List[int]) -> Optional[str]:
+        """
+        Deletes the comments if the user is a creator of all of them. Returns an error message otherwise.
+        """
+        comments = Comment.objects.filter(pk__in=comment_ids, room_id=self.room.id)
+        creator_ids = set(comments.values_list("creator_id", flat=True))
+        if not creator_ids:
+            return "Comments with such ids don't exist."
+        if creator_ids != {self.chat_user_id}:
+            return "You should be a creator of all selected messages to delete them"
+        comments.delete()
+        return None
+
+    def refresh_participation(self):
+        self._set_participation(
+            Participation.objects
+            .filter(chatuser_id=self.chat_user_id, room_id=self.room.id)
+            .values_list("team_number", flat=True)
+            .first()
+        )
+
+    def _set_participation(self, team_number: Optional[int]):
+        if team_number is not None:
+            self.is_participant = True
+            self.user_team_number = team_number
+
+    def leave_team(self):
+        self.is_participant = False
+        self.user_team_number = None
+
+    def apply_control(self, event: Dict[str, Any]) -> bool:
+        """
+        Updates the permissions from a `room_control` event about a member of the room.
+        Returns whether the event was about the user.
+        """
+        if self.chat_user_id is None or event.get("chat_user_id") != self.chat_user_id:
+            return False
+        action = event["action"]
+        if action == RoomControlAction.BAN:
+            # Banned users are removed from the teams as well
+            self.is_banned = not self.is_ban_immune
+            self.leave_team()
+        elif action == RoomControlAction.UNBAN:
+            self.is_banned = False
+        elif action == RoomControlAction.TEAM_CHANGE:
+            self.is_participant = event["team_number"] is not None
+            self.user_team_number = event["team_number"]
+        else:
+            return False
+        return True
+
+    def get_membership_frame(self) -> Dict[str, Any]:
+        return {
+            "type": "membership",
+            "is_banned": self.is_banned,
+            "is_participant": self.is_participant,
+            "team_number": self.user_team_number,
+        }
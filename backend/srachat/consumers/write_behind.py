@@ -0,0 +1,144 @@
+import asyncio
+import atexit
+import logging
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+
+from srachat.models import Comment
+from .events import broadcast_room_frame
+
+logger = logging.getLogger(__name__)
+
+
+class PendingComment(NamedTuple):
+    comment: Comment
+    # Temporary id the clients have seen the comment with until it is saved
+    pending_id: str
+
+
+def persist_comments(comments: List[Comment]):
+    """
+    Saves the comments in a single transaction and in the given order,
+    so their ids grow in the same order the comments were shown to the clients.
+    """
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Comment.objects.bulk_create(comments)
+            # bulk_create skips Comment.save, which counts the comments in their rooms
+            Comment.count_in_rooms(comments)
+        else:
+            # The backend cannot return the ids from a bulk insert, which are needed to notify the clients
+            for comment in comments:
+                comment.save()
+
+
+def persist_batch(batch: List[PendingComment]) -> Tuple[List[PendingComment], List[PendingComment]]:
+    """
+    Saves the batch and returns the saved and the failed comments.
+    If the batch cannot be saved as a whole, the comments are saved one by one,
+    so a single broken comment (e.g. of a room deleted in the meantime) doesn't take the rest of the batch down.
+    """
+    try:
+        persist_comments([pending.comment for pending in batch])
+        return batch, []
+    except Exception:
+        logger.exception(f"Failed to save a batch of {len(batch)} comments, saving them one by one")
+
+    saved, failed = [], []
+    for pending in batch:
+        # The ids might have been assigned before the rollback
+        pending.comment.pk = None
+        pending.comment._state.adding = True
+        try:
+            persist_comments([pending.comment])
+            saved.append(pending)
+        except Exception:
+            logger.exception(f"Failed to save the comment {pending.pending_id}")
+            failed.append(pending)
+    return saved, failed
+
+
+class CommentWriteBehindQueue:
+    """
+    Queue of the comments, which have already been broadcast, but not saved yet.
+
+    Comments are saved in batches of SRACHAT_COMMENT_WRITE_BEHIND_BATCH_SIZE or after
+    SRACHAT_COMMENT_WRITE_BEHIND_MS since the first comment of the batch was accepted, whatever comes first.
+    After a batch is saved, every room it touched gets a `comments_persisted` frame mapping the pending ids
+    to the real ones, or `comments_failed` with the pending ids of the comments, which couldn't be saved.
+
+    The comments still waiting in the queue are saved synchronously when the worker process exits.
+    """
+
+    def __init__(self):
+        self.pending: List[PendingComment] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def add(self, pending: PendingComment):
+        self.pending.append(pending)
+        if len(self.pending) >= settings.SRACHAT_COMMENT_WRITE_BEHIND_BATCH_SIZE:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.SRACHAT_COMMENT_WRITE_BEHIND_MS / 1000)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        # Batches are saved one after another in the database thread, so their order is kept
+        saved, failed = await database_sync_to_async(persist_batch)(batch)
+        await self._notify(saved, failed)
+
+    @staticmethod
+    async def _notify(saved: List[PendingComment], failed: List[PendingComment]):
+        persisted_by_room: Dict[int, Dict[str, int]] = defaultdict(dict)
+        for pending in saved:
+            persisted_by_room[pending.comment.room_id][pending.pending_id] = pending.comment.pk
+        failed_by_room: Dict[int, List[str]] = defaultdict(list)
+        for pending in failed:
+            failed_by_room[pending.comment.room_id].append(pending.pending_id)
+
+        channel_layer = get_channel_layer()
+        for room_id, ids in persisted_by_room.items():
+            await broadcast_room_frame(
+                channel_layer, room_id, {"type": "comments_persisted", "room": room_id, "ids": ids}
+            )
+        for room_id, pending_ids in failed_by_room.items():
+            await broadcast_room_frame(channel_layer, room_id, {
+                "type": "comments_failed",
+                "room": room_id,
+                "pending_ids": pending_ids,
+                "error_message": "Messages could not be saved, please send them again."
+            })
+
+    def flush_sync(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            saved, failed = persist_batch(batch)
+            if failed:
+                logger.error(f"{len(failed)} comments were lost on shutdown: {[p.pending_id for p in failed]}")
+
+
+_queue: Optional[CommentWriteBehindQueue] = None
+
+
+def get_write_behind_queue() -> CommentWriteBehindQueue:
+    global _queue
+    if _queue is None:
+        _queue = CommentWriteBehindQueue()
+        atexit.register(_queue.flush_sync)
+    return _queue
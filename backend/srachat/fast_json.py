@@ -0,0 +1,43 @@
+"""
+JSON encoding shared by the REST API (`srachat.renderers`, `srachat.parsers`) and the websocket frames
+(`srachat.consumers.codec`).
+
+orjson is used when it is installed, otherwise the standard library. Both produce the same documents
+as DRF's `JSONRenderer` with the default settings: compact, not ASCII-escaped, datetimes in ISO 8601 with `Z`
+for UTC. Whatever neither of them knows (lazy translations, decimals, querysets, ...) is converted
+by DRF's `JSONEncoder`. `ErrorDetail` is a `str`, which both of them encode natively.
+"""
+import json
+from typing import Any, Union
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Whether orjson is used
+FAST = orjson is not None
+
+_encoder = JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def stdlib_dumps(obj: Any) -> bytes:
+    return _encoder.encode(obj).encode()
+
+
+def stdlib_loads(data: Union[bytes, str]) -> Any:
+    return json.loads(data)
+
+
+if FAST:
+    _OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_encoder.default, option=_OPTIONS)
+
+    # Raises `orjson.JSONDecodeError`, which is a `json.JSONDecodeError`
+    loads = orjson.loads
+else:  # pragma: no cover
+    dumps, loads = stdlib_dumps, stdlib_loads
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from srachat.models.room import RoomVoteShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds the vote shards (see SRACHAT_VOTE_COUNTER_SHARDS) into the vote counters of the rooms, "
+        "once or every --interval seconds. With --rebuild recounts the counters from the votes instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="keep folding the shards every this amount of seconds")
+        parser.add_argument("--rebuild", action="store_true", help="recount the counters from the votes")
+        parser.add_argument("--room", type=int, nargs="+", dest="room_ids", help="only these rooms")
+
+    def handle(self, *args, interval=None, rebuild=False, room_ids=None, **options):
+        if rebuild:
+            if interval is not None:
+                raise CommandError("--interval cannot be combined with --rebuild")
+            rooms = RoomVoteShard.rebuild(room_ids)
+            self.stdout.write(f"Recounted the votes of {rooms} rooms")
+            return
+
+        while True:
+            rooms = RoomVoteShard.fold(room_ids)
+            if interval is None:
+                self.stdout.write(f"Folded the vote shards of {rooms} rooms")
+                return
+            if rooms:
+                self.stdout.write(f"Folded the vote shards of {rooms} rooms")
+            time.sleep(interval)
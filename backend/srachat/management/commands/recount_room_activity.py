@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from srachat.models import Room
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts the participants, the comments and the time of the last comment of the rooms "
+        "from their rows, e.g. after loading fixtures or bulk changes, which skip the counters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, nargs="+", dest="room_ids", help="only these rooms")
+
+    def handle(self, *args, room_ids=None, **options):
+        rooms = Room.objects.all() if room_ids is None else Room.objects.filter(pk__in=room_ids)
+        self.stdout.write(f"Recounted the activity of {rooms.recount_activity()} rooms")
@@ -0,0 +1,122 @@
+"""
+Relation of the user of a request to the rooms, shared by the permissions and the views of the request.
+
+Everything is resolved on the first use and memoized for the rest of the request:
+the id of the user's ChatUser costs a query, the membership in a room costs a single query
+of the room annotated by `RoomQuerySet.with_membership` (which resolves the ChatUser id as well),
+or none at all if the room was fetched with these annotations.
+"""
+from typing import Dict, NamedTuple, Optional, Union
+
+from django.db.models import QuerySet
+from rest_framework.permissions import SAFE_METHODS
+
+from .models import ChatUser, Room
+
+
+class RoomMembership(NamedTuple):
+    chat_user_id: Optional[int]
+    is_creator: bool
+    is_admin: bool
+    is_banned: bool
+    team_number: Optional[int]
+
+    @classmethod
+    def from_room(cls, room: Room) -> "RoomMembership":
+        """
+        Reads the membership from a room annotated by `RoomQuerySet.with_membership`.
+        """
+        return cls(
+            chat_user_id=room.member_chat_user_id,
+            is_creator=room.member_chat_user_id is not None and room.creator_id == room.member_chat_user_id,
+            is_admin=room.member_is_admin,
+            is_banned=room.member_is_banned,
+            team_number=room.member_team_number,
+        )
+
+    @property
+    def is_participant(self) -> bool:
+        return self.team_number is not None
+
+    @property
+    def is_ban_immune(self) -> bool:
+        # Admins and a creator of the room are not affected by the bans
+        return self.is_admin or self.is_creator
+
+    @property
+    def is_allowed(self) -> bool:
+        return not self.is_banned or self.is_ban_immune
+
+
+NOT_A_MEMBER = RoomMembership(chat_user_id=None, is_creator=False, is_admin=False, is_banned=False, team_number=None)
+
+
+class MembershipContext:
+    """
+    Memoized ChatUser of the request's user and their membership in the rooms, see the module documentation.
+    The values are read once, so they describe the user as they were before the request changed anything.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.is_authenticated = bool(user and user.is_authenticated)
+        self._chat_user_id: Optional[int] = None
+        self._chat_user: Optional[ChatUser] = None
+        self._rooms: Dict[int, RoomMembership] = {}
+
+    @property
+    def chat_user_id(self) -> Optional[int]:
+        if self._chat_user_id is None and self.is_authenticated:
+            self._chat_user_id = ChatUser.objects.values_list("id", flat=True).get(user_id=self.user.pk)
+        return self._chat_user_id
+
+    def get_chat_user(self) -> ChatUser:
+        """
+        The ChatUser object itself, for the views, which need more than its id.
+        """
+        if self._chat_user is None:
+            self._chat_user = ChatUser.objects.get(user_id=self.user.pk)
+            self._chat_user_id = self._chat_user.id
+        return self._chat_user
+
+    def for_room(self, room: Union[Room, int]) -> RoomMembership:
+        """
+        Membership in the room, which is given as an object or by its id.
+        """
+        if not self.is_authenticated:
+            return NOT_A_MEMBER
+        room_id = room.pk if isinstance(room, Room) else room
+        membership = self._rooms.get(room_id)
+        if membership is None:
+            if not hasattr(room, "member_chat_user_id"):
+                room = Room.objects.with_membership(self.user).only("id", "creator_id").get(pk=room_id)
+            membership = self._rooms[room_id] = RoomMembership.from_room(room)
+            self._chat_user_id = membership.chat_user_id
+        return membership
+
+
+def get_membership(request) -> MembershipContext:
+    """
+    Returns the membership context of the request, creating it on the first call.
+    """
+    context = getattr(request, "srachat_membership", None)
+    if context is None or context.user is not request.user:
+        context = request.srachat_membership = MembershipContext(request.user)
+    return context
+
+
+class RoomMembershipMixin:
+    """
+    Mixin of the views of a single room. The room of an unsafe request is fetched annotated with the membership
+    of the user, so the permissions and the view read it without extra queries (safe requests are not checked).
+    """
+
+    def get_queryset(self) -> QuerySet:
+        queryset = super().get_queryset()
+        if self.request.method in SAFE_METHODS or not self.request.user.is_authenticated:
+            return queryset
+        return queryset.with_membership(self.request.user)
+
+    @property
+    def membership(self) -> MembershipContext:
+        return get_membership(self.request)
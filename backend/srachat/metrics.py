@@ -0,0 +1,30 @@
+"""
+Process-local counters of the events worth monitoring, e.g. how often the slow socket policies fire.
+
+Counters are kept per worker process and exposed to the staff by `root.views.Metrics`.
+"""
+import threading
+from collections import Counter
+from typing import Dict
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def increment(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name: str) -> int:
+    return _counters[name]
+
+
+def snapshot() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0002_comment_created_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['room', 'created', 'id'], name='comment_room_created_id'),
+        ),
+    ]
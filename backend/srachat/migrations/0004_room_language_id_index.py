@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0003_comment_room_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['language', 'id'], name='room_language_id'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0004_room_language_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomVoteShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('first_team_votes', models.IntegerField(default=0)),
+                ('second_team_votes', models.IntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_shards', to='srachat.room')),
+            ],
+            options={
+                'unique_together': {('room', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:47
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_participants(apps, schema_editor):
+    Room = apps.get_model("srachat", "Room")
+    for room in Room.objects.annotate(
+        first=Count("participation", filter=Q(participation__team_number=1)),
+        second=Count("participation", filter=Q(participation__team_number=2)),
+    ).filter(Q(first__gt=0) | Q(second__gt=0)).iterator():
+        Room.objects.filter(pk=room.pk).update(first_team_participants=room.first, second_team_participants=room.second)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0005_room_vote_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='first_team_participants',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='second_team_participants',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(count_participants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0006_room_participants_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participation',
+            index=models.Index(fields=['room', 'team_number', 'chatuser'], name='participation_room_team'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='room_active_id'),
+        ),
+        migrations.AddIndex(
+            model_name='roomvote',
+            index=models.Index(fields=['room', 'team_number'], name='roomvote_room_team'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:55
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Room = apps.get_model("srachat", "Room")
+    Comment = apps.get_model("srachat", "Comment")
+    comments = Comment.objects.filter(room_id=OuterRef("pk")).order_by().values("room_id")
+    Room.objects.update(
+        comment_count=Coalesce(Subquery(comments.annotate(amount=Count("pk")).values("amount")), Value(0)),
+        last_comment_at=Subquery(comments.annotate(last=Max("created")).values("last")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('srachat', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_comment_at', 'id'], name='room_active_activity'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
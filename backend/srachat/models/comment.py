@@ -1,21 +1,89 @@
-from django.db import models
+from collections import defaultdict
+from typing import Dict, Iterable
+
+from django.db import models, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
+from .room import Room
 from .team_number import TeamNumber
 
 
+class CommentQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Subtracts the comments from `comment_count` of their rooms, an UPDATE per room, and deletes them.
+        """
+        with transaction.atomic(using=self.db):
+            Comment.uncount_in_rooms(dict(
+                self.order_by().values("room").annotate(amount=Count("id")).values_list("room", "amount")
+            ))
+            return super().delete()
+
+    delete.alters_data = True
+
+
 class Comment(models.Model):
 
     MODIFIABLE_FIELDS = ["body"]
 
     body = models.TextField()
-    created = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, since comments persisted in batches (see consumers.write_behind) keep the time
+    # they were accepted and shown to the clients
+    created = models.DateTimeField(default=timezone.now, editable=False)
     creator = models.ForeignKey("ChatUser", on_delete=models.CASCADE, related_name="created_comment")
     room = models.ForeignKey("Room", on_delete=models.CASCADE, related_name='comments')
     team_number = models.PositiveSmallIntegerField(choices=TeamNumber.choices)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ('created',)
+        indexes = [
+            # Keyset pagination of the room history, see srachat.pagination
+            models.Index(fields=["room", "created", "id"], name="comment_room_created_id"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Comment.count_in_rooms([self])
+
+    @staticmethod
+    def count_in_rooms(comments: Iterable["Comment"]):
+        """
+        Adds the just saved comments to `comment_count` and `last_comment_at` of their rooms, an UPDATE per room.
+        Should be called in the transaction, which saved them. The rooms are locked in the order of their ids.
+        """
+        created_by_room = defaultdict(list)
+        for comment in comments:
+            created_by_room[comment.room_id].append(comment.created)
+        for room_id in sorted(created_by_room):
+            created = created_by_room[room_id]
+            last_comment_at = Value(max(created), output_field=models.DateTimeField())
+            Room.objects.filter(pk=room_id).update(
+                comment_count=F("comment_count") + len(created),
+                # Some databases return NULL as the greatest of NULL and a value
+                last_comment_at=Coalesce(Greatest("last_comment_at", last_comment_at), last_comment_at),
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Comment.uncount_in_rooms({self.room_id: 1})
+            return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def uncount_in_rooms(amounts: Dict[int, int]):
+        """
+        Subtracts the amounts of the comments being deleted (room id -> amount) from `comment_count` of their rooms.
+        Comments deleted together with their room are not subtracted.
+        """
+        Room.objects.decrement({room_id: {"comment_count": amount} for room_id, amount in amounts.items()})
 
     @staticmethod
     def get_comment_or_404(pk):
@@ -23,3 +91,4 @@ class Comment(models.Model):
 
     def __str__(self):
         return self.body
+
@@ -1,10 +1,101 @@
+import random
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
 from django.core.validators import MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import ValidationError
+
 from .tag import Tag
 
 from .language import LanguageChoices
 from .team_number import TeamNumber
+from .user import ChatUser, Participation
+
+
+class RoomQuerySet(models.QuerySet):
+    def with_relations(self) -> "RoomQuerySet":
+        """
+        Prefetches the many-to-many relations shown with every room: tags, admins and banned users.
+        Serializing any amount of the rooms costs three extra queries instead of four per room.
+        """
+        return self.prefetch_related("tags", "admins", "banned_users")
+
+    def only_fields(self, fields: Iterable[str]) -> "RoomQuerySet":
+        """
+        Fetches only the columns and prefetches only the many-to-many relations needed to show the given fields.
+        """
+        relations = {field.name for field in self.model._meta.many_to_many}
+        return self.only(
+            "id", *(field for field in fields if field not in relations)
+        ).prefetch_related(*(field for field in fields if field in relations))
+
+    def with_membership(self, user) -> "RoomQuerySet":
+        """
+        Annotates the rooms with the relation of the given django user to them, using subqueries only:
+        - member_chat_user_id: id of the user's ChatUser
+        - member_is_admin, member_is_banned: whether the user is an admin of / is banned in the room
+        - member_team_number: team number of the user in the room or None if they are not a participant
+        """
+        chat_user_filter = dict(room_id=OuterRef("pk"), chatuser__user_id=user.pk)
+        return self.annotate(
+            member_chat_user_id=Subquery(ChatUser.objects.filter(user_id=user.pk).values("id")[:1]),
+            member_is_admin=Exists(self.model.admins.through.objects.filter(**chat_user_filter)),
+            member_is_banned=Exists(self.model.banned_users.through.objects.filter(**chat_user_filter)),
+            member_team_number=Subquery(
+                Participation.objects.filter(**chat_user_filter).values("team_number")[:1]
+            ),
+        )
+
+    def recount_activity(self) -> int:
+        """
+        Recounts the activity counters of the rooms (see `Room.ACTIVITY_FIELDS`) from the participations
+        and the comments in a single UPDATE. Returns the amount of rooms updated.
+        """
+        comments = self.model._meta.get_field("comments").related_model.objects.filter(
+            room_id=OuterRef("pk")
+        ).order_by().values("room_id")
+        participations = Participation.objects.filter(room_id=OuterRef("pk")).order_by().values("room_id")
+        return self.update(
+            comment_count=Coalesce(Subquery(comments.annotate(amount=Count("pk")).values("amount")), Value(0)),
+            last_comment_at=Subquery(comments.annotate(last=Max("created")).values("last")),
+            **{
+                field: Coalesce(Subquery(
+                    participations.filter(team_number=team_number).annotate(amount=Count("pk")).values("amount")
+                ), Value(0))
+                for team_number, field in self.model.PARTICIPANTS_FIELDS.items()
+            }
+        )
+
+    def decrement(self, amounts: Dict[int, Dict[str, int]]):
+        """
+        Subtracts the amounts (room id -> counter -> amount) from the counters of the rooms, an UPDATE per room
+        in the order of their ids. The counters never go below zero, even if they have drifted.
+        """
+        for room_id in sorted(amounts):
+            self.filter(pk=room_id).update(**{
+                field: Greatest(F(field) - amount, 0) for field, amount in amounts[room_id].items()
+            })
+
+    def with_votes(self) -> "RoomQuerySet":
+        """
+        With SRACHAT_VOTE_COUNTER_SHARDS annotates the rooms with the votes, which are still in their shards
+        and not folded into the room counters yet (`unfolded_first_team_votes`, `unfolded_second_team_votes`),
+        in the same query, so `Room.get_votes` reads a consistent sum. Does nothing without the shards.
+        """
+        if not settings.SRACHAT_VOTE_COUNTER_SHARDS:
+            return self
+        return self.annotate(**{
+            f"unfolded_{field}": Coalesce(Subquery(
+                RoomVoteShard.objects.filter(room_id=OuterRef("pk")).values("room_id").annotate(
+                    votes=Sum(field)
+                ).values("votes")
+            ), Value(0))
+            for field in self.model.VOTES_FIELDS.values()
+        })
 
 
 class Room(models.Model):
@@ -24,7 +115,16 @@ class Room(models.Model):
     ALLOWED_TO_SPECIFY_FIELDS = ["admins", "language", "max_participants_in_team", "image"]
 
     MODIFIABLE_FIELD = REQUIRED_FIELDS + ALLOWED_TO_SPECIFY_FIELDS
-    UNMODIFIABLE_FIELDS = ["banned_users", "created", "creator", "first_team_votes", "second_team_votes", "is_active"]
+    UNMODIFIABLE_FIELDS = [
+        "banned_users", "created", "creator", "first_team_votes", "second_team_votes", "is_active",
+        "first_team_participants", "second_team_participants", "comment_count", "last_comment_at",
+    ]
+    VOTES_FIELDS = {TeamNumber.FIRST_TEAM: "first_team_votes", TeamNumber.SECOND_TEAM: "second_team_votes"}
+    PARTICIPANTS_FIELDS = {
+        TeamNumber.FIRST_TEAM: "first_team_participants", TeamNumber.SECOND_TEAM: "second_team_participants"
+    }
+    # Activity counters kept together with the participations and the comments, see `RoomQuerySet.recount_activity`
+    ACTIVITY_FIELDS = [*PARTICIPANTS_FIELDS.values(), "comment_count", "last_comment_at"]
 
     # Parameters, which should be specified on creation
     tags = models.ManyToManyField(Tag, related_name="rooms")
@@ -35,9 +135,16 @@ class Room(models.Model):
     # Parameters, which can be filled automatically
 
     # Parameters, which are forbidden to be specified ...
+    # Kept by RoomVote and RoomVoteShard, never written by `save` of an existing room
     first_team_votes = models.PositiveSmallIntegerField(default=0)
     second_team_votes = models.PositiveSmallIntegerField(default=0)
     is_active = models.BooleanField(default=True)
+    # Kept by Participation and Comment together with their rows, never written by `save` of an existing room
+    first_team_participants = models.PositiveSmallIntegerField(default=0)
+    second_team_participants = models.PositiveSmallIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Time of the newest comment ever posted, it is not moved back when comments are deleted
+    last_comment_at = models.DateTimeField(null=True, blank=True)
     # ... and even modified
     created = models.DateTimeField(auto_now=True)
     creator = models.ForeignKey("ChatUser", on_delete=models.CASCADE, related_name="created_room")
@@ -54,10 +161,50 @@ class Room(models.Model):
     banned_users = models.ManyToManyField("ChatUser", related_name="forbidden_rooms", blank=True)
     image = models.ImageField(upload_to='images', null=True, blank=True)
 
+    objects = RoomQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Room list filtered by the language, see views.rooms.RoomList
+            models.Index(fields=["language", "id"], name="room_language_id"),
+            # Room list shows only the active rooms, newest first
+            models.Index(fields=["id"], name="room_active_id", condition=Q(is_active=True)),
+            # ... or the ones with comments, the recently commented first
+            models.Index(fields=["last_comment_at", "id"], name="room_active_activity", condition=Q(is_active=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # A stale copy of the activity and the vote counters must not overwrite the changes
+            # made since the room was read, see `RoomVote.cast` and `RoomVoteShard.fold`
+            counters = {*self.ACTIVITY_FIELDS, *self.VOTES_FIELDS.values()}
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in counters
+            ]
+        super().save(*args, **kwargs)
+
     @staticmethod
     def get_room_or_404(pk):
         return get_object_or_404(Room, pk=pk)
 
+    def get_votes(self, team_number: int) -> int:
+        """
+        Votes for the team, including the ones still in the shards (see `RoomVoteShard`).
+        Reads the annotation of `RoomQuerySet.with_votes` if there is one, otherwise queries the shards.
+        """
+        field = self.VOTES_FIELDS[team_number]
+        unfolded = getattr(self, f"unfolded_{field}", None)
+        if unfolded is None:
+            unfolded = 0
+            if self.vote_shards_enabled():
+                unfolded = self.vote_shards.aggregate(votes=Sum(field))["votes"] or 0
+        return getattr(self, field) + unfolded
+
+    @staticmethod
+    def vote_shards_enabled() -> bool:
+        return bool(settings.SRACHAT_VOTE_COUNTER_SHARDS)
+
     def __str__(self):
         return self.title
 
@@ -76,5 +223,130 @@ class RoomVote(models.Model):
     def __str__(self):
         return f"Voter: {self.voter}, Room: {self.room}, Team number: {self.team_number}, Voted: {self.date_voted}"
 
+    @staticmethod
+    def cast(room_id: int, voter_id: int, team_number: int) -> bool:
+        """
+        Records the vote of the voter for the team (0 revokes the vote) and moves the counters of the room
+        in one transaction. The counters are changed by a single UPDATE with F() expressions, so concurrent votes
+        are never lost and neither the room row is read nor its other columns are written.
+        Only the voter's own vote row is locked.
+        With SRACHAT_VOTE_COUNTER_SHARDS the UPDATE goes to a random shard of the room instead of the room itself.
+
+        Returns False if the voter has already voted for this team.
+        Raises ValidationError if a vote is revoked before it was given.
+        """
+        with transaction.atomic():
+            vote, created = RoomVote.objects.select_for_update().get_or_create(
+                room_id=room_id, voter_id=voter_id, defaults={"team_number": team_number}
+            )
+            if created:
+                if team_number == 0:
+                    # Rolls the new vote back
+                    raise ValidationError("You are voting for the first time, specify the team")
+                previous_team_number = 0
+            elif vote.team_number == team_number:
+                return False
+            else:
+                previous_team_number = vote.team_number
+                vote.team_number = team_number
+                vote.save(update_fields=["team_number", "date_voted"])
+
+            deltas = {}
+            if previous_team_number:
+                deltas[Room.VOTES_FIELDS[previous_team_number]] = -1
+            if team_number:
+                deltas[Room.VOTES_FIELDS[team_number]] = 1
+            if Room.vote_shards_enabled():
+                RoomVoteShard.add(room_id, deltas)
+            else:
+                Room.objects.filter(pk=room_id).update(**{field: F(field) + delta for field, delta in deltas.items()})
+        return True
+
     class Meta:
         unique_together = ("voter", "room")
+        indexes = [
+            # Votes of a room by team, see `RoomVoteShard.rebuild`
+            models.Index(fields=["room", "team_number"], name="roomvote_room_team"),
+        ]
+
+
+class RoomVoteShard(models.Model):
+    """
+    One of SRACHAT_VOTE_COUNTER_SHARDS rows, the votes of a room are spread over, so the voters of a popular room
+    don't all wait for the lock of the room row. Holds the votes cast since the shards of the room
+    were last folded into its counters (see `fold`), so a shard goes below zero when votes are revoked.
+    Reads add the shards to the room counters, see `RoomQuerySet.with_votes`.
+    """
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="vote_shards")
+    shard = models.PositiveSmallIntegerField()
+    first_team_votes = models.IntegerField(default=0)
+    second_team_votes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("room", "shard")
+
+    def __str__(self):
+        return f"Room: {self.room_id}, Shard: {self.shard}, Votes: {self.first_team_votes}/{self.second_team_votes}"
+
+    @staticmethod
+    def add(room_id: int, deltas: Dict[str, int]):
+        """
+        Adds the deltas of the room vote counters to a random shard of the room, creating it if needed.
+        """
+        shard = random.randrange(settings.SRACHAT_VOTE_COUNTER_SHARDS)
+        counters = {field: F(field) + delta for field, delta in deltas.items()}
+        shards = RoomVoteShard.objects.filter(room_id=room_id, shard=shard)
+        if not shards.update(**counters):
+            RoomVoteShard.objects.get_or_create(room_id=room_id, shard=shard)
+            shards.update(**counters)
+
+    @staticmethod
+    def fold(room_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Moves the votes from the shards into the counters of their rooms (all of them or the given ones),
+        a room per transaction. Returns the amount of rooms, which had any votes to move.
+        """
+        shards = RoomVoteShard.objects.exclude(first_team_votes=0, second_team_votes=0)
+        if room_ids is not None:
+            shards = shards.filter(room_id__in=room_ids)
+        room_ids = list(shards.values_list("room_id", flat=True).distinct())
+        for room_id in room_ids:
+            with transaction.atomic():
+                # Votes cast in the meantime wait for the locks and land in the emptied shards
+                room_shards = list(RoomVoteShard.objects.select_for_update().filter(room_id=room_id))
+                Room.objects.filter(pk=room_id).update(**{
+                    field: F(field) + sum(getattr(shard, field) for shard in room_shards)
+                    for field in Room.VOTES_FIELDS.values()
+                })
+                RoomVoteShard.objects.filter(pk__in=[shard.pk for shard in room_shards]).update(
+                    **{field: 0 for field in Room.VOTES_FIELDS.values()}
+                )
+        return len(room_ids)
+
+    @staticmethod
+    def rebuild(room_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Recounts the counters of the rooms (all of them or the given ones) from their RoomVote rows
+        and empties their shards, a room per transaction. Returns the amount of rooms recounted.
+
+        The room and its shards are locked before the votes are counted, so a vote cast at the same time
+        is either already counted or still moves a counter after the rebuild, but never both.
+        """
+        rooms = Room.objects.all() if room_ids is None else Room.objects.filter(pk__in=room_ids)
+        room_ids = list(rooms.values_list("pk", flat=True))
+        for room_id in room_ids:
+            with transaction.atomic():
+                list(Room.objects.select_for_update().filter(pk=room_id).values_list("pk"))
+                shard_ids = list(RoomVoteShard.objects.select_for_update().filter(room_id=room_id).values_list(
+                    "pk", flat=True
+                ))
+                votes = dict(RoomVote.objects.filter(room_id=room_id).values_list("team_number").annotate(
+                    votes=Count("pk")
+                ).order_by())
+                Room.objects.filter(pk=room_id).update(**{
+                    field: votes.get(team_number, 0) for team_number, field in Room.VOTES_FIELDS.items()
+                })
+                RoomVoteShard.objects.filter(pk__in=shard_ids).update(
+                    **{field: 0 for field in Room.VOTES_FIELDS.values()}
+                )
+        return len(room_ids)
@@ -1,26 +1,91 @@
+from collections import defaultdict
+from typing import Iterable, Tuple
+
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
 
 from .team_number import TeamNumber
 
 
+class ParticipationQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Subtracts the participations from the participant counters of their rooms, an UPDATE per room and team,
+        and deletes them. Used by `room.chat_users.remove()` as well.
+        """
+        with transaction.atomic(using=self.db):
+            amounts = self.order_by().values("room", "team_number").annotate(amount=Count("id"))
+            Participation.leave_teams(amounts.values_list("room", "team_number", "amount"))
+            return super().delete()
+
+    delete.alters_data = True
+
+
 class Participation(models.Model):
     chatuser = models.ForeignKey("ChatUser", on_delete=models.CASCADE)
     room = models.ForeignKey("Room", on_delete=models.CASCADE)
     team_number = models.PositiveSmallIntegerField(choices=TeamNumber.choices)
 
+    objects = ParticipationQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
-        # TODO: optimize with indexing
-        participants_in_team = Participation.objects.filter(room=self.room, team_number=self.team_number).count()
-        if participants_in_team >= self.room.max_participants_in_team:
-            raise OverflowError(f"Team number {self.team_number} is full.")
-        super().save(*args, **kwargs)
+        """
+        Moves the participant counters of the room (see `Room.PARTICIPANTS_FIELDS`) together with the row.
+        Raises OverflowError if the team has already reached `max_participants_in_team`.
+        The check and the increment are a single conditional UPDATE of the room row,
+        so concurrent joins are serialized by its lock and cannot overfill a team.
+        """
+        rooms = self.get_rooms()
+        with transaction.atomic():
+            previous_team_number = None
+            if not self._state.adding:
+                previous_team_number = (
+                    Participation.objects.filter(pk=self.pk).values_list("team_number", flat=True).first()
+                )
+            if previous_team_number != self.team_number:
+                field = rooms.model.PARTICIPANTS_FIELDS[self.team_number]
+                joined = rooms.filter(
+                    pk=self.room_id, **{f"{field}__lt": F("max_participants_in_team")}
+                ).update(**{field: F(field) + 1})
+                if not joined:
+                    raise OverflowError(f"Team number {self.team_number} is full.")
+                if previous_team_number is not None:
+                    previous_field = rooms.model.PARTICIPANTS_FIELDS[previous_team_number]
+                    rooms.filter(pk=self.room_id).update(**{previous_field: F(previous_field) - 1})
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Participation.leave_teams([(self.room_id, self.team_number, 1)])
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def leave_teams(cls, amounts: Iterable[Tuple[int, int, int]]):
+        """
+        Subtracts the participations being deleted (room id, team number, amount) from the participant counters
+        of the rooms. Participations deleted together with their room are not subtracted.
+        """
+        rooms = cls.get_rooms()
+        by_room = defaultdict(dict)
+        for room_id, team_number, amount in amounts:
+            by_room[room_id][rooms.model.PARTICIPANTS_FIELDS[team_number]] = amount
+        rooms.decrement(by_room)
+
+    @classmethod
+    def get_rooms(cls) -> models.Manager:
+        # Room model imports this module
+        return cls._meta.get_field("room").related_model.objects
 
     class Meta:
         unique_together = ("chatuser", "room")
+        indexes = [
+            # Participants of a room by team, covers the room users list
+            models.Index(fields=["room", "team_number", "chatuser"], name="participation_room_team"),
+        ]
 
 
 class ChatUser(models.Model):
@@ -36,6 +101,14 @@ class ChatUser(models.Model):
         return self.user.__str__()
 
 
+@receiver(pre_delete, sender=ChatUser)
+def forget_user_activity(sender, instance, **kwargs):
+    # The cascade of a deleted user doesn't go through the querysets, which keep the activity counters of the rooms,
+    # so the user leaves the teams and their comments are deleted before it runs
+    Participation.objects.filter(chatuser=instance).delete()
+    instance.created_comment.all().delete()
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -0,0 +1,97 @@
+"""
+Keyset (a.k.a. seek) pagination over the (created, id) pair.
+
+Unlike offset pagination, the page is located by the position of its border object,
+so fetching the page N costs the same as fetching the first one given an index on (..., created, id).
+Cursors are opaque url-safe strings for the clients.
+
+The generic list endpoints use the same approach through DRF's cursor pagination, see `IdCursorPagination`.
+"""
+import base64
+import binascii
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.db.models import Model, Q, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPage(NamedTuple):
+    # Objects of the page in the chronological order
+    objects: List[Model]
+    # Whether there are more objects beyond the page in the direction it was fetched in
+    has_more: bool
+    # Cursor pointing to the border object of the page in that direction, which should be used to fetch the next page:
+    # the first object for `get_page_before`, the last one for `get_page_after`
+    cursor: Optional[str]
+
+
+def encode_cursor(obj: Model) -> str:
+    """
+    Encodes the position of the object in the (created, id) ordering.
+    """
+    return base64.urlsafe_b64encode(f"{obj.created.isoformat()}|{obj.pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created), int(pk)
+    except (AttributeError, binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError("Invalid cursor", code="invalid")
+
+
+def filter_before(queryset: QuerySet, cursor: str) -> QuerySet:
+    created, pk = decode_cursor(cursor)
+    return queryset.filter(Q(created__lt=created) | Q(created=created, pk__lt=pk))
+
+
+def filter_after(queryset: QuerySet, cursor: str) -> QuerySet:
+    created, pk = decode_cursor(cursor)
+    return queryset.filter(Q(created__gt=created) | Q(created=created, pk__gt=pk))
+
+
+def get_page_before(queryset: QuerySet, limit: int, cursor: Optional[str] = None) -> KeysetPage:
+    """
+    Returns `limit` newest objects of the queryset, which are older than the cursor position.
+    If no cursor is given, returns the newest objects of the queryset.
+    """
+    if cursor:
+        queryset = filter_before(queryset, cursor)
+    # One extra object is fetched to find out whether there are more pages without an extra COUNT query
+    objects = list(queryset.order_by("-created", "-pk")[:limit + 1])
+    has_more = len(objects) > limit
+    objects = objects[:limit][::-1]
+    return KeysetPage(objects, has_more, encode_cursor(objects[0]) if objects else cursor)
+
+
+def get_page_after(queryset: QuerySet, limit: int, cursor: str) -> KeysetPage:
+    """
+    Returns `limit` oldest objects of the queryset, which are newer than the cursor position.
+    """
+    objects = list(filter_after(queryset, cursor).order_by("created", "pk")[:limit + 1])
+    has_more = len(objects) > limit
+    objects = objects[:limit]
+    return KeysetPage(objects, has_more, encode_cursor(objects[-1]) if objects else cursor)
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the generic list endpoints, newest objects first.
+
+    The primary key is used as the only ordering field, since it is unique, indexed and never changes
+    (`created` of a room is updated on every save). The response is {"next": url, "previous": url, "results": [...]},
+    `?limit=` sets the size of the page up to `max_page_size`.
+    """
+    ordering = "-id"
+    page_size = 50
+    max_page_size = 100
+    page_size_query_param = "limit"
+
+    def get_ordering(self, request, queryset, view):
+        # Views can order the pages by another field, which is set per request
+        get_pagination_ordering = getattr(view, "get_pagination_ordering", None)
+        if get_pagination_ordering is not None:
+            return get_pagination_ordering()
+        return super().get_ordering(request, queryset, view)
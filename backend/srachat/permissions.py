@@ -1,7 +1,7 @@
 from rest_framework import permissions
 
+from .membership import get_membership
 from .models import Room
-from .models.user import ChatUser
 
 
 class AbstractSrachatReadOnlyPermission(permissions.BasePermission):
@@ -10,6 +10,8 @@ class AbstractSrachatReadOnlyPermission(permissions.BasePermission):
 
     It implements the read only part of the permissions.BasePermission has_object_permission method.
     The only part that should be changed in the subclasses is the `condition` class variable.
+    The relation of the user to the rooms is read from the membership context of the request,
+    so the permissions of a request and its view share the queries (see srachat.membership).
     """
 
     @staticmethod
@@ -32,7 +34,9 @@ class IsCreatorOrReadOnly(AbstractSrachatReadOnlyPermission):
 
     @staticmethod
     def get_condition(request, view, obj) -> bool:
-        return obj.creator == ChatUser.objects.get(user=request.user)
+        if isinstance(obj, Room):
+            return get_membership(request).for_room(obj).is_creator
+        return obj.creator_id == get_membership(request).chat_user_id
 
 
 class IsRoomParticipantOrReadOnly(AbstractSrachatReadOnlyPermission):
@@ -42,7 +46,7 @@ class IsRoomParticipantOrReadOnly(AbstractSrachatReadOnlyPermission):
 
     @staticmethod
     def get_condition(request, view, obj) -> bool:
-        return ChatUser.objects.get(user=request.user) in obj.chat_users.all()
+        return get_membership(request).for_room(obj).is_participant
 
 
 class IsRoomAdminOrReadOnly(AbstractSrachatReadOnlyPermission):
@@ -52,7 +56,7 @@ class IsRoomAdminOrReadOnly(AbstractSrachatReadOnlyPermission):
 
     @staticmethod
     def get_condition(request, view, obj) -> bool:
-        return ChatUser.objects.get(user=request.user) in obj.admins.all()
+        return get_membership(request).for_room(obj).is_admin
 
 
 class IsAccountOwnerOrReadOnly(AbstractSrachatReadOnlyPermission):
@@ -74,12 +78,10 @@ class IsAllowedRoomOrReadOnly(AbstractSrachatReadOnlyPermission):
     def get_condition(request, view, obj) -> bool:
         if isinstance(obj, Room):
             room = obj
-        elif hasattr(obj, "room"):
-            room = obj.room
+        elif hasattr(obj, "room_id"):
+            # The room itself is not needed
+            room = obj.room_id
         else:
             raise ValueError("Object should either be of type Room or any type, which is bound to room.")
 
-        user = ChatUser.objects.get(user=request.user)
-        if user in room.banned_users.all() and user not in room.admins.all() and user is not room.creator:
-            return False
-        return True
+        return get_membership(request).for_room(room).is_allowed
@@ -0,0 +1,25 @@
+from rest_framework.renderers import JSONRenderer
+
+from . import fast_json
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` encoding with orjson, see `srachat.fast_json`. The documents are the same,
+    indented ones and the settings other than the default compact and not ASCII-escaped output are left to DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+        if (
+            not fast_json.FAST or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = fast_json.dumps(data)
+        # DRF escapes the line separators to keep the JSON a subset of javascript, checking is cheaper than escaping
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
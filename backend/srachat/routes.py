@@ -1,8 +1,9 @@
 from channels.routing import URLRouter
 from django.urls import re_path
 
-from .consumers import RoomConsumer
+from .consumers import MultiplexRoomConsumer, RoomConsumer
 
 srachat_router = URLRouter([
+    re_path('^rooms/$', MultiplexRoomConsumer.as_asgi(), name="ws_rooms"),
     re_path('^rooms/(?P<id>\w+)/$', RoomConsumer.as_asgi(), name="ws_room"),
 ])
@@ -1,10 +1,11 @@
-from typing import List
+from typing import Iterable, List, Optional
 
 from rest_framework import serializers
 
 from .create_update_model_serializer import CreateUpdateModelSerializer
 from ..models.room import Room
 from ..models.tag import Tag
+from ..models.team_number import TeamNumber
 
 
 class CreateUpdateRoomSerializer(CreateUpdateModelSerializer):
@@ -44,11 +45,30 @@ class UpdateRoomSerializer(CreateUpdateRoomSerializer):
 
 
 class DetailListRoomSerializer(serializers.ModelSerializer):
+    """
+    Shows all fields of a room, or only the given `fields` if they are passed on the creation.
+    Votes include the ones not folded from the shards yet (see `Room.get_votes`).
+    """
     tags = serializers.SerializerMethodField()
+    first_team_votes = serializers.SerializerMethodField()
+    second_team_votes = serializers.SerializerMethodField()
 
     class Meta:
         model = Room
         fields = '__all__'
 
+    def __init__(self, *args, fields: Optional[Iterable[str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
     def get_tags(self, obj):
-        return Tag.get_names_by_ids(obj.tags.all())
+        # Reads the prefetched tags if the queryset was built with `with_relations`
+        return [tag.name for tag in obj.tags.all()]
+
+    def get_first_team_votes(self, obj):
+        return obj.get_votes(TeamNumber.FIRST_TEAM)
+
+    def get_second_team_votes(self, obj):
+        return obj.get_votes(TeamNumber.SECOND_TEAM)
@@ -1,10 +1,14 @@
 import datetime
 from typing import Optional, Dict, Any, Callable, Union
+from unittest import mock
 
+from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework import status
 
+from ..models import ChatUser, Comment, Room
 from ..tests.utils import CommentUtils, RoomUtils, UserUtils, UrlUtils, SrachatTestCase
+from ..views.comments import CommentList
 
 # TODO: update the documentation
 """
@@ -69,8 +73,8 @@ class CommentTests(SrachatTestCase):
     def test_no_comments_in_both_rooms_after_creation(self):
         response_first = self.client.get(self.url_first_room_comments)
         response_second = self.client.get(self.url_second_room_comments)
-        self.assertEqual(len(response_first.data), 0)
-        self.assertEqual(len(response_second.data), 0)
+        self.assertEqual(len(response_first.data["results"]), 0)
+        self.assertEqual(len(response_second.data["results"]), 0)
 
     def test_post_comment_all_fields_correct(self):
         self.set_credentials(self.auth_token_first)
@@ -80,7 +84,7 @@ class CommentTests(SrachatTestCase):
 
         response_get = self.client.get(self.url_first_room_comments)
 
-        data = response_get.data[0]
+        data = response_get.data["results"][0]
         self.assertEqual(data["creator"], 1)
         self.assertEqual(data["body"], CommentUtils.DATA_COMMENT_FIRST["body"])
         self.assertEqual(
@@ -89,6 +93,17 @@ class CommentTests(SrachatTestCase):
         )
         self.assertEqual(data["team_number"], 1)
 
+    def test_post_comment_resolves_membership_once(self):
+        # The room comes with the membership of the user, the permissions and the view share it
+        self.client.credentials()
+        self.client.force_authenticate(User.objects.get(username=UserUtils.USERNAME_FIRST))
+        # The room, the creator validated by the serializer, the comment and the counters of the room in a savepoint
+        with self.assertNumQueries(6):
+            post_response = self.client.post(self.url_first_room_comments, data=CommentUtils.DATA_COMMENT_FIRST)
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(post_response.data["team_number"], 1)
+        self.assertEqual(post_response.data["creator"], 1)
+
     def _try_post_comment_check(
             self,
             status_code: int,
@@ -109,7 +124,7 @@ class CommentTests(SrachatTestCase):
             comments_amount = 1
         else:
             comments_amount = 0
-        self.assertEqual(len(response_get.data), comments_amount)
+        self.assertEqual(len(response_get.data["results"]), comments_amount)
 
     def test_comment_can_be_added_by_participant_first_team(self):
         """
@@ -315,3 +330,64 @@ class CommentTests(SrachatTestCase):
                                            status_code=status.HTTP_400_BAD_REQUEST,
                                            auth_token=self.auth_token_first,
                                            field_dict=fields)
+
+
+class CommentPaginationTests(SrachatTestCase):
+    """
+    Setup: a room with five comments, all of them created at the same time, so only their ids define the order.
+    """
+    def setUp(self):
+        chat_user = ChatUser.objects.get(user=User.objects.create_user(UserUtils.USERNAME_FIRST))
+        room = Room.objects.create(
+            creator=chat_user, title=RoomUtils.DATA_ROOM_FIRST.title,
+            first_team_name=RoomUtils.DATA_ROOM_FIRST.first_team_name,
+            second_team_name=RoomUtils.DATA_ROOM_FIRST.second_team_name
+        )
+        created = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        self.bodies = [f"comment {i}" for i in range(5)]
+        for body in self.bodies:
+            Comment.objects.create(creator=chat_user, room=room, body=body, team_number=1, created=created)
+        self.url = reverse(UrlUtils.Rooms.COMMENTS, args=[room.id])
+
+    def _get_page(self, **params):
+        response = self.client.get(self.url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        bodies = [comment["body"] for comment in response.data["results"]]
+        return bodies, response.data["before"], response.data["after"]
+
+    def test_newest_page_by_default(self):
+        bodies, before, after = self._get_page(limit=2)
+        self.assertEqual(bodies, self.bodies[3:])
+        self.assertIsNotNone(before)
+        self.assertIsNone(after)
+
+    def test_walk_back_and_forth(self):
+        _, before, _ = self._get_page(limit=2)
+        bodies, before, after = self._get_page(limit=2, before=before)
+        self.assertEqual(bodies, self.bodies[1:3])
+        bodies, oldest_before, _ = self._get_page(limit=2, before=before)
+        self.assertEqual(bodies, self.bodies[:1])
+        self.assertIsNone(oldest_before)
+
+        bodies, _, after = self._get_page(limit=2, after=after)
+        self.assertEqual(bodies, self.bodies[3:])
+        self.assertIsNone(after)
+
+    @mock.patch.object(CommentList, "MAX_PAGE_SIZE", 3)
+    def test_page_size_is_capped(self):
+        bodies, _, _ = self._get_page(limit=100)
+        self.assertEqual(bodies, self.bodies[2:])
+
+    def test_page_costs_the_same_query_count(self):
+        _, before, _ = self._get_page(limit=1)
+        with self.assertNumQueries(2):
+            self._get_page(limit=1)
+        with self.assertNumQueries(2):
+            self._get_page(limit=1, before=before)
+
+    def test_bad_parameters(self):
+        _, before, _ = self._get_page(limit=2)
+        for params in ({"before": "not a cursor"}, {"before": before, "after": before}, {"limit": 0}, {"limit": "x"}):
+            self.assertEqual(self.client.get(self.url, data=params).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, data={"before": "not a cursor"})
+        self.assertEqual(response.data[0].code, "invalid")
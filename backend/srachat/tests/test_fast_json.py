@@ -0,0 +1,70 @@
+import datetime
+import decimal
+import io
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from .. import fast_json
+from ..consumers import codec
+from ..parsers import FastJSONParser
+from ..renderers import FastJSONRenderer
+
+"""
+To test:
+    - The fast renderer produces the same documents as DRF's JSONRenderer, including the types orjson doesn't know
+    - Indented documents and a missing orjson fall back to DRF
+    - The fast parser parses the same documents and rejects the same invalid ones
+"""
+
+
+class FastJSONTest(SimpleTestCase):
+    PAYLOAD = {
+        "results": [ReturnDict({
+            "id": 1,
+            "title": "Кошки \u2028 собаки",
+            "created": datetime.datetime(2021, 3, 4, 5, 6, 7, 890, tzinfo=timezone.utc),
+            "edited": datetime.datetime(2021, 3, 4, 5, 6, 7),
+            "day": datetime.date(2021, 3, 4),
+            "uuid": uuid.UUID(int=1),
+            "price": decimal.Decimal("1.50"),
+            "tags": ("a", "b"),
+            "votes": {1: 10, 2: 20},
+        }, serializer=None)],
+        "errors": {"title": [ErrorDetail("This field is required.", code="required")]},
+        "message": gettext_lazy("Not found."),
+        "next": None,
+    }
+
+    def test_same_document_as_drf(self):
+        expected = JSONRenderer().render(self.PAYLOAD)
+        self.assertEqual(FastJSONRenderer().render(self.PAYLOAD), expected)
+        self.assertEqual(fast_json.stdlib_dumps(self.PAYLOAD).replace("\u2028".encode(), b"\\u2028"), expected)
+
+    def test_fallbacks(self):
+        indented = "application/json; indent=4"
+        self.assertEqual(
+            FastJSONRenderer().render(self.PAYLOAD, indented), JSONRenderer().render(self.PAYLOAD, indented)
+        )
+        with mock.patch.object(fast_json, "FAST", False):
+            self.assertEqual(FastJSONRenderer().render(self.PAYLOAD), JSONRenderer().render(self.PAYLOAD))
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"a": [1]}')), {"a": [1]})
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_parse(self):
+        body = '{"body": "Привет", "team_number": 1, "tags": [1.5, null, true]}'.encode()
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for invalid in (b'{"body": ', b'{"value": NaN}', b""):
+            with self.subTest(invalid=invalid), self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(invalid))
+
+    def test_codec_round_trip(self):
+        frame = {"type": "new_message", "comments": [{"body": "Привет", "id": 1}]}
+        self.assertEqual(codec.decode(codec.encode(frame)), frame)
@@ -1,4 +1,5 @@
 import datetime
+import io
 import tempfile
 from typing import Tuple, List
 from unittest.mock import MagicMock
@@ -6,16 +7,19 @@ from unittest.mock import MagicMock
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.files import File
-from django.db import transaction
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.db.models.query import QuerySet
 from django.db.utils import IntegrityError
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from ..consumers.write_behind import persist_comments
 from ..models.comment import Comment
 from ..models.language import LanguageChoices
 from ..models.user import ChatUser, Participation
-from ..models.room import Room, RoomVote
+from ..models.room import Room, RoomVote, RoomVoteShard
 from ..models.tag import Tag
 from .utils import CommentUtils, RoomUtils, UserUtils
 
@@ -219,6 +223,59 @@ class RoomTest(TestCase):
         with self.assertRaises(OverflowError):
             Participation.objects.create(chatuser=self.third_user, room=second_room, team_number=1)
 
+    def test_participants_counters(self):
+        first_room, second_room = fetch_two_predefined_rooms()
+
+        def assert_participants(room: Room, first_team: int, second_team: int):
+            room.refresh_from_db()
+            self.assertEqual((room.first_team_participants, room.second_team_participants), (first_team, second_team))
+
+        with CaptureQueriesContext(connection) as queries:
+            Participation.objects.create(chatuser=self.first_user, room=second_room, team_number=1)
+        # The capacity is checked by the counter, not by counting the participants
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries.captured_queries))
+        Participation.objects.create(chatuser=self.second_user, room=second_room, team_number=2)
+        Participation.objects.create(chatuser=self.second_user, room=first_room, team_number=2)
+        assert_participants(second_room, 1, 1)
+
+        # A rejected join doesn't change the counters
+        with self.assertRaises(IntegrityError):
+            Participation.objects.create(chatuser=self.first_user, room=second_room, team_number=2)
+        assert_participants(second_room, 1, 1)
+
+        # Changing the team
+        participation = Participation.objects.get(chatuser=self.first_user, room=second_room)
+        participation.team_number = 2
+        participation.save()
+        assert_participants(second_room, 0, 2)
+
+        second_room.chat_users.remove(self.second_user)
+        assert_participants(second_room, 0, 1)
+        # A deleted user leaves the teams of all the rooms
+        self.second_user.delete()
+        assert_participants(first_room, 0, 0)
+
+    def test_stale_room_save_keeps_participants_counters(self):
+        first_room, _ = fetch_two_predefined_rooms()
+        Participation.objects.create(chatuser=self.first_user, room=first_room, team_number=1)
+        first_room.title += "a"
+        first_room.save()
+
+        first_room = Room.objects.get(pk=first_room.pk)
+        self.assertEqual(first_room.title, RoomUtils.DATA_ROOM_FIRST.title + "a")
+        self.assertEqual(first_room.first_team_participants, 1)
+
+    def test_stale_room_save_keeps_votes(self):
+        first_room, _ = fetch_two_predefined_rooms()
+        RoomVote.cast(first_room.id, self.first_user.id, 1)
+        # E.g. the room deactivation or an update through the endpoint
+        first_room.is_active = False
+        first_room.save()
+
+        first_room = Room.objects.get(pk=first_room.pk)
+        self.assertFalse(first_room.is_active)
+        self.assertEqual(first_room.first_team_votes, 1)
+
     def test_set_participant_amount_higher_than_max_possible(self):
         with self.assertRaises(ValidationError):
             Room.objects.create(
@@ -388,7 +445,7 @@ class RoomTest(TestCase):
         )
         room.first_team_votes = -1
         with self.assertRaises(IntegrityError):
-            room.save()
+            room.save(update_fields=["first_team_votes"])
 
     def test_both_teams_have_zero_votes(self):
         first_room, second_room = fetch_two_predefined_rooms()
@@ -398,6 +455,74 @@ class RoomTest(TestCase):
         self.assertEqual(second_room.second_team_votes, 0)
 
 
+@override_settings(SRACHAT_VOTE_COUNTER_SHARDS=4)
+class RoomVoteShardTest(TestCase):
+    """
+    Set up: create three users and two rooms, votes are counted in 4 shards per room.
+
+    Tests:
+    - Votes land in the shards, while the room counters are not touched
+    - Reads of the room sum the counters and the shards, annotated or not
+    - Folding moves the shards into the room counters
+    - Counters are rebuilt from the votes
+    - Management command folds and rebuilds the counters
+    """
+    def setUp(self):
+        self.users = create_predefined_users(
+            UserUtils.USERNAME_FIRST, UserUtils.USERNAME_SECOND, UserUtils.USERNAME_THIRD
+        )
+        self.first_room, self.second_room = create_two_predefined_rooms(self.users[0], self.users[1])
+        for user, team_number in zip(self.users, (1, 1, 2)):
+            RoomVote.cast(self.first_room.id, user.id, team_number)
+        # Revote of the last user
+        RoomVote.cast(self.first_room.id, self.users[2].id, 1)
+
+    def _assert_votes(self, room: Room, first_team_votes: int, second_team_votes: int):
+        self.assertEqual((room.get_votes(1), room.get_votes(2)), (first_team_votes, second_team_votes))
+
+    def test_votes_land_in_shards(self):
+        self.first_room.refresh_from_db()
+        self.assertEqual((self.first_room.first_team_votes, self.first_room.second_team_votes), (0, 0))
+        self.assertTrue(RoomVoteShard.objects.filter(room=self.first_room).exists())
+        self.assertLessEqual(RoomVoteShard.objects.filter(room=self.first_room).count(), 4)
+
+    def test_reads_sum_counters_and_shards(self):
+        self._assert_votes(Room.objects.get(pk=self.first_room.id), 3, 0)
+        with self.assertNumQueries(1):
+            rooms = list(Room.objects.with_votes().order_by("id"))
+            self._assert_votes(rooms[0], 3, 0)
+            self._assert_votes(rooms[1], 0, 0)
+
+    def test_fold(self):
+        self.assertEqual(RoomVoteShard.fold(), 1)
+        self.first_room.refresh_from_db()
+        self.assertEqual((self.first_room.first_team_votes, self.first_room.second_team_votes), (3, 0))
+        self._assert_votes(Room.objects.with_votes().get(pk=self.first_room.id), 3, 0)
+        # Nothing is left to fold
+        self.assertEqual(RoomVoteShard.fold(), 0)
+
+    def test_rebuild(self):
+        RoomVoteShard.fold()
+        Room.objects.filter(pk=self.first_room.id).update(first_team_votes=10, second_team_votes=10)
+        RoomVote.cast(self.first_room.id, self.users[0].id, 2)
+
+        self.assertEqual(RoomVoteShard.rebuild([self.first_room.id]), 1)
+        self._assert_votes(Room.objects.with_votes().get(pk=self.first_room.id), 2, 1)
+        self.first_room.refresh_from_db()
+        self.assertEqual((self.first_room.first_team_votes, self.first_room.second_team_votes), (2, 1))
+
+    def test_reconcile_votes_command(self):
+        out = io.StringIO()
+        call_command("reconcile_votes", stdout=out)
+        self.first_room.refresh_from_db()
+        self.assertEqual(self.first_room.first_team_votes, 3)
+
+        Room.objects.filter(pk=self.first_room.id).update(first_team_votes=0)
+        call_command("reconcile_votes", "--rebuild", "--room", str(self.first_room.id), stdout=out)
+        self.first_room.refresh_from_db()
+        self.assertEqual(self.first_room.first_team_votes, 3)
+
+
 class CommentTest(TestCase):
     """
     Set up: create two users. Each should create a room.
@@ -491,6 +616,69 @@ class CommentTest(TestCase):
         ]
         self.assertListEqual(team_numbers, [1, 1, 2, 2])
 
+    def test_room_activity_counters(self):
+        first_room, second_room = fetch_two_predefined_rooms()
+        second_room.refresh_from_db()
+        self.assertEqual(second_room.comment_count, 4)
+        self.assertEqual(second_room.last_comment_at, fetch_comment(CommentUtils.COMMENT_FOURTH).get().created)
+        self.assertEqual((first_room.comment_count, first_room.last_comment_at), (0, None))
+
+        # Saved in a batch by the websocket write-behind queue
+        older = Comment(
+            creator=self.first_user, room=second_room, body=CommentUtils.COMMENT_FIRST, team_number=1,
+            created=timezone.now() - datetime.timedelta(days=1)
+        )
+        newer = Comment(creator=self.first_user, room=first_room, body=CommentUtils.COMMENT_FIRST, team_number=1)
+        persist_comments([older, newer])
+        second_room.refresh_from_db()
+        first_room.refresh_from_db()
+        self.assertEqual(second_room.comment_count, 5)
+        # An older comment doesn't move the last comment time back
+        self.assertEqual(second_room.last_comment_at, fetch_comment(CommentUtils.COMMENT_FOURTH).get().created)
+        self.assertEqual((first_room.comment_count, first_room.last_comment_at), (1, newer.created))
+
+        Comment.objects.filter(room=second_room, creator=self.second_user).delete()
+        older.delete()
+        second_room.refresh_from_db()
+        self.assertEqual(second_room.comment_count, 2)
+
+        # Recounted from the rows
+        Room.objects.update(comment_count=0, last_comment_at=None, first_team_participants=5)
+        call_command("recount_room_activity", stdout=io.StringIO())
+        second_room.refresh_from_db()
+        self.assertEqual(second_room.comment_count, 2)
+        self.assertEqual(second_room.last_comment_at, fetch_comment(CommentUtils.COMMENT_SECOND).get().created)
+        self.assertEqual((second_room.first_team_participants, second_room.second_team_participants), (0, 0))
+
+    def test_comment_deletes_subtract_once_per_room(self):
+        first_room, second_room = fetch_two_predefined_rooms()
+        # Not counted, like the rows written without the models
+        Comment.objects.bulk_create(
+            Comment(creator=self.first_user, room=room, body=CommentUtils.COMMENT_FIRST, team_number=1)
+            for room in (first_room, second_room) for _ in range(3)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            Comment.objects.filter(creator=self.first_user).delete()
+        updates = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+        first_room.refresh_from_db()
+        second_room.refresh_from_db()
+        # Never below zero
+        self.assertEqual((first_room.comment_count, second_room.comment_count), (0, 0))
+
+        Comment.objects.bulk_create(
+            Comment(creator=self.first_user, room=first_room, body=CommentUtils.COMMENT_FIRST, team_number=1)
+            for _ in range(200)
+        )
+        Comment.objects.filter(room=first_room).first().delete()
+        first_room.refresh_from_db()
+        self.assertEqual(first_room.comment_count, 0)
+        # The comments deleted together with the room are not subtracted one by one
+        with CaptureQueriesContext(connection) as queries:
+            first_room.delete()
+        self.assertLess(len(queries), 20)
+        self.assertFalse(any(query["sql"].startswith("UPDATE") for query in queries.captured_queries))
+
     def test_comments_deletes_after_room_deletion(self):
         _, second_room = fetch_two_predefined_rooms()
         comments = Comment.objects.filter(room=second_room)
@@ -499,6 +687,13 @@ class CommentTest(TestCase):
         second_room.delete()
         self.assertTrue(not comments.exists())
 
+    def test_user_deletion_subtracts_comments(self):
+        _, second_room = fetch_two_predefined_rooms()
+        self.first_user.delete()
+        second_room.refresh_from_db()
+        self.assertEqual(second_room.comment_count, Comment.objects.filter(room=second_room).count())
+        self.assertEqual(second_room.comment_count, 2)
+
     def test_comments_deletes_after_user_deletion(self):
         _, second_room = fetch_two_predefined_rooms()
         comments = Comment.objects.filter(creator=self.first_user)
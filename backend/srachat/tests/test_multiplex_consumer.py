@@ -0,0 +1,138 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from ..models.comment import Comment
+from ..models.room import Room
+from ..models.user import ChatUser, Participation
+from .utils import CommentUtils, RoomUtils, SrachatTestCase, UrlUtils, UserUtils, websocket_communicator
+
+"""
+Setup:
+    - Create two users and two rooms of the first one.
+    - Second user is a participant of the first room only.
+
+To test:
+    - A single socket receives the history and the messages of every subscribed room, tagged with the room id
+    - Permissions are kept per room
+    - Unsubscribed and non-existing rooms don't affect the socket
+    - Bans and deactivation of one room don't affect the other subscriptions
+"""
+
+
+class MultiplexRoomConsumerTest(SrachatTestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(UserUtils.USERNAME_FIRST, password=UserUtils.PASSWORD)
+        self.second_user = User.objects.create_user(UserUtils.USERNAME_SECOND, password=UserUtils.PASSWORD)
+        first_chat_user = ChatUser.objects.get(user=self.first_user)
+        self.second_chat_user = ChatUser.objects.get(user=self.second_user)
+
+        self.first_room, self.second_room = [
+            Room.objects.create(
+                creator=first_chat_user, title=data.title,
+                first_team_name=data.first_team_name, second_team_name=data.second_team_name
+            )
+            for data in (RoomUtils.DATA_ROOM_FIRST, RoomUtils.DATA_ROOM_SECOND)
+        ]
+        for room in (self.first_room, self.second_room):
+            room.admins.add(first_chat_user)
+        Participation.objects.create(chatuser=self.second_chat_user, room=self.first_room, team_number=1)
+        Comment.objects.create(
+            creator=first_chat_user, room=self.second_room, body=CommentUtils.COMMENT_FIRST, team_number=1
+        )
+        async_to_sync(get_channel_layer().flush)()
+
+    async def _connect_and_subscribe(self, user, *rooms):
+        communicator = websocket_communicator(UrlUtils.Websockets.ROOMS, user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for room in rooms:
+            await communicator.send_json_to({"type": "subscribe", "room": room.id})
+            history = await communicator.receive_json_from()
+            self.assertEqual((history["type"], history["room"]), ("new_message", room.id))
+        return communicator
+
+    async def _send_message(self, communicator, room, body: str = CommentUtils.COMMENT_SECOND):
+        await communicator.send_json_to({"type": "new_message", "room": room.id, "data": {"body": body}})
+        return await communicator.receive_json_from()
+
+    @database_sync_to_async
+    def _rest_call(self, user, method: str, url_name: str, room, data=None):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            getattr(self.client, method)(reverse(url_name, args=[room.id]), data=data, format="json")
+        self.client.force_authenticate(None)
+
+    async def test_subscribe_sends_tagged_history(self):
+        communicator = websocket_communicator(UrlUtils.Websockets.ROOMS)
+        await communicator.connect()
+        await communicator.send_json_to({"type": "subscribe", "room": self.second_room.id})
+        history = await communicator.receive_json_from()
+        self.assertEqual(history["room"], self.second_room.id)
+        self.assertEqual([comment["body"] for comment in history["comments"]], [CommentUtils.COMMENT_FIRST])
+        await communicator.disconnect()
+
+    async def test_messages_of_every_room_are_received(self):
+        listener = await self._connect_and_subscribe(None, self.first_room, self.second_room)
+        sender = await self._connect_and_subscribe(self.second_user, self.first_room)
+
+        await self._send_message(sender, self.first_room)
+        response = await listener.receive_json_from()
+        self.assertEqual((response["type"], response["room"]), ("new_message", self.first_room.id))
+        self.assertEqual(response["comments"][0]["body"], CommentUtils.COMMENT_SECOND)
+        await listener.disconnect()
+        await sender.disconnect()
+
+    async def test_permissions_are_kept_per_room(self):
+        communicator = await self._connect_and_subscribe(self.second_user, self.first_room, self.second_room)
+
+        response = await self._send_message(communicator, self.second_room)
+        self.assertEqual((response["type"], response["room"]), ("error", self.second_room.id))
+        response = await self._send_message(communicator, self.first_room)
+        self.assertEqual((response["type"], response["room"]), ("new_message", self.first_room.id))
+        await communicator.disconnect()
+
+    async def test_unsubscribe(self):
+        communicator = await self._connect_and_subscribe(self.second_user, self.first_room)
+
+        await communicator.send_json_to({"type": "unsubscribe", "room": self.first_room.id})
+        self.assertEqual(
+            await communicator.receive_json_from(), {"type": "unsubscribed", "room": self.first_room.id}
+        )
+        self.assertEqual((await self._send_message(communicator, self.first_room))["type"], "error")
+        await communicator.disconnect()
+
+    async def test_non_existing_room_keeps_socket_open(self):
+        communicator = await self._connect_and_subscribe(self.second_user)
+        await communicator.send_json_to({"type": "subscribe", "room": self.second_room.id + 100})
+        response = await communicator.receive_json_from()
+        self.assertEqual((response["type"], response["room"]), ("error", self.second_room.id + 100))
+
+        await communicator.send_json_to({"type": "subscribe", "room": self.first_room.id})
+        self.assertEqual((await communicator.receive_json_from())["room"], self.first_room.id)
+        await communicator.disconnect()
+
+    async def test_ban_affects_only_its_room(self):
+        communicator = await self._connect_and_subscribe(self.second_user, self.first_room, self.second_room)
+
+        await self._rest_call(
+            self.first_user, "post", UrlUtils.Rooms.BAN, self.second_room, {"id": self.second_chat_user.id}
+        )
+        membership = await communicator.receive_json_from()
+        self.assertEqual((membership["type"], membership["room"]), ("membership", self.second_room.id))
+        self.assertTrue(membership["is_banned"])
+        response = await self._send_message(communicator, self.first_room)
+        self.assertEqual(response["type"], "new_message")
+        await communicator.disconnect()
+
+    async def test_deactivation_unsubscribes_the_room(self):
+        communicator = await self._connect_and_subscribe(self.second_user, self.first_room, self.second_room)
+
+        await self._rest_call(self.first_user, "post", UrlUtils.Rooms.DEACTIVATE, self.second_room)
+        response = await communicator.receive_json_from()
+        self.assertEqual((response["type"], response["room"]), ("error", self.second_room.id))
+        self.assertEqual((await self._send_message(communicator, self.second_room))["type"], "error")
+        self.assertEqual((await self._send_message(communicator, self.first_room))["type"], "new_message")
+        await communicator.disconnect()
@@ -0,0 +1,493 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .. import metrics
+from ..consumers import codec
+from ..consumers.events import room_group_name
+from ..consumers.room_subscription import RoomSubscription
+from ..consumers.outbound import OutboundQueue, SlowConsumerPolicy
+from ..models.comment import Comment
+from ..models.room import Room
+from ..models.user import ChatUser, Participation
+from .utils import CommentUtils, RoomUtils, SrachatTestCase, UrlUtils, UserUtils, websocket_communicator
+
+"""
+Setup:
+    - Create three users and a room of the first one.
+    - First user is a participant of the first team, second one of the second team.
+    - Third user is not a participant.
+
+To test:
+    - Anybody can connect to the room and receives the history
+    - Only the newest window of the history is sent on connect, older comments are paged by `load_more`
+    - Reconnecting clients get only the comments after the last seen one, or a resync if the gap is too large
+    - Participants' messages are broadcast to all connected sockets
+    - Sockets with the msgpack subprotocol get the same frames as binary ones, through a group of their own
+    - With coalescing enabled, a burst of messages is delivered as a single frame
+    - With write-behind enabled, messages are broadcast first and saved in a batch afterwards
+    - Non participants, banned and anonymous users cannot send messages
+    - Connect makes the same amount of queries regardless of the room size
+    - Bans, team changes and deactivation done through the REST api affect already open sockets
+    - Only a creator of comments can delete them
+    - Sockets, which acknowledge the frames, get at most the window of frames ahead of the acknowledgements
+    - Connecting to a non-existing room closes the socket
+"""
+
+
+@database_sync_to_async
+def comment_exists(**filters) -> bool:
+    return Comment.objects.filter(**filters).exists()
+
+
+class RoomConsumerTest(SrachatTestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(UserUtils.USERNAME_FIRST, password=UserUtils.PASSWORD)
+        self.second_user = User.objects.create_user(UserUtils.USERNAME_SECOND, password=UserUtils.PASSWORD)
+        self.third_user = User.objects.create_user(UserUtils.USERNAME_THIRD, password=UserUtils.PASSWORD)
+        self.first_chat_user = ChatUser.objects.get(user=self.first_user)
+        self.second_chat_user = ChatUser.objects.get(user=self.second_user)
+
+        self.room = Room.objects.create(
+            creator=self.first_chat_user, title=RoomUtils.DATA_ROOM_FIRST.title,
+            first_team_name=RoomUtils.DATA_ROOM_FIRST.first_team_name,
+            second_team_name=RoomUtils.DATA_ROOM_FIRST.second_team_name
+        )
+        self.room.admins.add(self.first_chat_user)
+        Participation.objects.create(chatuser=self.first_chat_user, room=self.room, team_number=1)
+        Participation.objects.create(chatuser=self.second_chat_user, room=self.room, team_number=2)
+        self.first_comment_id = Comment.objects.create(
+            creator=self.first_chat_user, room=self.room, body=CommentUtils.COMMENT_FIRST, team_number=1
+        ).id
+        self.url = UrlUtils.Websockets.ROOM.format(self.room.id)
+
+        # In-memory channel layer is shared between the tests
+        async_to_sync(get_channel_layer().flush)()
+
+    async def _connect(self, user=None, url=None):
+        communicator = websocket_communicator(url or self.url, user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _connect_and_skip_history(self, user=None):
+        communicator = await self._connect(user)
+        await communicator.receive_json_from()
+        return communicator
+
+    async def test_connect_sends_history(self):
+        communicator = await self._connect()
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "new_message")
+        self.assertEqual([comment["body"] for comment in response["comments"]], [CommentUtils.COMMENT_FIRST])
+        await communicator.disconnect()
+
+    async def test_message_is_broadcast_to_the_room(self):
+        sender = await self._connect_and_skip_history(self.second_user)
+        listener = await self._connect_and_skip_history()
+
+        await sender.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        for communicator in (sender, listener):
+            response = await communicator.receive_json_from()
+            self.assertEqual(response["type"], "new_message")
+            self.assertEqual(response["room"], self.room.id)
+            self.assertEqual(len(response["comments"]), 1)
+            self.assertEqual(response["comments"][0]["body"], CommentUtils.COMMENT_SECOND)
+            self.assertEqual(response["comments"][0]["team_number"], 2)
+            self.assertEqual(response["comments"][0]["creator"], self.second_chat_user.id)
+
+        self.assertTrue(await comment_exists(body=CommentUtils.COMMENT_SECOND, room=self.room))
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_msgpack_subprotocol(self):
+        sender = websocket_communicator(self.url, self.second_user, subprotocols=[codec.MSGPACK_SUBPROTOCOL])
+        connected, subprotocol = await sender.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, codec.MSGPACK_SUBPROTOCOL)
+        history = codec.decode_binary(await sender.receive_from())
+        self.assertEqual([comment["body"] for comment in history["comments"]], [CommentUtils.COMMENT_FIRST])
+        listener = await self._connect_and_skip_history()
+
+        await sender.send_to(bytes_data=codec.encode_binary({"type": "new_message", "data": {"body": "binary"}}))
+        binary_frame = codec.decode_binary(await sender.receive_from())
+        self.assertEqual(binary_frame, await listener.receive_json_from())
+        self.assertEqual(binary_frame["comments"][0]["body"], "binary")
+
+        await sender.send_to(bytes_data=codec.encode_binary({"type": "new_message", "data": {}}))
+        self.assertEqual(codec.decode_binary(await sender.receive_from())["type"], "error")
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_room_groups_get_their_encoding_only(self):
+        channel_layer = get_channel_layer()
+        text_channel, binary_channel = await channel_layer.new_channel(), await channel_layer.new_channel()
+        await channel_layer.group_add(room_group_name(self.room.id), text_channel)
+        await channel_layer.group_add(room_group_name(self.room.id, binary=True), binary_channel)
+        sender = await self._connect_and_skip_history(self.second_user)
+
+        await sender.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        await sender.receive_json_from()
+        text_event = await channel_layer.receive(text_channel)
+        binary_event = await channel_layer.receive(binary_channel)
+        self.assertEqual((set(text_event), set(binary_event)), ({"type", "text"}, {"type", "bytes"}))
+        self.assertEqual(codec.decode(text_event["text"]), codec.decode_binary(binary_event["bytes"]))
+        await sender.disconnect()
+
+    async def test_json_is_the_default(self):
+        communicator = websocket_communicator(self.url, subprotocols=["unknown"])
+        _, subprotocol = await communicator.connect()
+        self.assertIsNone(subprotocol)
+        self.assertEqual((await communicator.receive_json_from())["type"], "new_message")
+        await communicator.disconnect()
+
+    async def _send_burst_and_receive(self, amount: int):
+        sender = await self._connect_and_skip_history(self.second_user)
+        listener = await self._connect_and_skip_history()
+
+        for i in range(amount):
+            await sender.send_json_to({"type": "new_message", "data": {"body": f"burst {i}"}})
+        response = await listener.receive_json_from()
+        await sender.disconnect()
+        await listener.disconnect()
+        return response
+
+    @override_settings(SRACHAT_BROADCAST_COALESCE_MS=300)
+    async def test_burst_is_coalesced(self):
+        response = await self._send_burst_and_receive(3)
+        self.assertEqual(response["type"], "new_message")
+        self.assertEqual([comment["body"] for comment in response["comments"]], ["burst 0", "burst 1", "burst 2"])
+
+    @override_settings(SRACHAT_BROADCAST_COALESCE_MS=10_000, SRACHAT_BROADCAST_COALESCE_MAX_COMMENTS=2)
+    async def test_coalesced_frame_is_sent_when_full(self):
+        response = await self._send_burst_and_receive(2)
+        self.assertEqual([comment["body"] for comment in response["comments"]], ["burst 0", "burst 1"])
+
+    @override_settings(SRACHAT_COMMENT_WRITE_BEHIND=True, SRACHAT_COMMENT_WRITE_BEHIND_BATCH_SIZE=2)
+    async def test_write_behind_broadcasts_and_saves_batch(self):
+        sender = await self._connect_and_skip_history(self.second_user)
+        listener = await self._connect_and_skip_history()
+
+        await sender.send_json_to({"type": "new_message", "data": {"body": "first"}})
+        first = (await listener.receive_json_from())["comments"][0]
+        self.assertIsNone(first["id"])
+        self.assertFalse(await comment_exists(body="first"))
+
+        await sender.send_json_to({"type": "new_message", "data": {"body": "second"}})
+        second = (await listener.receive_json_from())["comments"][0]
+        persisted = await listener.receive_json_from()
+        self.assertEqual(persisted["type"], "comments_persisted")
+        self.assertCountEqual(persisted["ids"].keys(), [first["pending_id"], second["pending_id"]])
+        # Ids follow the order the comments were shown in
+        self.assertLess(persisted["ids"][first["pending_id"]], persisted["ids"][second["pending_id"]])
+        self.assertTrue(await comment_exists(id=persisted["ids"][first["pending_id"]], body="first", team_number=2))
+        await sender.disconnect()
+        await listener.disconnect()
+
+    @override_settings(SRACHAT_COMMENT_WRITE_BEHIND=True, SRACHAT_COMMENT_WRITE_BEHIND_MS=10)
+    async def test_write_behind_failure_is_reported(self):
+        sender = await self._connect_and_skip_history(self.second_user)
+        persist_patch = mock.patch("srachat.consumers.write_behind.persist_comments", side_effect=DatabaseError)
+        with persist_patch, self.assertLogs("srachat.consumers.write_behind", level="ERROR"):
+            await sender.send_json_to({"type": "new_message", "data": {"body": "lost"}})
+            comment = (await sender.receive_json_from())["comments"][0]
+            failed = await sender.receive_json_from()
+        self.assertEqual(failed["type"], "comments_failed")
+        self.assertEqual(failed["pending_ids"], [comment["pending_id"]])
+        self.assertFalse(await comment_exists(body="lost"))
+        await sender.disconnect()
+
+    async def _assert_cannot_send_message(self, user=None):
+        communicator = await self._connect_and_skip_history(user)
+        await communicator.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "error")
+        self.assertFalse(await comment_exists(body=CommentUtils.COMMENT_SECOND))
+        await communicator.disconnect()
+
+    async def test_anonymous_cannot_send_message(self):
+        await self._assert_cannot_send_message()
+
+    async def test_non_participant_cannot_send_message(self):
+        await self._assert_cannot_send_message(self.third_user)
+
+    async def test_banned_participant_cannot_send_message(self):
+        await database_sync_to_async(self.room.banned_users.add)(self.second_chat_user)
+        await self._assert_cannot_send_message(self.second_user)
+
+    async def _connect_and_disconnect(self, user):
+        communicator = await self._connect_and_skip_history(user)
+        await communicator.disconnect()
+
+    def test_connect_query_count_does_not_depend_on_room_size(self):
+        for user in (self.first_user, self.second_user, None):
+            with self.assertNumQueries(2):
+                async_to_sync(self._connect_and_disconnect)(user)
+
+        for i in range(20):
+            chat_user = ChatUser.objects.get(user=User.objects.create_user(f"{UserUtils.USERNAME}{i + 10}"))
+            self.room.admins.add(chat_user)
+            self.room.banned_users.add(chat_user)
+            Comment.objects.create(creator=self.first_chat_user, room=self.room, body=str(i), team_number=1)
+        with self.assertNumQueries(2):
+            async_to_sync(self._connect_and_disconnect)(self.second_user)
+
+    async def test_creator_can_delete_own_messages(self):
+        communicator = await self._connect_and_skip_history(self.first_user)
+        await communicator.send_json_to({"type": "delete_messages", "data": {"ids": [self.first_comment_id]}})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "delete_messages")
+        self.assertFalse(await comment_exists(id=self.first_comment_id))
+        await communicator.disconnect()
+
+    async def test_non_creator_cannot_delete_messages(self):
+        communicator = await self._connect_and_skip_history(self.second_user)
+        await communicator.send_json_to({"type": "delete_messages", "data": {"ids": [self.first_comment_id]}})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "error")
+        self.assertTrue(await comment_exists(id=self.first_comment_id))
+        await communicator.disconnect()
+
+    @override_settings(SRACHAT_OUTBOUND_WINDOW=1)
+    async def test_acknowledgements_limit_sent_frames(self):
+        sender = await self._connect_and_skip_history(self.second_user)
+        listener = await self._connect_and_skip_history()
+        # The history frame is received but not acknowledged yet, so the window is full
+        await listener.send_json_to({"type": "ack", "data": {"received": 0}})
+
+        await sender.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        await sender.receive_json_from()
+        self.assertTrue(await listener.receive_nothing())
+        await listener.send_json_to({"type": "ack", "data": {"received": 1}})
+        response = await listener.receive_json_from()
+        self.assertEqual(response["comments"][0]["body"], CommentUtils.COMMENT_SECOND)
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_non_existing_room_closes_connection(self):
+        communicator = await self._connect(url=UrlUtils.Websockets.ROOM.format(self.room.id + 100))
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "error")
+        self.assertEqual((await communicator.receive_output())["type"], "websocket.close")
+        await communicator.disconnect()
+
+    @database_sync_to_async
+    def _rest_call(self, user, method: str, url_name: str, data=None):
+        self.client.force_authenticate(user)
+        # The control events are published on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(reverse(url_name, args=[self.room.id]), data=data, format="json")
+        self.client.force_authenticate(None)
+        return response
+
+    async def test_ban_and_unban_affect_open_socket(self):
+        communicator = await self._connect_and_skip_history(self.second_user)
+
+        await self._rest_call(self.first_user, "post", UrlUtils.Rooms.BAN, {"id": self.second_chat_user.id})
+        membership = await communicator.receive_json_from()
+        self.assertEqual(
+            membership,
+            {"room": self.room.id, "type": "membership", "is_banned": True, "is_participant": False, "team_number": None}
+        )
+        await communicator.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        self.assertEqual((await communicator.receive_json_from())["type"], "error")
+
+        await self._rest_call(self.first_user, "delete", UrlUtils.Rooms.BAN, {"id": self.second_chat_user.id})
+        self.assertFalse((await communicator.receive_json_from())["is_banned"])
+        await communicator.disconnect()
+
+    async def test_team_change_affects_open_socket(self):
+        communicator = await self._connect_and_skip_history(self.third_user)
+
+        await self._rest_call(self.third_user, "post", UrlUtils.Rooms.USERS, {"team_number": 1})
+        membership = await communicator.receive_json_from()
+        self.assertTrue(membership["is_participant"])
+        self.assertEqual(membership["team_number"], 1)
+        await communicator.send_json_to({"type": "new_message", "data": {"body": CommentUtils.COMMENT_SECOND}})
+        self.assertEqual((await communicator.receive_json_from())["comments"][0]["team_number"], 1)
+
+        await self._rest_call(self.third_user, "delete", UrlUtils.Rooms.USERS)
+        self.assertFalse((await communicator.receive_json_from())["is_participant"])
+        await communicator.disconnect()
+
+    async def test_deactivation_closes_open_sockets(self):
+        communicator = await self._connect_and_skip_history(self.second_user)
+        await self._rest_call(self.first_user, "post", UrlUtils.Rooms.DEACTIVATE)
+        self.assertEqual((await communicator.receive_json_from())["type"], "error")
+        self.assertEqual((await communicator.receive_output())["type"], "websocket.close")
+        await communicator.disconnect()
+
+
+@mock.patch.object(RoomSubscription, "HISTORY_WINDOW", 2)
+@mock.patch.object(RoomSubscription, "RESUME_MAX_GAP", 3)
+class RoomConsumerHistoryTest(TestCase):
+    """
+    Set up: a room with five comments of its creator, the history window is two comments,
+    at most three comments can be resumed.
+    """
+    def setUp(self):
+        chat_user = ChatUser.objects.get(user=User.objects.create_user(UserUtils.USERNAME_FIRST))
+        room = Room.objects.create(
+            creator=chat_user, title=RoomUtils.DATA_ROOM_FIRST.title,
+            first_team_name=RoomUtils.DATA_ROOM_FIRST.first_team_name,
+            second_team_name=RoomUtils.DATA_ROOM_FIRST.second_team_name
+        )
+        self.bodies = [f"comment {i}" for i in range(5)]
+        self.ids = [
+            Comment.objects.create(creator=chat_user, room=room, body=body, team_number=1).id
+            for body in self.bodies
+        ]
+        self.url = UrlUtils.Websockets.ROOM.format(room.id)
+        async_to_sync(get_channel_layer().flush)()
+
+    async def test_history_window_and_load_more(self):
+        communicator = websocket_communicator(self.url)
+        await communicator.connect()
+
+        history = await communicator.receive_json_from()
+        self.assertEqual([comment["body"] for comment in history["comments"]], self.bodies[3:])
+        self.assertTrue(history["has_more"])
+
+        await communicator.send_json_to({"type": "load_more", "data": {"cursor": history["cursor"]}})
+        page = await communicator.receive_json_from()
+        self.assertEqual(page["type"], "load_more")
+        self.assertEqual([comment["body"] for comment in page["comments"]], self.bodies[1:3])
+        self.assertTrue(page["has_more"])
+
+        await communicator.send_json_to({"type": "load_more", "data": {"cursor": page["cursor"], "limit": 10}})
+        page = await communicator.receive_json_from()
+        self.assertEqual([comment["body"] for comment in page["comments"]], self.bodies[:1])
+        self.assertFalse(page["has_more"])
+        await communicator.disconnect()
+
+    async def test_load_more_bad_cursor(self):
+        communicator = websocket_communicator(self.url)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        for data in ({}, {"cursor": "not a cursor"}, {"cursor": 123}):
+            await communicator.send_json_to({"type": "load_more", "data": data})
+            self.assertEqual((await communicator.receive_json_from())["type"], "error")
+        await communicator.disconnect()
+
+    async def test_resume_from_query_string(self):
+        communicator = websocket_communicator(self.url + f"?last_seen_id={self.ids[2]}")
+        await communicator.connect()
+
+        delta = await communicator.receive_json_from()
+        self.assertEqual(delta["type"], "new_message")
+        self.assertTrue(delta["resumed"])
+        self.assertEqual([comment["body"] for comment in delta["comments"]], self.bodies[3:])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_resume_up_to_date(self):
+        communicator = websocket_communicator(self.url + f"?last_seen_id={self.ids[-1]}")
+        await communicator.connect()
+        self.assertEqual((await communicator.receive_json_from())["comments"], [])
+        await communicator.disconnect()
+
+    async def test_resume_gap_too_large(self):
+        communicator = websocket_communicator(self.url + f"?last_seen_id={self.ids[0]}")
+        await communicator.connect()
+
+        self.assertEqual((await communicator.receive_json_from())["type"], "resync_required")
+        window = await communicator.receive_json_from()
+        self.assertEqual(window["type"], "new_message")
+        self.assertEqual([comment["body"] for comment in window["comments"]], self.bodies[3:])
+        await communicator.disconnect()
+
+    async def test_resume_message(self):
+        communicator = websocket_communicator(self.url)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({"type": "resume", "data": {"last_seen_id": self.ids[3]}})
+        delta = await communicator.receive_json_from()
+        self.assertTrue(delta["resumed"])
+        self.assertEqual([comment["body"] for comment in delta["comments"]], self.bodies[4:])
+
+        await communicator.send_json_to({"type": "resume", "data": {"last_seen_id": "abc"}})
+        self.assertEqual((await communicator.receive_json_from())["type"], "error")
+        await communicator.disconnect()
+
+
+class OutboundQueueTest(SimpleTestCase):
+    """
+    The socket is stuck until the test lets it go, the queue can hold two frames.
+    """
+    def setUp(self):
+        metrics.reset()
+        self.sent = []
+        self.socket_is_free = asyncio.Event()
+
+    async def _base_send(self, message):
+        await self.socket_is_free.wait()
+        self.sent.append(message)
+
+    async def _overflow(self, policy: str, binary: bool = False):
+        queue = OutboundQueue(self._base_send, 2, policy, binary=binary)
+        queue.start()
+        for i in range(4):
+            queue.put({"type": "websocket.send", "text": str(i)})
+            # Let the writer take the first frame, so it is stuck with it
+            await asyncio.sleep(0)
+        self.socket_is_free.set()
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return [message.get("text") for message in self.sent]
+
+    async def test_drop_oldest(self):
+        self.assertEqual(await self._overflow(SlowConsumerPolicy.DROP_OLDEST), ["0", "2", "3"])
+        self.assertEqual(metrics.get("outbound_queue.drop_oldest"), 1)
+
+    async def test_resync(self):
+        sent = await self._overflow(SlowConsumerPolicy.RESYNC)
+        self.assertEqual(sent[0], "0")
+        self.assertEqual(codec.decode(sent[1]), {"type": "resync_required", "reason": "slow_consumer"})
+        self.assertEqual(sent[2:], ["3"])
+        self.assertEqual(metrics.get("outbound_queue.resync"), 1)
+
+    async def test_binary_resync(self):
+        await self._overflow(SlowConsumerPolicy.RESYNC, binary=True)
+        self.assertEqual(
+            codec.decode_binary(self.sent[1]["bytes"]), {"type": "resync_required", "reason": "slow_consumer"}
+        )
+
+    async def test_disconnect(self):
+        await self._overflow(SlowConsumerPolicy.DISCONNECT)
+        self.assertEqual(self.sent[-1], {"type": "websocket.close"})
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(metrics.get("outbound_queue.disconnect"), 1)
+
+    async def test_window(self):
+        queue = OutboundQueue(self._base_send, 2, SlowConsumerPolicy.DROP_OLDEST, window=1)
+        queue.start()
+        self.socket_is_free.set()
+        for i in range(5):
+            if i == 2:
+                # Not limited until the first acknowledgement
+                queue.ack(1)
+            queue.put({"type": "websocket.send", "text": str(i)})
+            await asyncio.sleep(0)
+        self.assertEqual([message["text"] for message in self.sent], ["0", "1"])
+        self.assertEqual(metrics.get("outbound_queue.drop_oldest"), 1)
+
+        # More than was sent doesn't open the window any further
+        queue.ack(10)
+        await asyncio.sleep(0)
+        queue.ack(3)
+        await asyncio.sleep(0)
+        await queue.stop()
+        self.assertEqual([message["text"] for message in self.sent], ["0", "1", "3", "4"])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(self._base_send, 2, "ignore")
@@ -1,15 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, Any, Callable, Optional
+from unittest import mock, skipIf
 
-from django.db import transaction
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
-from ..models import ChatUser
+from ..models import ChatUser, Comment
 from ..models.language import LanguageChoices
 from ..models.room import Room, RoomVote
 from ..models.tag import Tag
 from ..tests.utils import UserUtils, RoomUtils, UrlUtils, SrachatTestCase
+from ..views.rooms import RoomVoteTeam
 
 # TODO: expand the documentation
 # TODO: add tests for images
@@ -56,13 +62,108 @@ class RoomCreationTest(SrachatTestCase):
         self.client.post(self.url, data=RoomUtils.DATA_ROOM_SECOND._asdict(), format="json")
 
         get_response = self.client.get(self.url)
-        self.assertEqual(len(get_response.data), 2)
+        self.assertEqual(len(get_response.data["results"]), 2)
         # Check that for fetching all fields can be shown
         self.assertCountEqual(
             Room.MODIFIABLE_FIELD + Room.UNMODIFIABLE_FIELDS + ["id"],
-            list(get_response.data[0].keys())
+            list(get_response.data["results"][0].keys())
         )
 
+    def test_list_rooms_page_by_page(self):
+        self._get_rooms_count_queries(5)
+        rooms = []
+        url = self.url + "?limit=2"
+        while url:
+            get_response = self.client.get(url)
+            self.assertLessEqual(len(get_response.data["results"]), 2)
+            rooms += [room["id"] for room in get_response.data["results"]]
+            url = get_response.data["next"]
+        # Newest rooms first
+        self.assertEqual(rooms, list(Room.objects.order_by("-id").values_list("id", flat=True)))
+
+    def test_list_rooms_filtered_by_language_and_tag(self):
+        self.client.post(self.url, data=RoomUtils.DATA_ROOM_FIRST._asdict(), format="json")
+        second_room_data = {**RoomUtils.DATA_ROOM_SECOND._asdict(), "language": LanguageChoices.ENGLISH}
+        self.client.post(self.url, data=second_room_data, format="json")
+
+        def get_titles(**params):
+            return [room["title"] for room in self.client.get(self.url, data=params).data["results"]]
+
+        self.assertEqual(get_titles(language=LanguageChoices.ENGLISH), [RoomUtils.ROOM_NAME_SECOND])
+        self.assertEqual(get_titles(language=LanguageChoices.RUSSIAN), [RoomUtils.ROOM_NAME_FIRST])
+        # Only the second room has the fourth tag
+        fourth_tag = Tag.objects.get(pk=RoomUtils.DATA_ROOM_SECOND.tags[-1]).name
+        self.assertEqual(get_titles(tag=fourth_tag), [RoomUtils.ROOM_NAME_SECOND])
+        self.assertEqual(get_titles(tag=fourth_tag, language=LanguageChoices.RUSSIAN), [])
+
+    def test_list_rooms_by_activity(self):
+        self._get_rooms_count_queries(3)
+        creator = ChatUser.objects.get(user__username=UserUtils.USERNAME_FIRST)
+        first_room, second_room, _ = Room.objects.order_by("id")
+        for room in (second_room, first_room, second_room):
+            Comment.objects.create(creator=creator, room=room, body="comment", team_number=1)
+
+        self.client.credentials()
+        with self.assertNumQueries(1):
+            get_response = self.client.get(self.url, data={"ordering": "activity", "fields": "id,comment_count"})
+        # Rooms without comments are not listed
+        self.assertEqual(get_response.data["results"], [
+            {"id": second_room.id, "comment_count": 2}, {"id": first_room.id, "comment_count": 1}
+        ])
+
+        get_response = self.client.get(self.url, data={"ordering": "activity", "limit": 1})
+        self.assertEqual([room["id"] for room in get_response.data["results"]], [second_room.id])
+        get_response = self.client.get(get_response.data["next"])
+        self.assertEqual([room["id"] for room in get_response.data["results"]], [first_room.id])
+
+        get_response = self.client.get(self.url, data={"ordering": "comments"})
+        self.assertEqual(get_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _get_rooms_count_queries(self, rooms_amount: int) -> int:
+        # Creates the rooms up to the given amount and counts the queries of the list
+        creator = ChatUser.objects.get(user__username=UserUtils.USERNAME_FIRST)
+        for i in range(Room.objects.count(), rooms_amount):
+            room = Room.objects.create(
+                creator=creator, title=f"{RoomUtils.ROOM_NAME_FIRST} {i}",
+                first_team_name=RoomUtils.DATA_ROOM_FIRST.first_team_name,
+                second_team_name=RoomUtils.DATA_ROOM_FIRST.second_team_name
+            )
+            room.tags.set(RoomUtils.DATA_ROOM_FIRST.tags)
+            room.admins.add(creator)
+            room.banned_users.add(creator)
+
+        with CaptureQueriesContext(connection) as queries:
+            get_response = self.client.get(self.url)
+        self.assertEqual(len(get_response.data["results"]), Room.objects.count())
+        return len(queries)
+
+    def test_list_rooms_query_count_does_not_depend_on_rooms_amount(self):
+        self.client.credentials()
+        # Rooms, their tags, admins and banned users
+        self.assertEqual(self._get_rooms_count_queries(2), 4)
+        self.assertEqual(self._get_rooms_count_queries(20), 4)
+
+    def test_list_rooms_sparse_fields(self):
+        self._get_rooms_count_queries(2)
+        self.client.credentials()
+        fields = ["id", "title", "first_team_votes", "tags"]
+        # Rooms and their tags only
+        with self.assertNumQueries(2):
+            get_response = self.client.get(self.url, data={"fields": ",".join(fields)})
+        self.assertEqual(get_response.status_code, status.HTTP_200_OK)
+        for room in get_response.data["results"]:
+            self.assertCountEqual(room.keys(), fields)
+        self.assertCountEqual(
+            get_response.data["results"][0]["tags"], Tag.get_names_by_ids(RoomUtils.DATA_ROOM_FIRST.tags)
+        )
+
+        with self.assertNumQueries(1):
+            self.client.get(self.url, data={"fields": "id,title"})
+
+    def test_list_rooms_unknown_fields(self):
+        get_response = self.client.get(self.url, data={"fields": "id,password"})
+        self.assertEqual(get_response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_room_creation_authenticated_too_many_tags(self):
         data = RoomUtils.DATA_ROOM_FIRST._asdict()
         data["tags"] = data["tags"].copy()
@@ -110,7 +211,7 @@ class RoomCreationTest(SrachatTestCase):
 
         # Check that not a single room was created
         get_response = self.client.get(self.url)
-        self.assertListEqual(get_response.data, [])
+        self.assertListEqual(get_response.data["results"], [])
 
     def test_forbidden_parameter_provided(self):
         self.set_credentials(self.auth_token)
@@ -137,7 +238,7 @@ class RoomCreationTest(SrachatTestCase):
         self._post_assert_status(room_data, status.HTTP_400_BAD_REQUEST)
 
         get_response = self.client.get(self.url)
-        self.assertListEqual(get_response.data, [])
+        self.assertListEqual(get_response.data["results"], [])
 
     def test_too_big_number_of_max_participants(self):
         # First room votes
@@ -174,13 +275,13 @@ class RoomTest(SrachatTestCase):
         data["admins"] = [1, 2]
         post_response = self.client.post(self.url_list, data=data, format="json")
 
-        self.first_room_data = self.client.get(self.url_info).data
-
         self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Room.objects.count(), 1)
         # first user becomes a participant of his own room
         self.client.post(self.url_users, data={"team_number": 1}, format="json")
 
+        self.first_room_data = self.client.get(self.url_info).data
+
     def _check_all_fields_are_present_first_room(self):
         get_response = self.client.get(self.url_info)
         keys = ["id"] + Room.MODIFIABLE_FIELD + Room.UNMODIFIABLE_FIELDS
@@ -213,7 +314,7 @@ class RoomTest(SrachatTestCase):
 
         get_response = self.client.get(self.url_list)
         self.assertEqual(get_response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(get_response.data), 1)
+        self.assertEqual(len(get_response.data["results"]), 1)
 
         self.set_credentials(self.auth_token_second)
 
@@ -681,6 +782,46 @@ class RoomTest(SrachatTestCase):
         post_response = self.client.post(self.url_vote, data={"team_number": 1}, format="json")
         self.assertEqual(post_response.status_code, status.HTTP_202_ACCEPTED)
 
+    def test_room_vote_does_not_lose_concurrent_votes(self):
+        """
+            POST: '/pidor/rooms/{id}/vote/
+        """
+        other_voter = ChatUser.objects.get(user=User.objects.create_user(UserUtils.USERNAME_FORTH))
+        created_before = Room.objects.get(pk=self.first_room_id).created
+        get_object = RoomVoteTeam.get_object
+
+        def get_object_and_vote_in_between(view):
+            room = get_object(view)
+            # Another vote lands after the room was read by the view
+            RoomVote.cast(room.id, other_voter.id, 1)
+            return room
+
+        with mock.patch.object(RoomVoteTeam, "get_object", get_object_and_vote_in_between):
+            post_response = self.client.post(self.url_vote, data={"team_number": 1}, format="json")
+        self.assertEqual(post_response.status_code, status.HTTP_202_ACCEPTED)
+
+        room = Room.objects.get(pk=self.first_room_id)
+        self.assertEqual((room.first_team_votes, room.second_team_votes), (2, 0))
+        # Voting doesn't rewrite the rest of the room
+        self.assertEqual(room.created, created_before)
+
+    @override_settings(SRACHAT_VOTE_COUNTER_SHARDS=4)
+    def test_room_votes_in_shards_are_shown(self):
+        """
+            POST: '/pidor/rooms/{id}/vote/
+            GET: '/pidor/rooms/{id}/
+            GET: '/pidor/rooms/
+        """
+        post_response = self.client.post(self.url_vote, data={"team_number": 1}, format="json")
+        self.assertEqual(post_response.status_code, status.HTTP_202_ACCEPTED)
+        # The vote is not folded into the room yet
+        self.assertEqual(Room.objects.get(pk=self.first_room_id).first_team_votes, 0)
+
+        self.assertEqual(self.client.get(self.url_info).data["first_team_votes"], 1)
+        list_response = self.client.get(self.url_list, {"fields": "id,first_team_votes,second_team_votes"})
+        self.assertEqual(list_response.data["results"][0]["first_team_votes"], 1)
+        self.assertEqual(list_response.data["results"][0]["second_team_votes"], 0)
+
     def test_room_detail_tags_as_strings(self):
         """
             GET: '/pidor/rooms/{id}/
@@ -688,3 +829,38 @@ class RoomTest(SrachatTestCase):
 
         tags = self.client.get(self.url_info).data["tags"]
         self.assertTrue(all(map(lambda tag: isinstance(tag, str), tags)))
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite doesn't let several threads write to the test database at once")
+class RoomVoteConcurrencyTest(TransactionTestCase):
+    """
+    Setup: a room and several voters, which vote at the same time from their own threads and connections.
+    """
+    VOTERS_AMOUNT = 8
+
+    def setUp(self):
+        self.voters = [
+            ChatUser.objects.get(user=User.objects.create_user(f"{UserUtils.USERNAME}{i}"))
+            for i in range(self.VOTERS_AMOUNT)
+        ]
+        self.room = Room.objects.create(
+            creator=self.voters[0], title=RoomUtils.ROOM_NAME_FIRST,
+            first_team_name=RoomUtils.DATA_ROOM_FIRST.first_team_name,
+            second_team_name=RoomUtils.DATA_ROOM_FIRST.second_team_name
+        )
+
+    def _vote(self, voter: ChatUser, team_number: int):
+        try:
+            return RoomVote.cast(self.room.id, voter.id, team_number)
+        finally:
+            connection.close()
+
+    def test_parallel_votes_are_all_counted(self):
+        team_numbers = [i % 2 + 1 for i in range(self.VOTERS_AMOUNT)]
+        with ThreadPoolExecutor(self.VOTERS_AMOUNT) as executor:
+            results = list(executor.map(self._vote, self.voters, team_numbers))
+        self.assertTrue(all(results))
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.first_team_votes, team_numbers.count(1))
+        self.assertEqual(self.room.second_team_votes, team_numbers.count(2))
@@ -0,0 +1,208 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from root.token_auth import (
+    INVALIDATION_GROUP, TokenAuthMiddlewareStack, TokenCacheInvalidationMiddleware, get_user, load_token, token_cache
+)
+from .. import metrics
+from .utils import SrachatTestCase, UrlUtils, UserUtils
+
+"""
+Setup:
+    - Register a user and authenticate the client with their token.
+
+To test:
+    - Only the first request with a token queries the database, REST and websocket share the cached token
+    - Logout and changes of the user are applied right away by the process and published to the other ones
+    - A token deleted while it is being read from the database is not cached
+    - The cache keeps the most recently used tokens only, each for the TTL
+    - Websockets are authenticated by the token from a header, a subprotocol or a cookie
+"""
+
+
+class TokenCacheTest(SrachatTestCase):
+    def setUp(self):
+        token_cache.clear()
+        metrics.reset()
+        self.auth_token = self.register_user_return_token(UserUtils.DATA_FIRST)
+        self.set_credentials(self.auth_token)
+        self.url = reverse(UrlUtils.Rooms.LIST)
+
+    def test_token_is_queried_once(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        # Only the rooms are left
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            user = async_to_sync(get_user)(self.auth_token)
+        self.assertEqual(user.username, UserUtils.USERNAME_FIRST)
+        self.assertEqual((metrics.get("token_cache.hit"), metrics.get("token_cache.miss")), (2, 1))
+
+    def test_websocket_and_rest_share_the_cache(self):
+        async_to_sync(get_user)(self.auth_token)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_unknown_token_is_anonymous(self):
+        self.assertTrue(async_to_sync(get_user)("unknown").is_anonymous)
+        self.set_credentials("unknown")
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(metrics.get("token_auth.invalid"), 2)
+
+    def test_logout_invalidates_the_token(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.post(reverse("rest_logout")).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(async_to_sync(get_user)(self.auth_token).is_anonymous)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.url)
+        user = User.objects.get(username=UserUtils.USERNAME_FIRST)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(async_to_sync(get_user)(self.auth_token).is_anonymous)
+
+    def test_cached_user_is_a_copy(self):
+        async_to_sync(get_user)(self.auth_token).username = "changed"
+        self.assertEqual(async_to_sync(get_user)(self.auth_token).username, UserUtils.USERNAME_FIRST)
+
+    @override_settings(SRACHAT_TOKEN_CACHE_SIZE=1)
+    def test_least_recently_used_token_is_evicted(self):
+        second_token = self.register_user_return_token(UserUtils.DATA_SECOND)
+        async_to_sync(get_user)(self.auth_token)
+        async_to_sync(get_user)(second_token)
+        self.assertEqual(len(token_cache), 1)
+        self.assertIsNone(token_cache.get(self.auth_token))
+        self.assertEqual(token_cache.get(second_token).key, second_token)
+
+    @override_settings(SRACHAT_TOKEN_CACHE_TTL=0)
+    def test_expired_token_is_queried_again(self):
+        async_to_sync(get_user)(self.auth_token)
+        self.assertIsNone(token_cache.get(self.auth_token))
+
+    def test_logout_during_load_is_not_cached(self):
+        query_set = Token.objects.select_related("user")
+        get = query_set.get
+
+        def get_and_logout(**kwargs):
+            token = get(**kwargs)
+            # Another request logs out after the token has been read
+            Token.objects.get(key=token.key).delete()
+            return token
+
+        with mock.patch.object(Token.objects, "select_related", return_value=query_set), \
+                mock.patch.object(query_set, "get", side_effect=get_and_logout):
+            load_token(self.auth_token)
+        self.assertEqual(len(token_cache), 0)
+        self.assertIsNone(async_to_sync(get_user)(self.auth_token).pk)
+
+    @override_settings(SRACHAT_TOKEN_CACHE_SIZE=0)
+    def test_disabled_cache(self):
+        token_cache.put(Token.objects.get(key=self.auth_token), token_cache.generation)
+        self.assertEqual(len(token_cache), 0)
+        with self.assertNumQueries(1):
+            async_to_sync(get_user)(self.auth_token)
+
+
+class TokenCacheInvalidationTest(SrachatTestCase):
+    def setUp(self):
+        token_cache.clear()
+        async_to_sync(get_channel_layer().flush)()
+        self.auth_token = self.register_user_return_token(UserUtils.DATA_FIRST)
+
+    def test_changes_are_published(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(INVALIDATION_GROUP, channel)
+        token = Token.objects.select_related("user").get(key=self.auth_token)
+        with self.captureOnCommitCallbacks(execute=True):
+            token.user.save()
+            token.delete()
+        self.assertEqual(
+            async_to_sync(channel_layer.receive)(channel), {"type": "token_cache.invalidate", "user_id": token.user_id}
+        )
+        self.assertEqual(
+            async_to_sync(channel_layer.receive)(channel), {"type": "token_cache.invalidate", "key": self.auth_token}
+        )
+
+    def test_invalidations_of_other_processes_are_applied(self):
+        async_to_sync(self._receive_invalidation)()
+
+    async def _receive_invalidation(self):
+        async def application(scope, receive, send):
+            pass
+
+        middleware = TokenCacheInvalidationMiddleware(application)
+        await middleware({"type": "http"}, None, None)
+        await database_sync_to_async(load_token)(self.auth_token)
+        self.assertEqual(len(token_cache), 1)
+
+        # Logout handled by another process
+        await get_channel_layer().group_send(
+            INVALIDATION_GROUP, {"type": "token_cache.invalidate", "key": self.auth_token}
+        )
+        for _ in range(100):
+            if not len(token_cache):
+                break
+            await asyncio.sleep(0.01)
+        await middleware.unsubscribe()
+        self.assertEqual(len(token_cache), 0)
+
+
+class TokenAuthMiddlewareTest(SrachatTestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.auth_token = self.register_user_return_token(UserUtils.DATA_FIRST)
+        self.scope = None
+
+    async def _application(self, scope, receive, send):
+        self.scope = scope
+        await receive()
+        await send({"type": "websocket.accept", "subprotocol": None})
+
+    def _connect(self, headers=None, subprotocols=None):
+        async def connect():
+            communicator = WebsocketCommunicator(
+                TokenAuthMiddlewareStack(self._application), "/", headers=headers, subprotocols=subprotocols
+            )
+            _, subprotocol = await communicator.connect()
+            await communicator.disconnect()
+            return subprotocol
+        return async_to_sync(connect)()
+
+    def test_token_from_header(self):
+        self._connect(headers=[(b"authorization", f"Token {self.auth_token}".encode())])
+        self.assertEqual(self.scope["user"].username, UserUtils.USERNAME_FIRST)
+
+    def test_token_from_subprotocol(self):
+        subprotocol = self._connect(subprotocols=["srachat", f"token.{self.auth_token}"])
+        self.assertEqual(self.scope["user"].username, UserUtils.USERNAME_FIRST)
+        # The consumer doesn't see the token, the browser gets it back as it requires
+        self.assertEqual(self.scope["subprotocols"], ["srachat"])
+        self.assertEqual(subprotocol, f"token.{self.auth_token}")
+
+    def test_token_from_cookie(self):
+        self._connect(headers=[(b"cookie", f"csrftoken=x; token={self.auth_token}".encode())])
+        self.assertEqual(self.scope["user"].username, UserUtils.USERNAME_FIRST)
+        self.assertEqual(self.scope["cookies"], {"csrftoken": "x", "token": self.auth_token})
+        self.assertNotIn("session", self.scope)
+
+    def test_header_token_goes_first(self):
+        self._connect(headers=[(b"authorization", b"Token unknown"), (b"cookie", f"token={self.auth_token}".encode())])
+        self.assertTrue(self.scope["user"].is_anonymous)
+
+    def test_no_token_is_anonymous(self):
+        self.assertIsNone(self._connect(headers=[(b"authorization", f"Bearer {self.auth_token}".encode())]))
+        self.assertTrue(self.scope["user"].is_anonymous)
@@ -46,14 +46,18 @@ class UsersTest(SrachatTestCase):
 
         list_response = self.client.get(self.url_list)
         self.assertEqual(list_response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(list_response.data), 1)
+        self.assertEqual(len(list_response.data["results"]), 1)
 
         post_response = self.register_user_return_response(UserUtils.DATA_SECOND)
         self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
 
         response = self.client.get(self.url_list)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
+
+        # Users joined with their accounts and the ids of their rooms
+        with self.assertNumQueries(2):
+            self.client.get(self.url_list)
 
     def test_user_list_admin_not_shown(self):
         """
@@ -63,7 +67,7 @@ class UsersTest(SrachatTestCase):
 
         response = self.client.get(self.url_list)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
 
     def test_chat_user_cannot_be_added_via_endpoint(self):
         """
@@ -73,7 +77,7 @@ class UsersTest(SrachatTestCase):
         self.assertEqual(post_response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
         get_response = self.client.get(self.url_list)
-        self.assertEqual(len(get_response.data), 1)
+        self.assertEqual(len(get_response.data["results"]), 1)
 
     def test_only_safe_methods_allowed(self):
         """
@@ -330,6 +334,40 @@ class RoomUserTest(SrachatTestCase):
         participations = Participation.objects.filter(room_id=self.first_room_id)
         self.assertEqual(participations.count(), 1)
 
+    def test_room_participants_counters(self):
+        """
+            DELETE, POST: '/pidor/rooms/{id}/users/
+            POST: '/pidor/rooms/{id}/ban/
+            DELETE: '/pidor/users/{id}/
+        """
+
+        def assert_participants(first_team: int, second_team: int):
+            data = self.client.get(self.url_info).data
+            self.assertEqual(
+                (data["first_team_participants"], data["second_team_participants"]), (first_team, second_team)
+            )
+
+        assert_participants(1, 0)
+        self._try_join_the_team(status.HTTP_202_ACCEPTED, self.auth_token_second, 2)
+        self._try_join_the_team(status.HTTP_202_ACCEPTED, self.auth_token_third, 1, [1, 2])
+        assert_participants(2, 1)
+
+        # Leaving
+        self.client.delete(self.url_users)
+        assert_participants(1, 1)
+        # Ban removes the user from the team
+        self.set_credentials(self.auth_token_first)
+        self.client.post(self.url_ban_user, data={"id": 2}, format="json")
+        assert_participants(1, 0)
+
+        # A deleted account leaves the team
+        self.set_credentials(self.auth_token_third)
+        self.client.post(self.url_users, data={"team_number": 1}, format="json")
+        assert_participants(2, 0)
+        response = self.client.delete(reverse(UrlUtils.Users.DETAILS, args=[3]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        assert_participants(1, 0)
+
     def _try_ban_user_and_check(self, status_code: int, banned_user_id: Optional[int] = None):
         if banned_user_id:
             data = {"id": banned_user_id}
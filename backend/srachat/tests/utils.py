@@ -2,12 +2,16 @@ from collections import namedtuple
 from dataclasses import asdict, dataclass
 from typing import Any, Dict, List
 
-from django.contrib.auth.models import User
-from django.urls import reverse
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.urls import path, reverse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.test import APITestCase
 
+from ..routes import srachat_router
+
 
 # TODO: unify all data classes
 
@@ -123,6 +127,11 @@ class UrlUtils:
     class Comments:
         DETAILS = "comment_details"
 
+    @dataclass
+    class Websockets:
+        ROOM = "/ws/pidor/rooms/{}/"
+        ROOMS = "/ws/pidor/rooms/"
+
 
 class SrachatTestCase(APITestCase):
     def register_user_return_response(self, user_data: Dict[str, str]) -> Response:
@@ -154,3 +163,23 @@ class SrachatTestCase(APITestCase):
 
     def set_credentials(self, token: str):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+
+class ScopeUserMiddleware:
+    """
+    Puts a predefined user into the websocket scope instead of resolving it from the token.
+    Used by the benchmarks as well, so they don't pay for the token lookup.
+    """
+
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope["user"] = self.user
+        return await self.inner(scope, receive, send)
+
+
+def websocket_communicator(url: str, user: User = None, subprotocols: List[str] = None) -> WebsocketCommunicator:
+    application = ScopeUserMiddleware(URLRouter([path('ws/pidor/', srachat_router)]), user or AnonymousUser())
+    return WebsocketCommunicator(application, url, subprotocols=subprotocols)
@@ -1,12 +1,16 @@
+from django.db.models import Prefetch
 from rest_framework import generics, status, parsers
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
+from ..consumers.events import RoomControlAction, publish_room_control
+from ..membership import RoomMembershipMixin
 from ..models.team_number import TeamNumber
 from ..models.user import ChatUser, Participation
 from ..models.room import Room
+from ..pagination import IdCursorPagination
 from ..permissions import IsAccountOwnerOrReadOnly, IsRoomAdminOrReadOnly
 from ..serializers.chatuser_serializer import ChatUserSerializer
 from ..serializers.participation_serializer import ParticipationSerializer
@@ -15,10 +19,17 @@ from ..validators import validate_non_negative_int
 
 class ChatUserList(generics.ListAPIView):
     """
-    This view is able to display all existing users.
+    This view is able to display all existing users page by page.
     """
-    queryset = ChatUser.objects.filter(user__is_staff=False)
+    queryset = (
+        ChatUser.objects
+        .filter(user__is_staff=False)
+        .select_related("user")
+        # Only the ids of the rooms are shown
+        .prefetch_related(Prefetch("rooms", queryset=Room.objects.only("id")))
+    )
     serializer_class = ChatUserSerializer
+    pagination_class = IdCursorPagination
 
 
 class ChatUserDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -31,7 +42,7 @@ class ChatUserDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ChatUserSerializer
 
 
-class RoomUserList(GenericAPIView):
+class RoomUserList(RoomMembershipMixin, GenericAPIView):
     """
     Returns all users of a room, adds a new one or deletes a caller of the endpoint.
     """
@@ -41,11 +52,12 @@ class RoomUserList(GenericAPIView):
 
     def get(self, request, pk, format=None):
         room = self.get_object()
-        participants = Participation.objects.filter(room=room)
+        # Read from the participation_room_team index only
+        participants = Participation.objects.filter(room=room).values_list("chatuser_id", "team_number")
         chat_user_id = {
             team_number: [
-                participant.chatuser_id for participant in participants
-                if participant.team_number == team_number
+                participant_id for participant_id, participant_team_number in participants
+                if participant_team_number == team_number
             ] for team_number in TeamNumber.values
         }
         return Response(chat_user_id)
@@ -58,29 +70,37 @@ class RoomUserList(GenericAPIView):
                 status=status.HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS
             )
 
-        user = ChatUser.objects.get(user=request.user)
-        if user in room.banned_users.all():
+        membership = self.membership.for_room(room)
+        if membership.is_banned:
             return Response("You are banned in this room", status=status.HTTP_403_FORBIDDEN)
 
         team_number = TeamNumber.get_team_number_from_data(request.data)
 
-        amount_of_participants = Participation.objects.filter(room=room, team_number=team_number).count()
-        if amount_of_participants >= room.max_participants_in_team:
-            return Response("This team reached maximum amount of participants", status=status.HTTP_406_NOT_ACCEPTABLE)
-
-        serializer = ParticipationSerializer(data=dict(chatuser=user.id, room=room.id, team_number=team_number))
+        serializer = ParticipationSerializer(
+            data=dict(chatuser=membership.chat_user_id, room=room.id, team_number=team_number)
+        )
         if serializer.is_valid(raise_exception=True):
-            serializer.save()
+            try:
+                # Checks the capacity of the team atomically, see `Participation.save`
+                serializer.save()
+            except OverflowError:
+                return Response(
+                    "This team reached maximum amount of participants", status=status.HTTP_406_NOT_ACCEPTABLE
+                )
+            publish_room_control(
+                room.id, RoomControlAction.TEAM_CHANGE, chat_user_id=membership.chat_user_id, team_number=team_number
+            )
             return Response(status=status.HTTP_202_ACCEPTED)
 
     def delete(self, request, pk):
         room = self.get_object()
-        chat_user = ChatUser.objects.get(user=request.user)
-        room.chat_users.remove(chat_user)
+        chat_user_id = self.membership.for_room(room).chat_user_id
+        room.chat_users.remove(chat_user_id)
+        publish_room_control(room.id, RoomControlAction.TEAM_CHANGE, chat_user_id=chat_user_id, team_number=None)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RoomBanUser(GenericAPIView):
+class RoomBanUser(RoomMembershipMixin, GenericAPIView):
     """
     Bans a user or retrieves all banned user for a specified room
     """
@@ -101,6 +121,7 @@ class RoomBanUser(GenericAPIView):
             return Response("Admins or a creator cannot be banned", status=status.HTTP_409_CONFLICT)
         room.chat_users.remove(user_id)
         room.banned_users.add(ChatUser.get_chat_user_or_404(user_id))
+        publish_room_control(room.id, RoomControlAction.BAN, chat_user_id=user_id)
         return Response(status=status.HTTP_202_ACCEPTED)
 
     def delete(self, request, pk):
@@ -108,6 +129,7 @@ class RoomBanUser(GenericAPIView):
         user_id = RoomBanUser.validate_and_return_user_id(request)
         if user_id in room.banned_users.values_list("id", flat=True):
             room.banned_users.remove(user_id)
+            publish_room_control(room.id, RoomControlAction.UNBAN, chat_user_id=user_id)
         else:
             return Response("Chat user is not blocked for this room", status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -4,27 +4,66 @@ from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
 from .modeldetail import ModelDetailView
+from ..membership import RoomMembershipMixin
 from ..models.comment import Comment
 from ..models.room import Room
-from ..models.user import ChatUser, Participation
+from ..pagination import encode_cursor, get_page_after, get_page_before
 from ..permissions import IsCreatorOrReadOnly, IsRoomParticipantOrReadOnly, IsAllowedRoomOrReadOnly
 from ..serializers.comment_serializer import ListCommentSerializer, SingleRoomCommentSerializer, UpdateCommentSerializer
 
 
-class CommentList(generics.GenericAPIView):
+class CommentList(RoomMembershipMixin, generics.GenericAPIView):
     """
     This view is able to display or add comments in all srachat rooms
     or if the room id is given to display or add comments to the given room.
+
+    Comments are listed page by page in the chronological order:
+    {"results": [...], "before": cursor of the older page or null, "after": cursor of the newer page or null}.
+    Without query parameters the newest page is returned, `?before=<cursor>` or `?after=<cursor>`
+    return the page next to the cursor, `?limit=` sets the size of the page up to MAX_PAGE_SIZE.
     """
     permission_classes = [IsAuthenticatedOrReadOnly & IsRoomParticipantOrReadOnly & IsAllowedRoomOrReadOnly]
     queryset = Room.objects.all()
     serializer_class = SingleRoomCommentSerializer
 
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 100
+
     def get(self, request, pk, format=None):
         room = self.get_object()
+        before = request.query_params.get("before") or None
+        after = request.query_params.get("after") or None
+        if before and after:
+            raise ValidationError("Only one of the before and after cursors can be specified.")
+        limit = self.get_limit(request)
+
         comments = Comment.objects.filter(room=room)
-        serializer = SingleRoomCommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        if after:
+            page = get_page_after(comments, limit, after)
+            # Everything up to the cursor is older than the page
+            has_older, has_newer = True, page.has_more
+        else:
+            page = get_page_before(comments, limit, before)
+            # Everything from the cursor on is newer than the page
+            has_older, has_newer = page.has_more, before is not None
+
+        objects = page.objects
+        first_cursor = encode_cursor(objects[0]) if objects else before or after
+        last_cursor = encode_cursor(objects[-1]) if objects else before or after
+        serializer = SingleRoomCommentSerializer(objects, many=True)
+        return Response({
+            "results": serializer.data,
+            "before": first_cursor if has_older else None,
+            "after": last_cursor if has_newer else None,
+        })
+
+    def get_limit(self, request) -> int:
+        limit = request.query_params.get("limit")
+        if limit is None:
+            return self.PAGE_SIZE
+        if not limit.isdigit() or int(limit) == 0:
+            raise ValidationError("Limit must be a positive integer.")
+        return min(int(limit), self.MAX_PAGE_SIZE)
 
     def post(self, request, pk, format=None):
         room = self.get_object()
@@ -34,15 +73,16 @@ class CommentList(generics.GenericAPIView):
                 status=status.HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS
             )
 
-        comment_creator = ChatUser.objects.get(user=request.user)
+        # Participation is checked by the permissions
+        membership = self.membership.for_room(room)
         comment_body = request.data.get("body", "")
         if not comment_body:
             raise ValidationError("You have to specify the comment body and it cannot be empty.")
 
         data = {
             "body": comment_body,
-            "creator": comment_creator.id,
-            "team_number": Participation.objects.get(chatuser=comment_creator, room=room).team_number
+            "creator": membership.chat_user_id,
+            "team_number": membership.team_number
         }
         serializer = SingleRoomCommentSerializer(data=data)
         serializer.is_valid(raise_exception=True)
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView
@@ -5,37 +7,91 @@ from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
 from .modeldetail import ModelDetailView
+from ..consumers.events import RoomControlAction, publish_room_control
+from ..membership import RoomMembershipMixin, get_membership
 from ..models.team_number import TeamNumber
-from ..models.user import ChatUser, Participation
+from ..models.user import Participation
 from ..models.room import Room, RoomVote
+from ..pagination import IdCursorPagination
 from ..permissions import IsCreatorOrReadOnly, IsRoomAdminOrReadOnly
 from ..serializers.room_serializer import DetailListRoomSerializer, CreateRoomSerializer, UpdateRoomSerializer
-from ..serializers.room_votes_serializer import RoomVotesSerializer
 
 
 class RoomList(generics.CreateAPIView, generics.ListAPIView):
     """
     This view is able to display all existing rooms
     or to create a new one.
+
+    Rooms are listed page by page, newest first (see `IdCursorPagination`), and can be filtered
+    by `language` code and by `tag` name. `?ordering=activity` lists only the rooms with comments,
+    the recently commented first, from the room_active_activity index. A room, which gets a comment
+    while the pages are walked, moves to the top and can be seen twice or skipped.
+
+    `fields` parameter narrows every room down to the given comma separated fields,
+    e.g. `?fields=id,title,first_team_name,second_team_name,first_team_votes,second_team_votes,tags`.
+    Only the columns and the relations needed for these fields are fetched.
     # TODO: extend the documentation, describe the accepted parameters and behaviour
     """
     permission_classes = [IsAuthenticatedOrReadOnly]
     serializer_class = DetailListRoomSerializer
+    pagination_class = IdCursorPagination
+
+    ROOM_FIELDS = ["id"] + Room.MODIFIABLE_FIELD + Room.UNMODIFIABLE_FIELDS
+    ORDERINGS = {
+        "newest": ("-id",),
+        "activity": ("-last_comment_at", "-id"),
+    }
+
+    def get_pagination_ordering(self):
+        ordering = self.request.query_params.get("ordering", "newest")
+        if ordering not in self.ORDERINGS:
+            raise ValidationError(f"Rooms can be ordered by: {', '.join(self.ORDERINGS)}")
+        return self.ORDERINGS[ordering]
+
+    def get_requested_fields(self) -> Optional[List[str]]:
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown_fields = set(fields) - set(self.ROOM_FIELDS)
+        if unknown_fields:
+            raise ValidationError(f"Unknown room fields: {', '.join(sorted(unknown_fields))}")
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        return super().get_serializer(*args, fields=self.get_requested_fields(), **kwargs)
 
     def get_queryset(self):
-        queryset = Room.objects.filter(is_active=True)
+        fields = self.get_requested_fields()
+        ordering = self.get_pagination_ordering()
+        queryset = Room.objects.filter(is_active=True).with_votes()
+        if fields is None:
+            queryset = queryset.with_relations()
+        else:
+            # The pagination reads the ordering fields of the last room
+            queryset = queryset.only_fields([*fields, *(field.lstrip("-") for field in ordering)])
         filter_values = self.request.query_params.get("filter", None)
         if filter_values == "my":
             # TODO: refactor to use only filter argument without participation
             #   e.g. queryset.filter(participation__chatuser_id=self.request.user.id)
             participation = (Participation.objects
-                             .filter(chatuser_id=self.request.user.id)
+                             .filter(chatuser_id=get_membership(self.request).chat_user_id)
                              .values_list("room_id", flat=True))
             queryset = queryset.filter(id__in=participation)
+
+        language = self.request.query_params.get("language")
+        if language:
+            queryset = queryset.filter(language=language)
+        tag = self.request.query_params.get("tag")
+        if tag:
+            # Tag names are unique, so the join cannot duplicate the rooms
+            queryset = queryset.filter(tags__name=tag)
+        if "-last_comment_at" in ordering:
+            queryset = queryset.filter(last_comment_at__isnull=False)
         return queryset
 
     def post(self, request, *args, **kwargs):
-        callee_user = ChatUser.objects.get(user=request.user)
+        callee_user = get_membership(request).get_chat_user()
         serializer = CreateRoomSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         room = serializer.save(creator=callee_user)
@@ -43,19 +99,23 @@ class RoomList(generics.CreateAPIView, generics.ListAPIView):
         return Response(room.id, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class RoomDetail(ModelDetailView):
+class RoomDetail(RoomMembershipMixin, ModelDetailView):
     """
     This view is able to display, update and delete a single room.
     # TODO: extend the documentation. Describe all permissions.
     """
     permission_classes = [IsAuthenticatedOrReadOnly & (IsCreatorOrReadOnly | IsRoomAdminOrReadOnly)]
-    queryset = Room.objects.all()
+    queryset = Room.objects.with_relations()
 
     update_serializer_class = UpdateRoomSerializer
     detail_serializer_class = DetailListRoomSerializer
 
+    def get_queryset(self):
+        # The shards setting is read per request
+        return super().get_queryset().with_votes()
+
 
-class RoomVoteTeam(GenericAPIView):
+class RoomVoteTeam(RoomMembershipMixin, GenericAPIView):
     """
     View to let users vote for a team in a room
 
@@ -74,71 +134,30 @@ class RoomVoteTeam(GenericAPIView):
     If a user decides to change their mind and vote for another team or to revoke a vote,
     RoomVotes object created is modified and remains the only one for a combination user-room
 
+    The vote and the counters are changed atomically by `RoomVote.cast`, so concurrent voters don't lose updates.
+
     # TODO: make a script, which would periodically clean RoomVotes objects with a 0 value,
         which in fact means no vote at all and can be safely removed
-    # TODO: rewrite adding a vote to a room model as an action to a RoomVotes object
     """
     permission_classes = [IsAuthenticatedOrReadOnly]
     queryset = Room.objects.all()
 
-    @staticmethod
-    def _handle_repeating_vote(team_number: int, room: Room, previously_voted_object: RoomVote):
-        if team_number not in (0, 1, 2):
-            raise ValidationError("You can choose either 1 or 2 to vote for a team, or 0 to revoke the vote")
-
-        if previously_voted_object.team_number == 0:
-            if team_number == 1:
-                room.first_team_votes += 1
-            elif team_number == 2:
-                room.second_team_votes += 1
-        elif previously_voted_object.team_number == 1:
-            room.first_team_votes -= 1
-            if team_number == 2:
-                room.second_team_votes += 1
-        elif previously_voted_object.team_number == 2:
-            room.second_team_votes -= 1
-            if team_number == 1:
-                room.first_team_votes += 1
-        room.save()
-        previously_voted_object.team_number = team_number
-        previously_voted_object.save()
-
     def post(self, request, pk):
         room = self.get_object()
         if not room.is_active:
             return Response("You cannot vote in an inactive room", status=status.HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS)
-        user = request.user
 
         team_number = TeamNumber.get_team_number_from_data(request.data)
+        if team_number not in (0, *TeamNumber.values):
+            raise ValidationError("You can choose either 1 or 2 to vote for a team, or 0 to revoke the vote")
 
-        previously_voted = RoomVote.objects.filter(voter=ChatUser.objects.get(user=user), room=room)
-
-        already_voted_for_team = previously_voted.filter(team_number=team_number).exists()
-        if already_voted_for_team:
+        voter_id = self.membership.for_room(room).chat_user_id
+        if not RoomVote.cast(room.id, voter_id, team_number):
             return Response("You have already voted for this team", status=status.HTTP_406_NOT_ACCEPTABLE)
-
-        previously_voted_object = previously_voted.first()
-        if previously_voted.exists():
-            RoomVoteTeam._handle_repeating_vote(team_number, room, previously_voted_object)
-        else:
-            serializer = RoomVotesSerializer(data=dict(voter=user.id, room=room.id, team_number=team_number))
-            serializer.is_valid(raise_exception=True)
-            if team_number == 1:
-                room.first_team_votes += 1
-            elif team_number == 2:
-                room.second_team_votes += 1
-            else:
-                return Response(
-                    "You are voting for the first time, specify the team",
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            serializer.save()
-            room.save()
-
         return Response(status=status.HTTP_202_ACCEPTED)
 
 
-class RoomDeactivate(GenericAPIView):
+class RoomDeactivate(RoomMembershipMixin, GenericAPIView):
     """
     View to set the room into the deactivated state.
     Only a room creator can do that.
@@ -150,4 +169,5 @@ class RoomDeactivate(GenericAPIView):
         room = self.get_object()
         room.is_active = False
         room.save()
+        publish_room_control(room.id, RoomControlAction.DEACTIVATE)
         return Response(status=status.HTTP_202_ACCEPTED)
@@ -6,6 +6,9 @@ import {DummyMenu, RoomDropdownMenu} from "./Dropdown";
 import Comments from "./Comments";
 import ReconnectingWebSocket from "reconnecting-websocket";
 
+// Should stay well below SRACHAT_OUTBOUND_WINDOW of the backend
+const ACK_EVERY_FRAMES = 10;
+
 
 class Room extends Component {
     constructor(props) {
@@ -76,9 +79,19 @@ class Room extends Component {
     constructWebSocket(loadMessagesOnConnect:boolean=true) {
         const ws_scheme = window.location.protocol === "https:" ? "wss" : "ws";
         const ws = new ReconnectingWebSocket(`${ws_scheme}://${window.location.host}/ws${this.roomUrl}`);
-        ws.onopen = () => { console.log("Parsing messages") }
+        // Frames received on the current connection, acknowledged to the server every ACK_EVERY_FRAMES,
+        // so it doesn't buffer more than its window of frames for a client, which doesn't keep up
+        let received = 0;
+        ws.onopen = () => {
+            received = 0;
+            console.log("Parsing messages");
+        }
         ws.onmessage = event => {
             const data = JSON.parse(event.data);
+            received += 1;
+            if (received % ACK_EVERY_FRAMES === 0) {
+                ws.send(JSON.stringify({"type": "ack", "data": {"received": received}}));
+            }
             if (data.type === "error") {
                 alert(data.error_message)
             } else if (data.type === "new_message") {
@@ -1 +1,3 @@
-python3 manage.py loaddata srachat/fixtures/initial_*.yaml
\ No newline at end of file
+python3 manage.py loaddata srachat/fixtures/initial_*.yaml
+# Fixtures are loaded without the room counters being maintained
+python3 manage.py recount_room_activity